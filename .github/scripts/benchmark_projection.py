@@ -0,0 +1,210 @@
+"""Benchmark and check `spec_utils.proj_mat_compute` against its loop-based original.
+
+The 000055 spectral pipeline projects every participant's electrodes onto the
+head grid and the AAL regions with `proj_mat_compute`. Its Gaussian weights
+used to be computed one electrode at a time, and normalized one grid point
+and one region at a time, in Python loops; they are now computed with array
+operations. This script keeps the loop-based original as a reference, runs
+both on the same random electrode layouts (drawn from inside the brain of
+the shipped ``headGrid.mat``), and reports the time each takes and the
+largest difference between their matrices. It fails if the matrices differ
+beyond floating-point rounding.
+
+Usage:
+    python benchmark_projection.py --electrodes 100 --repeat 3
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy.io import loadmat
+
+PETERSON21 = Path(__file__).resolve().parents[2] / "000055" / "BruntonLab" / "peterson21"
+sys.path.insert(0, str(PETERSON21))
+
+import spec_utils  # noqa: E402
+
+HGRID_FID = PETERSON21 / "headGrid.mat"
+AAL_FID = PETERSON21 / "aal_rois.mat"
+
+
+# -- the original, loop-based implementation ---------------------------------
+
+
+def _reference_projection_matrix(elec_locs, headGrid, projectionParameter,
+                                 regionOfInterestCube=None):
+    if regionOfInterestCube is None:
+        regionOfInterestCube = headGrid["insideBrainCube"].copy()
+
+    sd_est_err_pow2 = projectionParameter["sd_est_elecloc"] ** 2
+    n_pnts_roi = regionOfInterestCube.sum()
+    n_elecs = elec_locs.shape[0]
+    projectionMatrix = np.zeros((n_elecs, n_pnts_roi))
+    totalDipoleDensity = np.zeros((n_pnts_roi))
+    gaussianWeightMatrix = np.zeros((n_elecs, n_pnts_roi))
+    dist_elec_gridlocs = np.zeros((n_elecs, n_pnts_roi))
+
+    if headGrid["xCube"].shape[0] > headGrid["xCube"].shape[2]:
+        regionOfInterestCube = np.swapaxes(regionOfInterestCube, 0, 2)
+        for cube in ("xCube", "yCube", "zCube", "insideBrainCube"):
+            headGrid[cube] = np.swapaxes(headGrid[cube], 0, 2)
+
+    gridPosition = np.vstack(
+        (
+            headGrid["xCube"][regionOfInterestCube],
+            headGrid["yCube"][regionOfInterestCube],
+            headGrid["zCube"][regionOfInterestCube],
+        )
+    ).T
+
+    if projectionParameter["normalizeInBrainDipoleDenisty"]:
+        unnormalized = dict(projectionParameter, normalizeInBrainDipoleDenisty=False)
+        _, _, weights = _reference_projection_matrix(
+            elec_locs, headGrid, unnormalized, headGrid["insideBrainCube"]
+        )
+        dipoleInBrainDensityNormalizationFactor = np.ones((weights.shape[0])) / weights.sum(1)
+
+    for dipoleNumber in range(n_elecs):
+        dist_elec_gridlocs[dipoleNumber, :] = (
+            np.sum(
+                (gridPosition - np.tile(elec_locs[dipoleNumber, :], [gridPosition.shape[0], 1]))
+                ** 2,
+                1,
+            )
+            ** 0.5
+        )
+        normalizationFactor = 1 / (
+            projectionParameter["sd_est_elecloc"] ** 3 * np.sqrt(8 * (np.pi ** 3))
+        )
+        gaussianWeightMatrix[dipoleNumber, :] = normalizationFactor * np.exp(
+            -dist_elec_gridlocs[dipoleNumber, :] ** 2 / (2 * sd_est_err_pow2)
+        )
+        gaussianWeightMatrix[
+            dipoleNumber,
+            dist_elec_gridlocs[dipoleNumber, :]
+            > projectionParameter["n_sd_trunc_gaussian"] * projectionParameter["sd_est_elecloc"],
+        ] = 0
+        if projectionParameter["normalizeInBrainDipoleDenisty"]:
+            gaussianWeightMatrix[dipoleNumber, :] = (
+                gaussianWeightMatrix[dipoleNumber, :]
+                * dipoleInBrainDensityNormalizationFactor[dipoleNumber]
+            )
+
+    for gridId in range(gaussianWeightMatrix.shape[1]):
+        totalDipoleDensity[gridId] = np.sum(gaussianWeightMatrix[:, gridId])
+        if totalDipoleDensity[gridId] > 0:
+            projectionMatrix[:, gridId] = gaussianWeightMatrix[:, gridId] / totalDipoleDensity[gridId]
+
+    return projectionMatrix, totalDipoleDensity, gaussianWeightMatrix
+
+
+def reference_proj_mat_compute(elec_locs, hgrid_fid, fwhm=20, bad_chans=[], aal_fid=None):
+    headGrid_in = loadmat(hgrid_fid, matlab_compatible=True)["headGrid"][0, 0]
+    sd_est_elecloc = fwhm / 2.355
+    proj_param = {
+        "sd_est_elecloc": sd_est_elecloc,
+        "n_sd_trunc_gaussian": 10 * sd_est_elecloc,
+        "normalizeInBrainDipoleDenisty": True,
+    }
+    _, totalDipoleDensity, gaussianWeightMatrix = _reference_projection_matrix(
+        elec_locs, headGrid_in, proj_param
+    )
+
+    if len(bad_chans) > 0:
+        if len(bad_chans) == 1:
+            bad_chans = bad_chans[0]
+        gaussianWeightMatrix[bad_chans, :] = 0
+        sum_vals = gaussianWeightMatrix.sum(0)
+        for s in range(len(sum_vals)):
+            gaussianWeightMatrix[:, s] = gaussianWeightMatrix[:, s] / sum_vals[s]
+
+    if aal_fid:
+        aal_rois = loadmat(aal_fid, matlab_compatible=True)["aal_rois"]
+        n_rois = aal_rois.shape[1]
+        n_elecs = gaussianWeightMatrix.shape[0]
+        labels = []
+        for i in range(n_rois):
+            aal_rois[0, i]["membershipProbabilityCube"] = np.swapaxes(
+                aal_rois[0, i]["membershipProbabilityCube"], 0, 2
+            )
+            labels.append("".join(aal_rois[0, i]["label"][0]))
+        dipoleProbabilityInRegion = np.zeros((n_elecs, n_rois))
+        for i in range(n_rois):
+            dipoleProbabilityInRegion[:, i] = (
+                gaussianWeightMatrix
+                @ aal_rois[0, i]["membershipProbabilityCube"][headGrid_in["insideBrainCube"]]
+            )
+        dipoleDensityROI = dipoleProbabilityInRegion.sum(0)
+        normdipoleProbabilityInRegion = np.zeros((n_elecs, n_rois))
+        for j in range(n_rois):
+            normdipoleProbabilityInRegion[:, j] = (
+                dipoleProbabilityInRegion[:, j] / dipoleProbabilityInRegion[:, j].sum()
+            )
+        return dipoleDensityROI, normdipoleProbabilityInRegion, labels
+
+    return totalDipoleDensity, gaussianWeightMatrix
+
+
+# -- benchmark ----------------------------------------------------------------
+
+
+def random_layout(n_elecs: int, rng: np.random.Generator) -> np.ndarray:
+    """`n_elecs` electrode locations near random in-brain grid points, left hemisphere."""
+    headGrid = loadmat(HGRID_FID, matlab_compatible=True)["headGrid"][0, 0]
+    inside = headGrid["insideBrainCube"].astype(bool)
+    points = np.vstack(
+        (headGrid["xCube"][inside], headGrid["yCube"][inside], headGrid["zCube"][inside])
+    ).T
+    elec_locs = points[rng.choice(len(points), n_elecs)] + rng.normal(0, 3, (n_elecs, 3))
+    elec_locs[:, 0] = -np.abs(elec_locs[:, 0])
+    return elec_locs
+
+
+def timed(fn, repeat: int):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t0)
+    return min(times), out
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--electrodes", type=int, nargs="+", default=[64, 128])
+    parser.add_argument("--bad", type=int, default=4, help="Bad channels per layout")
+    parser.add_argument("--fwhm", type=float, default=20.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--rtol", type=float, default=1e-12)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print("| electrodes | aal | loops s | vectorized s | speedup | max rel. diff |")
+    print("|---:|---|---:|---:|---:|---:|")
+    ok = True
+    for n_elecs in args.electrodes:
+        elec_locs = random_layout(n_elecs, rng)
+        bad_chans = np.sort(rng.choice(n_elecs, args.bad, replace=False))
+        for aal_fid in (None, AAL_FID):
+            compute = (elec_locs, HGRID_FID, args.fwhm, bad_chans, aal_fid)
+            t_ref, expected = timed(lambda: reference_proj_mat_compute(*compute), args.repeat)
+            t_new, actual = timed(lambda: spec_utils.proj_mat_compute(*compute), args.repeat)
+            diff = max(
+                np.max(np.abs(a - e)) / np.max(np.abs(e))
+                for a, e in zip(actual[:2], expected[:2])
+            )
+            ok &= diff <= args.rtol and (aal_fid is None or actual[2] == expected[2])
+            print(f"| {n_elecs} | {'yes' if aal_fid else 'no'} | {t_ref:.3f} | {t_new:.3f} "
+                  f"| {t_ref / t_new:.1f}x | {diff:.1e} |")
+    if not ok:
+        print(f"vectorized matrices differ from the reference by more than {args.rtol:g}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,346 @@
+"""Benchmark the NWB streaming backends against a local HTTP server.
+
+Serves one HDF5/NWB file from a local, Range-capable HTTP server that sleeps
+`--latency` ms before answering each request (a stand-in for the round trip
+to S3), then, for every backend of `utils_001075.open_nwb`, measures
+
+    open      open the file and `io.read()` the NWBFile
+    walk      visit every group and dataset and read all their attributes
+    seq       read `--seq-mb` MB of the dataset front to back, one chunk row
+              of the first axis at a time
+    random    read `--random-reads` chunk rows at random offsets
+
+recording wall time, HTTP requests and bytes served for each phase. The
+file's size and ETag are passed to `open_nwb` as a resolver lookup would
+give them, so remfile reads go through the `BlockPrefetcher` the DANDI
+helpers use rather than a bare `remfile.File`. Each
+backend runs `--repeat` times from a cold start (no cache directory); the
+median run is reported. A backend that cannot run here (not installed, or
+h5py built without ros3) is reported as skipped rather than failing the run.
+
+Without `--file`, a synthetic NWB file with one chunked TimeSeries is
+written to a temporary directory, so the numbers are comparable across
+library bumps.
+
+Usage:
+    python benchmark_streaming.py --latency 50 --output bench.json
+    python benchmark_streaming.py --file sub-01.nwb --dataset acquisition/ElectricalSeries/data
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# open_nwb lives with the helpers it wraps.
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "001075"))
+
+from utils_001075._open_nwb import BACKENDS, open_nwb  # noqa: E402
+
+
+ETAG = "benchmark"
+
+
+class LatencyServer(ThreadingHTTPServer):
+    """Serves `path` at /<name>, with Range support, injected latency and counters."""
+
+    daemon_threads = True
+
+    def __init__(self, path: Path, latency: float):
+        self.path = Path(path)
+        self.size = self.path.stat().st_size
+        self.latency = latency
+        self.requests = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), _Handler)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/{self.path.name}"
+
+    @property
+    def info(self) -> dict:
+        """The served file as `AssetURLResolver.info` describes an asset."""
+        return {"url": self.url, "s3_url": self.url, "etag": ETAG, "size": self.size}
+
+    def counters(self) -> tuple[int, int]:
+        with self._lock:
+            return self.requests, self.bytes
+
+    def count(self, nbytes: int) -> None:
+        with self._lock:
+            self.requests += 1
+            self.bytes += nbytes
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _range(self) -> tuple[int, int]:
+        size = self.server.size
+        spec = self.headers.get("Range", "")
+        if not spec.startswith("bytes="):
+            return 0, size - 1
+        start, _, end = spec[len("bytes="):].split(",")[0].partition("-")
+        if not start:  # suffix range: the last `end` bytes
+            return max(size - int(end), 0), size - 1
+        return int(start), min(int(end) if end else size - 1, size - 1)
+
+    def _send_headers(self) -> tuple[int, int]:
+        time.sleep(self.server.latency)
+        if self.path.lstrip("/") != self.server.path.name:
+            self.send_error(404)
+            return 0, -1
+        start, end = self._range()
+        partial = "Range" in self.headers
+        self.send_response(206 if partial else 200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{ETAG}"')
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        if partial:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{self.server.size}")
+        self.end_headers()
+        return start, end
+
+    def do_HEAD(self):
+        self._send_headers()
+        self.server.count(0)
+
+    def do_GET(self):
+        start, end = self._send_headers()
+        remaining = end - start + 1
+        with open(self.server.path, "rb") as f:
+            f.seek(start)
+            try:
+                while remaining > 0:
+                    block = f.read(min(remaining, 1 << 20))
+                    if not block:
+                        break
+                    self.wfile.write(block)
+                    remaining -= len(block)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # readers may hang up once they have the bytes they need
+        self.server.count(end - start + 1 - remaining)
+
+
+def write_synthetic_nwb(path: Path) -> str:
+    """A ~48 MB NWB file with one chunked (rows x 60) float64 TimeSeries."""
+    from datetime import datetime, timezone
+
+    import numpy as np
+    from hdmf.backends.hdf5 import H5DataIO
+    from pynwb import NWBHDF5IO, NWBFile, TimeSeries
+
+    nwbfile = NWBFile("benchmark", "benchmark", datetime(2024, 1, 1, tzinfo=timezone.utc))
+    data = np.random.default_rng(0).standard_normal((100_000, 60))
+    nwbfile.add_acquisition(
+        TimeSeries(name="signal", data=H5DataIO(data, chunks=(10_000, 4)), unit="a.u.", rate=30.0)
+    )
+    with NWBHDF5IO(str(path), "w") as io:
+        io.write(nwbfile)
+    return "acquisition/signal/data"
+
+
+def visit(group, fn, prefix: str = "") -> None:
+    """Call fn(path, obj) for every object under `group`, not following links.
+
+    `Group.visititems` is not part of the API lindi implements.
+    """
+    for name in group:
+        if type(group.get(name, getlink=True)).__name__ in ("SoftLink", "ExternalLink"):
+            continue
+        obj = group[name]
+        fn(prefix + name, obj)
+        if hasattr(obj, "keys"):
+            visit(obj, fn, prefix + name + "/")
+
+
+def largest_dataset(file) -> str:
+    sizes = {}
+
+    def size(path, obj):
+        if not hasattr(obj, "keys") and obj.shape:
+            sizes[path] = obj.dtype.itemsize * _count(obj.shape)
+
+    visit(file, size)
+    if not sizes:
+        raise SystemExit("no non-scalar dataset to read in this file")
+    return max(sizes, key=sizes.get)
+
+
+def _count(shape) -> int:
+    n = 1
+    for dim in shape:
+        n *= dim
+    return n
+
+
+def walk(file) -> int:
+    n = 0
+
+    def read_attrs(path, obj):
+        nonlocal n
+        for key in obj.attrs:
+            obj.attrs[key]
+        n += 1
+
+    visit(file, read_attrs)
+    return n
+
+
+def row_step(dataset) -> int:
+    """Rows per read: one chunk row, or ~1 MB for a contiguous dataset."""
+    if dataset.chunks:
+        return dataset.chunks[0]
+    row_bytes = dataset.dtype.itemsize * _count(dataset.shape[1:])
+    return max(1, (1 << 20) // max(row_bytes, 1))
+
+
+def run_once(server: LatencyServer, backend: str, dataset_path: str | None,
+             seq_bytes: int, random_reads: int, seed: int) -> dict:
+    phases = {}
+
+    def phase(name, fn):
+        r0, b0 = server.counters()
+        t0 = time.perf_counter()
+        out = fn()
+        r1, b1 = server.counters()
+        phases[name] = {"seconds": time.perf_counter() - t0, "requests": r1 - r0,
+                        "bytes": b1 - b0}
+        return out
+
+    def open_and_read():
+        io = open_nwb(server.url, backend=backend, info=server.info)
+        io.read()
+        return io
+
+    io = phase("open", open_and_read)
+    try:
+        file = io._file
+        phase("walk", lambda: walk(file))
+        dataset = file[dataset_path or largest_dataset(file)]
+        step = row_step(dataset)
+        n_rows = dataset.shape[0]
+
+        def sequential():
+            read = 0
+            for start in range(0, n_rows, step):
+                if read >= seq_bytes:
+                    break
+                read += dataset[start:start + step].nbytes
+            return read
+
+        def scattered():
+            rng = random.Random(seed)
+            read = 0
+            for _ in range(random_reads):
+                start = rng.randrange(0, max(n_rows - step, 0) + 1)
+                read += dataset[start:start + step].nbytes
+            return read
+
+        for name, fn in (("seq", sequential), ("random", scattered)):
+            read = phase(name, fn)
+            phases[name]["mb_per_s"] = read / 1e6 / phases[name]["seconds"]
+    finally:
+        io.close()
+    return phases
+
+
+def benchmark(server: LatencyServer, backend: str, args) -> dict:
+    runs = []
+    for i in range(args.repeat):
+        try:
+            runs.append(run_once(server, backend, args.dataset, args.seq_mb * 10**6,
+                                 args.random_reads, seed=i))
+        except (ImportError, ValueError, OSError) as e:
+            return {"backend": backend, "skipped": f"{type(e).__name__}: {e}"}
+    total = lambda run: sum(p["seconds"] for p in run.values())  # noqa: E731
+    median = sorted(runs, key=total)[len(runs) // 2]
+    return {
+        "backend": backend,
+        "runs": len(runs),
+        "total_seconds": statistics.median(total(run) for run in runs),
+        "phases": median,
+    }
+
+
+def render(results: list[dict], latency_ms: float) -> str:
+    lines = [
+        f"Streaming backends, {latency_ms:g} ms injected latency (median run)",
+        "",
+        "| backend | open s | walk s | seq MB/s | random MB/s | requests | MB served |",
+        "|---|---:|---:|---:|---:|---:|---:|",
+    ]
+    for r in results:
+        if "skipped" in r:
+            lines.append(f"| {r['backend']} | skipped: {r['skipped']} ||||||")
+            continue
+        p = r["phases"]
+        requests = sum(x["requests"] for x in p.values())
+        served = sum(x["bytes"] for x in p.values()) / 1e6
+        lines.append(
+            f"| {r['backend']} | {p['open']['seconds']:.2f} | {p['walk']['seconds']:.2f} "
+            f"| {p['seq']['mb_per_s']:.1f} | {p['random']['mb_per_s']:.1f} "
+            f"| {requests} | {served:.1f} |"
+        )
+    return "\n".join(lines)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", type=Path,
+                        help="HDF5/NWB file to serve (default: a synthetic NWB file)")
+    parser.add_argument("--dataset",
+                        help="Dataset to read slices of (default: the largest)")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--latency", type=float, default=50.0,
+                        help="Milliseconds slept before answering each request")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seq-mb", type=int, default=16,
+                        help="Megabytes to read sequentially")
+    parser.add_argument("--random-reads", type=int, default=20)
+    parser.add_argument("--output", type=Path, help="Write the results as JSON here")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.file
+        if path is None:
+            path = Path(tmp) / "benchmark.nwb"
+            args.dataset = args.dataset or write_synthetic_nwb(path)
+        server = LatencyServer(path, args.latency / 1000)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            results = []
+            for backend in args.backends:
+                results.append(benchmark(server, backend, args))
+                print(f"{backend}: done", file=sys.stderr, flush=True)
+        finally:
+            server.shutdown()
+
+    report = {
+        "latency_ms": args.latency,
+        "file": str(args.file) if args.file else "synthetic",
+        "file_bytes": server.size,
+        "results": results,
+    }
+    print(render(results, args.latency))
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
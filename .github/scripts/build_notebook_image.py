@@ -7,22 +7,42 @@ every file of that directory (minus notebooks belonging to other groups) plus
 any helper files the install cells fetch via `!curl`/`!wget`, with the pinned
 dependencies preinstalled into the system Python.
 
+Most groups share the bulk of their pins (they are all constrained to Colab's
+versions), so groups are also clustered into a few shared layers: each layer
+holds the pins common to all of its groups, is built once as the Dockerfile's
+`shared` stage, and is published as `<prefix>/shared-layers:<hash>`. A group
+image is then built on top of its layer and only installs its own delta.
+
+The layers are committed in `.github/docker/shared-layers.json` rather than
+recomputed on every build, so one notebook's pin bump changes neither the
+clustering nor the other groups' images. `plan-layers --write` re-clusters
+all groups and rewrites that file; run it when enough has drifted (new
+groups get no layer until then).
+
 Subcommands:
     list-groups [--filter REGEX] [--names-only]
         Print the groups as JSON. `--names-only` emits just the group names,
         suitable for a GitHub Actions matrix.
+    list-layers [--groups FILE] [--names-only]
+        Print the committed shared layers as JSON, optionally only those used
+        by the group names in FILE (a JSON array as printed by list-groups).
+    plan-layers [--write]
+        Print a fresh clustering of all groups into shared layers; with
+        `--write`, replace the committed layers with it.
     prepare --name NAME --context-dir DIR [--image-prefix PREFIX]
-        Write a docker build context (requirements.txt + work/) for one group
-        and emit image name, build hash, default notebook, and the notebook
-        list to $GITHUB_OUTPUT (or stdout when unset).
-
-The pin extraction reuses `find_install_cell` from run_notebook.py, so the
-image contents stay in lockstep with what CI tests. Entries captured by that
+        Write a docker build context (requirements.txt, shared-requirements.txt
+        + work/) for one group and emit image name, build hash, default
+        notebook, the notebook list and its shared layer image to
+        $GITHUB_OUTPUT (or stdout when unset).
+    prepare-layer --name NAME --context-dir DIR [--image-prefix PREFIX]
+        Write the build context for one shared layer (`--target shared`).
+
+The pins come from the shared notebook index (notebook_index.py), which
+parses install cells exactly like `find_install_cell` in run_notebook.py, so
+the image contents stay in lockstep with what CI tests. Entries captured by that
 regex that are not actual pins (it also picks up the literal `form` from the
 `{ display-mode: "form" }` title line) are filtered out: only `pkg==ver` and
 `pkg @ url` requirements are baked into an image.
-
-Assumes `nbformat` is importable.
 """
 
 from __future__ import annotations
@@ -38,15 +58,16 @@ import sys
 from dataclasses import dataclass, field
 from pathlib import Path
 
-import nbformat
-
 sys.path.insert(0, str(Path(__file__).resolve().parent))
-from list_notebooks import REPO_ROOT, is_excluded, load_exclusions  # noqa: E402
-from run_notebook import find_install_cell  # noqa: E402
+from list_notebooks import REPO_ROOT  # noqa: E402
+from notebook_index import IMAGE_INCLUSIONS, load_patterns, scan  # noqa: E402
 
 DOCKERFILE = REPO_ROOT / ".github" / "docker" / "Dockerfile"
+SHARED_LAYERS_FILE = REPO_ROOT / ".github" / "docker" / "shared-layers.json"
 DEFAULT_IMAGE_PREFIX = "ghcr.io/dandi/example-notebooks"
-IMAGE_INCLUSIONS = REPO_ROOT / ".github" / "notebook-image-inclusions.txt"
+SHARED_LAYERS_IMAGE = "shared-layers"
+# Layers smaller than this are not worth an extra image to build and pull.
+MIN_SHARED_PINS = 20
 
 
 def load_image_inclusions() -> list[str]:
@@ -55,13 +76,7 @@ def load_image_inclusions() -> list[str]:
     The container image ships system libraries the slim CI runner lacks, so
     the image pipeline rescues these from the shared test-exclusion list.
     """
-    if not IMAGE_INCLUSIONS.exists():
-        return []
-    return [
-        line.strip()
-        for line in IMAGE_INCLUSIONS.read_text().splitlines()
-        if line.strip() and not line.strip().startswith("#")
-    ]
+    return load_patterns(IMAGE_INCLUSIONS)
 
 
 def slug(s: str) -> str:
@@ -75,6 +90,11 @@ def real_pins(pins: list[str]) -> tuple[list[str], list[str]]:
     return kept, dropped
 
 
+def pin_hash(kept: list[str]) -> str:
+    """Order-independent identity of a pin set (see `real_pins`)."""
+    return hashlib.sha256("\n".join(sorted(kept)).encode()).hexdigest()
+
+
 @dataclass
 class Group:
     directory: str  # repo-relative, e.g. "001550/PaganLab"
@@ -94,26 +114,20 @@ class Group:
 
 
 def collect_groups() -> list[Group]:
-    exclusions = load_exclusions()
-    inclusions = load_image_inclusions()
     groups: dict[tuple[str, str], Group] = {}
-    for path in sorted(REPO_ROOT.rglob("*.ipynb")):
-        if ".ipynb_checkpoints" in path.parts:
-            continue
-        rel = str(path.relative_to(REPO_ROOT))
-        if is_excluded(rel, exclusions) and not is_excluded(rel, inclusions):
+    for entry in scan().values():
+        if entry.test_excluded and not entry.image_included:
             continue
-        nb = nbformat.read(path, as_version=4)
-        try:
-            pins, helpers, _ = find_install_cell(nb)
-        except RuntimeError:
+        if entry.install is None:
             continue  # no Colab bootstrap -> no image
+        pins, helpers, _ = entry.install
+        path = REPO_ROOT / entry.path
         kept, _ = real_pins(pins)
-        pin_hash = hashlib.sha256("\n".join(sorted(kept)).encode()).hexdigest()
+        digest = pin_hash(kept)
         directory = str(path.parent.relative_to(REPO_ROOT))
-        key = (directory, pin_hash)
+        key = (directory, digest)
         group = groups.setdefault(
-            key, Group(directory=directory, pin_hash=pin_hash, pins=sorted(kept))
+            key, Group(directory=directory, pin_hash=digest, pins=sorted(kept))
         )
         group.notebooks.append(path.name)
         for h in helpers:
@@ -135,6 +149,108 @@ def collect_groups() -> list[Group]:
     return result
 
 
+@dataclass
+class SharedLayer:
+    pins: list[str]
+    groups: list[str]  # names of the groups built on this layer
+    name: str = ""
+
+    def __post_init__(self):
+        if not self.name:
+            self.name = f"shared-{self.pin_hash[:12]}"
+
+    @property
+    def pin_hash(self) -> str:
+        return pin_hash(self.pins)
+
+    @property
+    def build_hash(self) -> str:
+        # The layer image also contains the Dockerfile's `system` stage.
+        return hashlib.sha256(self.pin_hash.encode() + DOCKERFILE.read_bytes()).hexdigest()
+
+    def image(self, prefix: str) -> str:
+        return f"{prefix}/{SHARED_LAYERS_IMAGE}:hash-{self.build_hash[:12]}"
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "pin_hash": self.pin_hash,
+            "n_pins": len(self.pins),
+            "groups": sorted(self.groups),
+        }
+
+
+def load_shared_layers() -> list[SharedLayer]:
+    """The committed shared layers (see `plan-layers`)."""
+    try:
+        data = json.loads(SHARED_LAYERS_FILE.read_text())
+    except FileNotFoundError:
+        return []
+    return [
+        SharedLayer(pins=layer["pins"], groups=layer["groups"], name=layer["name"])
+        for layer in data["layers"]
+    ]
+
+
+def write_shared_layers(layers: list[SharedLayer]) -> None:
+    SHARED_LAYERS_FILE.write_text(json.dumps({
+        "layers": [
+            {"name": layer.name, "groups": sorted(layer.groups), "pins": layer.pins}
+            for layer in layers
+        ],
+    }, indent=1) + "\n")
+
+
+def plan_shared_layers(groups: list[Group]) -> list[SharedLayer]:
+    """Cluster groups so pins common to a cluster are installed once.
+
+    Greedy agglomerative clustering on installs saved: a cluster of n groups
+    sharing k pins saves (n - 1) * k pin installs. Starting from singletons,
+    the pair of clusters whose merge saves the most is merged until no merge
+    saves anything. Always computed over every group, so a group's layer does
+    not depend on which groups a build selects. Builds use the committed
+    result (`load_shared_layers`), not this, so they stay stable.
+    """
+    clusters = [([g.name], set(g.pins)) for g in sorted(groups, key=lambda g: g.name)]
+
+    def saved(names: list[str], pins: set[str]) -> int:
+        return (len(names) - 1) * len(pins)
+
+    while True:
+        best = None
+        for i in range(len(clusters)):
+            for j in range(i + 1, len(clusters)):
+                (names_i, pins_i), (names_j, pins_j) = clusters[i], clusters[j]
+                shared = pins_i & pins_j
+                gain = (saved(names_i + names_j, shared)
+                        - saved(names_i, pins_i) - saved(names_j, pins_j))
+                if best is None or gain > best[0]:
+                    best = (gain, i, j, shared)
+        if best is None or best[0] <= 0:
+            break
+        _, i, j, shared = best
+        clusters[i] = (clusters[i][0] + clusters[j][0], shared)
+        del clusters[j]
+
+    return sorted(
+        (SharedLayer(pins=sorted(pins), groups=names)
+         for names, pins in clusters
+         if len(names) > 1 and len(pins) >= MIN_SHARED_PINS),
+        key=lambda layer: layer.name,
+    )
+
+
+def shared_layer_for(group: Group, layers: list[SharedLayer]) -> SharedLayer | None:
+    """The group's committed layer, unless the group has since dropped or bumped
+    one of its pins (the image would then hold packages the group does not pin)."""
+    layer = next((layer for layer in layers if group.name in layer.groups), None)
+    if layer is not None and not set(layer.pins) <= set(group.pins):
+        print(f"warning: {group.name} no longer has all pins of {layer.name}; building "
+              "without it (run plan-layers --write to re-cluster)", file=sys.stderr)
+        return None
+    return layer
+
+
 def matches(group: Group, pattern: str) -> bool:
     if not pattern:
         return True
@@ -149,6 +265,7 @@ INFRA_PREFIXES = (
     ".github/docker/",
     ".github/scripts/build_notebook_image.py",
     ".github/scripts/run_notebook.py",
+    ".github/scripts/notebook_index.py",
     ".github/workflows/build-notebook-images.yml",
     ".github/notebook-test-exclusions.txt",
     ".github/notebook-image-inclusions.txt",
@@ -181,12 +298,61 @@ def cmd_list_groups(args: argparse.Namespace) -> int:
     return 0
 
 
+def cmd_list_layers(args: argparse.Namespace) -> int:
+    layers = load_shared_layers()
+    if args.groups:
+        wanted = set(json.loads(Path(args.groups).read_text()))
+        layers = [layer for layer in layers if wanted & set(layer.groups)]
+    if args.names_only:
+        print(json.dumps([layer.name for layer in layers]))
+    else:
+        print(json.dumps([layer.as_dict() for layer in layers], indent=2))
+    return 0
+
+
+def cmd_plan_layers(args: argparse.Namespace) -> int:
+    layers = plan_shared_layers(collect_groups())
+    if args.write:
+        write_shared_layers(layers)
+    print(json.dumps([layer.as_dict() for layer in layers], indent=2))
+    return 0
+
+
+def write_outputs(outputs: dict) -> None:
+    github_output = os.environ.get("GITHUB_OUTPUT")
+    if github_output:
+        with open(github_output, "a") as f:
+            for k, v in outputs.items():
+                f.write(f"{k}={v}\n")
+    print(json.dumps(outputs, indent=2))
+
+
+def cmd_prepare_layer(args: argparse.Namespace) -> int:
+    layers = [layer for layer in load_shared_layers() if layer.name == args.name]
+    if not layers:
+        print(f"error: no shared layer named {args.name!r}", file=sys.stderr)
+        return 1
+    layer = layers[0]
+    context = Path(args.context_dir)
+    if context.exists():
+        shutil.rmtree(context)
+    context.mkdir(parents=True)
+    (context / "shared-requirements.txt").write_text("\n".join(layer.pins) + "\n")
+    write_outputs({
+        "image": layer.image(args.image_prefix),
+        "context_dir": str(context),
+    })
+    return 0
+
+
 def cmd_prepare(args: argparse.Namespace) -> int:
-    groups = [g for g in collect_groups() if g.name == args.name]
+    all_groups = collect_groups()
+    groups = [g for g in all_groups if g.name == args.name]
     if not groups:
         print(f"error: no group named {args.name!r}", file=sys.stderr)
         return 1
     group = groups[0]
+    layer = shared_layer_for(group, load_shared_layers())
 
     context = Path(args.context_dir)
     if context.exists():
@@ -210,7 +376,14 @@ def cmd_prepare(args: argparse.Namespace) -> int:
 
     shutil.copytree(src_dir, work, ignore=ignore)
 
+    # requirements.txt stays the full pin set: the final stage installs it
+    # jointly with ipykernel, so only the delta over the layer is downloaded
+    # but the resolution is still checked as a whole.
     (context / "requirements.txt").write_text("\n".join(group.pins) + "\n")
+    shared_pins = layer.pins if layer else []
+    (context / "shared-requirements.txt").write_text(
+        "".join(f"{pin}\n" for pin in shared_pins)
+    )
 
     # Bake helper files the same way run_notebook.py fetches them in CI.
     for h in group.helpers:
@@ -233,6 +406,10 @@ def cmd_prepare(args: argparse.Namespace) -> int:
         h.update(helper.encode() + b"\n")
     for name in sorted(group.notebooks):
         h.update((REPO_ROOT / group.directory / name).read_bytes())
+    # The layer enters only through its image tag, itself a hash of the
+    # committed layer definition: other groups' pins never reach this hash.
+    if layer:
+        h.update(b"shared " + layer.image(args.image_prefix).encode() + b"\n")
     h.update(DOCKERFILE.read_bytes())
     build_hash = h.hexdigest()
 
@@ -244,13 +421,9 @@ def cmd_prepare(args: argparse.Namespace) -> int:
         "default_notebook": notebooks[0],
         "notebooks": json.dumps(notebooks),
         "context_dir": str(context),
+        "shared_image": layer.image(args.image_prefix) if layer else "",
     }
-    github_output = os.environ.get("GITHUB_OUTPUT")
-    if github_output:
-        with open(github_output, "a") as f:
-            for k, v in outputs.items():
-                f.write(f"{k}={v}\n")
-    print(json.dumps(outputs, indent=2))
+    write_outputs(outputs)
     return 0
 
 
@@ -268,12 +441,28 @@ def main() -> int:
     )
     p_list.set_defaults(func=cmd_list_groups)
 
+    p_layers = sub.add_parser("list-layers")
+    p_layers.add_argument("--groups", help="JSON file of group names to restrict to")
+    p_layers.add_argument("--names-only", action="store_true")
+    p_layers.set_defaults(func=cmd_list_layers)
+
+    p_plan = sub.add_parser("plan-layers")
+    p_plan.add_argument("--write", action="store_true",
+                        help=f"replace {SHARED_LAYERS_FILE.relative_to(REPO_ROOT)} with the plan")
+    p_plan.set_defaults(func=cmd_plan_layers)
+
     p_prep = sub.add_parser("prepare")
     p_prep.add_argument("--name", required=True)
     p_prep.add_argument("--context-dir", required=True)
     p_prep.add_argument("--image-prefix", default=DEFAULT_IMAGE_PREFIX)
     p_prep.set_defaults(func=cmd_prepare)
 
+    p_prep_layer = sub.add_parser("prepare-layer")
+    p_prep_layer.add_argument("--name", required=True)
+    p_prep_layer.add_argument("--context-dir", required=True)
+    p_prep_layer.add_argument("--image-prefix", default=DEFAULT_IMAGE_PREFIX)
+    p_prep_layer.set_defaults(func=cmd_prepare_layer)
+
     args = parser.parse_args()
     return args.func(args)
 
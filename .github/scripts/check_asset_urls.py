@@ -0,0 +1,101 @@
+"""Check `AssetURLResolver._head` against a local stand-in for the DANDI API and S3.
+
+The API's ``/assets/<id>/download/`` endpoint redirects to an S3 URL presigned
+for GET, and S3 answers a HEAD on such a URL with 403. This script serves both
+from one local HTTP server that behaves the same way (302 from the API path;
+403 on HEAD, Range support on GET at the S3 path) and checks that the
+resolver (the vendored ``dandi_asset_urls.py``, from its 001075 copy) gets the
+S3 URL without its query, the object's size and its ETag. It fails if any
+differs.
+
+Usage:
+    python check_asset_urls.py
+"""
+
+from __future__ import annotations
+
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+# The resolver is vendored; check the 001075 copy, which the others match.
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "001075"))
+
+from utils_001075._asset_urls import AssetURLResolver  # noqa: E402
+
+ASSET_ID = "0123-abcd"
+CONTENT = bytes(range(256)) * 40
+ETAG = "d41d8cd98f00b204e9800998ecf8427e-2"
+S3_PATH = f"/s3/blobs/{ASSET_ID}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, headers: dict, body: bytes = b"") -> None:
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _route(self) -> None:
+        path, _, query = self.path.partition("?")
+        if path == f"/api/assets/{ASSET_ID}/download/":
+            self._send(302, {"Location": f"{S3_PATH}?X-Amz-Signature=abc&X-Amz-Expires=3600"})
+        elif path == S3_PATH and "X-Amz-Signature" in query:
+            if self.command == "HEAD":
+                self._send(403, {})  # signed for GET only
+                return
+            spec = self.headers.get("Range", "")
+            if not spec.startswith("bytes="):
+                self._send(200, {"ETag": f'"{ETAG}"'}, CONTENT)
+                return
+            start, _, end = spec[len("bytes="):].partition("-")
+            start, end = int(start), min(int(end), len(CONTENT) - 1)
+            self._send(206, {"ETag": f'"{ETAG}"',
+                             "Content-Range": f"bytes {start}-{end}/{len(CONTENT)}"},
+                       CONTENT[start:end + 1])
+        else:
+            self._send(404, {})
+
+    do_GET = do_HEAD = _route
+
+
+class _Client:
+    """The part of `DandiAPIClient` that `_head` uses."""
+
+    def __init__(self):
+        self.session = requests.Session()
+
+
+def main() -> int:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        resolver = AssetURLResolver(cache_file=None, manifest=None)
+        resolver._client = _Client()
+        got = resolver._head(f"{base}/api/assets/{ASSET_ID}/download/")
+    finally:
+        server.shutdown()
+
+    expected = {"s3_url": f"{base}{S3_PATH}", "etag": ETAG, "size": len(CONTENT)}
+    ok = got == expected
+    for key, value in expected.items():
+        print(f"{'ok' if got.get(key) == value else 'MISMATCH'} {key}: "
+              f"{got.get(key)!r} (expected {value!r})")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,9 @@
 import datetime
-import fnmatch
 import json
 import os
 import shutil
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional
 
 import requests
@@ -12,29 +12,35 @@ from dandi.dandiapi import DandiAPIClient
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from build_notebook_image import collect_groups  # noqa: E402
+from notebook_index import scan  # noqa: E402
 
 REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
-COLAB_EXCLUSIONS = os.path.join(REPO_ROOT, ".github", "notebook-colab-exclusions.txt")
 IMAGE_PREFIX = "ghcr.io/dandi/example-notebooks"
+METADATA_CACHE = os.environ.get(
+    "DANDI_METADATA_CACHE", os.path.join(REPO_ROOT, ".cache", "dandiset-metadata.json")
+)
+# Bound on concurrent requests to the DANDI API and to GHCR.
+MAX_WORKERS = 8
 
 
-def image_is_public(group_name: str) -> bool:
+def image_is_public(group_name: str, session: Optional[requests.Session] = None) -> bool:
     """True iff the group's image exists on GHCR and is anonymously pullable.
 
     Container packages start private and must be flipped public by hand, so
     the badge is derived from what an anonymous user can actually pull rather
     than from what CI has pushed.
     """
+    http = session or requests
     repo = f"dandi/example-notebooks/{group_name}"
     try:
-        token = requests.get(
+        token = http.get(
             "https://ghcr.io/token", params={"scope": f"repository:{repo}:pull"},
             timeout=10,
         ).json().get("token")
         if not token:
             # No anonymous token grant: the package is private or does not exist.
             return False
-        r = requests.get(
+        r = http.get(
             f"https://ghcr.io/v2/{repo}/manifests/latest",
             headers={
                 "Authorization": f"Bearer {token}",
@@ -51,11 +57,12 @@ def image_is_public(group_name: str) -> bool:
 
 def docker_images_by_notebook() -> Dict[str, str]:
     """Map repo-relative notebook path -> public image ref (only public ones)."""
+    groups = collect_groups()
+    names = sorted({group.name for group in groups})
+    with requests.Session() as session, ThreadPoolExecutor(MAX_WORKERS) as pool:
+        public = dict(zip(names, pool.map(lambda n: image_is_public(n, session), names)))
     mapping: Dict[str, str] = {}
-    public: Dict[str, bool] = {}
-    for group in collect_groups():
-        if group.name not in public:
-            public[group.name] = image_is_public(group.name)
+    for group in groups:
         if not public[group.name]:
             continue
         for nb_name in group.notebooks:
@@ -66,93 +73,120 @@ def docker_images_by_notebook() -> Dict[str, str]:
     return mapping
 
 
-def get_dandiset_metadata(dandiset_id: str) -> Optional[Dict[str, Any]]:
+def load_metadata_cache(path: str = METADATA_CACHE) -> Dict[str, Any]:
+    """Read the on-disk API response cache; a missing or corrupt file is empty."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_metadata_cache(cache: Dict[str, Any], path: str = METADATA_CACHE) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp, path)
+
+
+def cached_api_get(client: DandiAPIClient, path: str, cache: Dict[str, Any]) -> Any:
+    """
+    GET a DANDI API path, revalidating any cached copy instead of refetching it.
+
+    The cached response's ETag and Last-Modified are sent back as
+    If-None-Match / If-Modified-Since; on 304 the cached body is returned, and
+    on 200 the cache entry is replaced.
+
+    Parameters
+    ----------
+    client : DandiAPIClient
+        The shared client; its session pools connections across threads.
+    path : str
+        API path, e.g. ``/dandisets/000004/``.
+    cache : Dict[str, Any]
+        Cache mapping path -> {"etag", "last_modified", "body"}; updated in place.
+
+    Returns
+    -------
+    Any
+        The decoded JSON body.
+    """
+    entry = cache.get(path)
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    r = client.get(path, headers=headers, json_resp=False)
+    if r.status_code == 304 and entry:
+        return entry["body"]
+    body = r.json()
+    cache[path] = {
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+        "body": body,
+    }
+    return body
+
+
+def get_dandiset_metadata(
+    dandiset_id: str,
+    client: Optional[DandiAPIClient] = None,
+    cache: Optional[Dict[str, Any]] = None,
+) -> Optional[Dict[str, Any]]:
     """
     Fetch metadata for a given dandiset ID.
 
+    The version is resolved like ``DandiAPIClient.get_dandiset``: the most
+    recent published version if there is one, otherwise the draft.
+
     Parameters
     ----------
     dandiset_id : str
         The ID of the dandiset to fetch metadata for.
+    client : Optional[DandiAPIClient]
+        A shared client to reuse; a new one is opened when omitted.
+    cache : Optional[Dict[str, Any]]
+        Response cache for `cached_api_get`; a throwaway one when omitted.
 
     Returns
     -------
     Optional[Dict[str, Any]]
         A dictionary containing the dandiset metadata if successful, None otherwise.
     """
-    with DandiAPIClient() as client:
-        try:
-            dandiset = client.get_dandiset(dandiset_id)
-            metadata = dandiset.get_raw_metadata()
-            return metadata
-        except Exception as e:
-            print(f"Error fetching metadata for dandiset {dandiset_id}: {str(e)}")
-            return None
-
-
-def load_exclusion_patterns(path: str) -> List[str]:
-    """Read gitignore-style glob patterns from an exclusion file."""
-    if not os.path.exists(path):
-        return []
-    with open(path) as f:
-        return [
-            line.strip()
-            for line in f
-            if line.strip() and not line.strip().startswith("#")
-        ]
-
-
-def is_excluded(rel_path: str, patterns: List[str]) -> bool:
-    """Match a repo-relative path against gitignore-style patterns."""
-    for pat in patterns:
-        if fnmatch.fnmatch(rel_path, pat):
-            return True
-        if pat.endswith("/**") and (
-            rel_path == pat[:-3] or rel_path.startswith(pat[:-2])
-        ):
-            return True
-    return False
-
-
-def notebook_has_colab_bootstrap(abs_path: str) -> bool:
-    """Return True iff the notebook starts with a Colab-bootstrap install cell."""
+    if client is None:
+        with DandiAPIClient() as client:
+            return get_dandiset_metadata(dandiset_id, client, cache)
+    if cache is None:
+        cache = {}
     try:
-        with open(abs_path) as f:
-            nb = json.load(f)
-    except Exception:
-        return False
-    for cell in nb.get("cells", [])[:8]:
-        if cell.get("cell_type") != "code":
-            continue
-        source = cell.get("source", "")
-        if isinstance(source, list):
-            source = "".join(source)
-        if "uv pip install --system" in source:
-            return True
-    return False
+        info = cached_api_get(client, f"/dandisets/{dandiset_id}/", cache)
+        version = info.get("most_recent_published_version") or info["draft_version"]
+        return cached_api_get(
+            client, f"/dandisets/{dandiset_id}/versions/{version['version']}/", cache
+        )
+    except Exception as e:
+        print(f"Error fetching metadata for dandiset {dandiset_id}: {str(e)}")
+        return None
 
 
 def find_notebooks(folder: str) -> List[str]:
     """
-    Recursively find all Jupyter notebooks in a given folder.
+    Find all Jupyter notebooks under a top-level dandiset folder.
 
     Parameters
     ----------
     folder : str
-        The path to the folder to search in.
+        The repo-relative dandiset folder, e.g. ``"000055"``.
 
     Returns
     -------
     List[str]
-        A list of relative paths to the found notebooks.
+        A list of paths relative to `folder`, from the shared notebook index.
     """
-    notebooks = []
-    for root, _, files in os.walk(folder):
-        for file in files:
-            if file.endswith('.ipynb'):
-                rel_path = os.path.relpath(os.path.join(root, file), folder)
-                notebooks.append(rel_path)
-    return notebooks
+    prefix = folder.rstrip("/") + "/"
+    return [rel[len(prefix):] for rel in scan() if rel.startswith(prefix)]
 
 
 def collect_metadata() -> List[Dict[str, Any]]:
@@ -176,36 +210,41 @@ def collect_metadata() -> List[Dict[str, Any]]:
     notebooks pass headless CI but we still don't want to advertise them
     as one-click-runnable for other reasons.
     """
-    colab_excl = load_exclusion_patterns(COLAB_EXCLUSIONS)
+    index = scan()
     docker_images = docker_images_by_notebook()
 
+    folders = sorted(f for f in os.listdir('.') if os.path.isdir(f) and f.isdigit())
+    cache = load_metadata_cache()
+    with DandiAPIClient() as client, ThreadPoolExecutor(MAX_WORKERS) as pool:
+        all_metadata = list(pool.map(
+            lambda folder: get_dandiset_metadata(folder, client, cache), folders
+        ))
+    save_metadata_cache(cache)
+
     dandisets = []
-    for folder in os.listdir('.'):
-        if os.path.isdir(folder) and folder.isdigit():
-            metadata = get_dandiset_metadata(folder)
-            if metadata:
-                nb_paths = find_notebooks(folder)
-                notebooks = []
-                for rel in nb_paths:
-                    repo_rel = os.path.join(folder, rel)
-                    abs_path = os.path.join(REPO_ROOT, repo_rel)
-                    excluded = is_excluded(repo_rel, colab_excl)
-                    eligible = (not excluded) and notebook_has_colab_bootstrap(abs_path)
-                    notebooks.append({
-                        "path": rel,
-                        "colab_eligible": eligible,
-                        "colab_url": (
-                            f"https://colab.research.google.com/github/"
-                            f"dandi/example-notebooks/blob/master/{repo_rel}"
-                            if eligible else ""
-                        ),
-                        "docker_image": docker_images.get(repo_rel, ""),
-                    })
-                dandisets.append({
-                    'id': folder,
-                    'metadata': metadata,
-                    'notebooks': notebooks,
+    for folder, metadata in zip(folders, all_metadata):
+        if metadata:
+            nb_paths = find_notebooks(folder)
+            notebooks = []
+            for rel in nb_paths:
+                repo_rel = os.path.join(folder, rel)
+                entry = index[repo_rel]
+                eligible = (not entry.colab_excluded) and entry.has_bootstrap
+                notebooks.append({
+                    "path": rel,
+                    "colab_eligible": eligible,
+                    "colab_url": (
+                        f"https://colab.research.google.com/github/"
+                        f"dandi/example-notebooks/blob/master/{repo_rel}"
+                        if eligible else ""
+                    ),
+                    "docker_image": docker_images.get(repo_rel, ""),
                 })
+            dandisets.append({
+                'id': folder,
+                'metadata': metadata,
+                'notebooks': notebooks,
+            })
 
     # newest dandisets first
     dandisets.sort(key=lambda x: x['id'], reverse=True)
@@ -0,0 +1,153 @@
+"""Record and replay the HTTP traffic of a notebook run.
+
+Imported by the prelude run_notebook.py prepends to the converted script when
+`--http-store` is given. It patches `requests.adapters.HTTPAdapter.send`, the
+single choke point under `DandiAPIClient`, `remfile.File` and `lindi`, so
+every DANDI API response and every S3 range request made through `requests`
+is keyed on (method, URL, Range header, request body) and kept in a
+content-addressed store:
+
+    <store>/blobs/<sha256 of body>
+    <store>/index/<sha256 of request key>.json   (status, headers, blob)
+
+Only successful and redirect (2xx/3xx) responses are stored; error responses
+are passed through to the caller unrecorded.
+
+Modes:
+    record   always go to the network, and store what comes back
+    replay   serve hits from the store; misses go to the network and are stored
+    offline  serve hits from the store; a miss raises ConnectionError
+
+Traffic that does not go through `requests` is not captured: fsspec's HTTP
+filesystem (aiohttp), h5py's ros3 driver (libcurl inside HDF5), and `!shell`
+commands all still reach the network, and fail in offline mode.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+
+MODES = ("record", "replay", "offline")
+
+# Headers that describe the stored body rather than the original transfer.
+DROPPED_HEADERS = {"content-encoding", "transfer-encoding", "connection"}
+
+
+def request_key(method: str, url: str, headers, body) -> str:
+    h = hashlib.sha256()
+    h.update(f"{method.upper()} {url}\n".encode())
+    h.update(f"range: {headers.get('Range', '')}\n".encode())
+    if body:
+        h.update(body if isinstance(body, bytes) else str(body).encode())
+    return h.hexdigest()
+
+
+class Store:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.blobs = self.root / "blobs"
+        self.index = self.root / "index"
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self.index.mkdir(parents=True, exist_ok=True)
+
+    def _write(self, path: Path, data: bytes) -> None:
+        # Write-then-rename so concurrent notebook runs sharing a store never
+        # see a torn file.
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+
+    def get(self, key: str) -> tuple[dict, bytes] | None:
+        entry_path = self.index / f"{key}.json"
+        if not entry_path.exists():
+            return None
+        entry = json.loads(entry_path.read_text())
+        blob = self.blobs / entry["blob"]
+        if not blob.exists():
+            return None
+        return entry, blob.read_bytes()
+
+    def put(self, key: str, url: str, status: int, reason: str, headers,
+            body: bytes) -> None:
+        digest = hashlib.sha256(body).hexdigest()
+        blob = self.blobs / digest
+        if not blob.exists():
+            self._write(blob, body)
+        entry = {
+            "url": url,
+            "status": status,
+            "reason": reason,
+            "headers": {k: v for k, v in headers.items()
+                        if k.lower() not in DROPPED_HEADERS},
+            "blob": digest,
+        }
+        self._write(self.index / f"{key}.json", json.dumps(entry).encode())
+
+
+def _response(request, entry: dict, body: bytes):
+    from requests.models import Response
+    from requests.structures import CaseInsensitiveDict
+    from requests.utils import get_encoding_from_headers
+
+    resp = Response()
+    resp.status_code = entry["status"]
+    resp.reason = entry["reason"]
+    resp.headers = CaseInsensitiveDict(entry["headers"])
+    resp.headers["Content-Length"] = str(len(body))
+    resp.encoding = get_encoding_from_headers(resp.headers)
+    resp.url = request.url
+    resp.request = request
+    resp.raw = io.BytesIO(body)
+    resp._content = body
+    resp._content_consumed = True
+    return resp
+
+
+def install(root: str, mode: str = "replay") -> None:
+    """Patch `requests` in this process to record/replay through `root`."""
+    if mode not in MODES:
+        raise ValueError(f"unknown http replay mode {mode!r}; expected one of {MODES}")
+    try:
+        from requests.adapters import HTTPAdapter
+        from requests.exceptions import ConnectionError
+    except ImportError:
+        return  # nothing in this env can make requests-based traffic
+
+    store = Store(Path(root))
+    original_send = HTTPAdapter.send
+    stats = {"hits": 0, "misses": 0}
+
+    def send(self, request, **kwargs):
+        key = request_key(request.method, request.url, request.headers, request.body)
+        if mode != "record":
+            cached = store.get(key)
+            if cached is not None:
+                stats["hits"] += 1
+                return _response(request, *cached)
+            if mode == "offline":
+                raise ConnectionError(
+                    f"http replay (offline): no recording for {request.method} "
+                    f"{request.url} range={request.headers.get('Range')}",
+                    request=request,
+                )
+        stats["misses"] += 1
+        resp = original_send(self, request, **kwargs)
+        if not 200 <= resp.status_code < 400:
+            # Errors (403, 404, 429, 5xx) may be transient or real failures:
+            # pass them through rather than replay them forever.
+            return resp
+        store.put(key, request.url, resp.status_code, resp.reason or "",
+                  resp.headers, resp.content)
+        return resp
+
+    HTTPAdapter.send = send
+
+    import atexit
+    atexit.register(lambda: print(
+        f"::http-replay mode={mode} hits={stats['hits']} misses={stats['misses']}::",
+        flush=True,
+    ))
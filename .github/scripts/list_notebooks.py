@@ -1,8 +1,9 @@
 """List notebooks that should be tested by CI.
 
-Walks all `*.ipynb` in the repo, subtracts entries matching any pattern in
-`.github/notebook-test-exclusions.txt`. Optionally intersects with a list of
-changed files (for the per-PR workflow) supplied on stdin.
+Takes all `*.ipynb` in the repo (walked as in notebook_index.py, without
+reading them), subtracts entries matching any pattern in `.github/notebook-test-exclusions.txt`.
+Optionally intersects with a list of changed files (for the per-PR workflow)
+supplied on stdin.
 
 Output is JSON (an array of paths), suitable for a GitHub Actions matrix.
 
@@ -10,41 +11,32 @@ Usage:
     python .github/scripts/list_notebooks.py [--changed-only]
 
 When `--changed-only` is passed, the script reads newline-separated changed
-file paths from stdin and intersects with the walked set before applying
-exclusions.
+file paths from stdin and keeps the notebooks among them, plus every notebook
+whose directory holds (at any depth) a changed non-notebook file: a helper
+module or data file is part of those notebooks' runs (see
+`run_notebook.execution_key`). Exclusions are applied after that.
 """
 
 from __future__ import annotations
 
 import argparse
-import fnmatch
 import json
 import sys
 from pathlib import Path
 
-REPO_ROOT = Path(__file__).resolve().parents[2]
-EXCLUSIONS_FILE = REPO_ROOT / ".github" / "notebook-test-exclusions.txt"
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+# REPO_ROOT and is_excluded are re-exported for the sibling scripts.
+from notebook_index import (  # noqa: E402
+    REPO_ROOT,
+    TEST_EXCLUSIONS as EXCLUSIONS_FILE,
+    is_excluded,
+    load_patterns,
+    walk_notebooks,
+)
 
 
 def load_exclusions() -> list[str]:
-    if not EXCLUSIONS_FILE.exists():
-        return []
-    return [
-        line.strip()
-        for line in EXCLUSIONS_FILE.read_text().splitlines()
-        if line.strip() and not line.strip().startswith("#")
-    ]
-
-
-def is_excluded(path: str, patterns: list[str]) -> bool:
-    for pat in patterns:
-        if fnmatch.fnmatch(path, pat):
-            return True
-        # Also support /** style matches by stripping the trailing /** and
-        # checking prefix
-        if pat.endswith("/**") and (path == pat[:-3] or path.startswith(pat[:-2])):
-            return True
-    return False
+    return load_patterns(EXCLUSIONS_FILE)
 
 
 def main() -> None:
@@ -53,26 +45,26 @@ def main() -> None:
         "--changed-only",
         action="store_true",
         help="Read newline-separated changed file paths from stdin and "
-             "restrict output to changed files that are also .ipynb",
+             "restrict output to the notebooks they change or sit next to",
     )
     args = parser.parse_args()
 
     exclusions = load_exclusions()
 
     if args.changed_only:
-        candidates = [
-            line.strip()
-            for line in sys.stdin.read().splitlines()
-            if line.strip().endswith(".ipynb")
-        ]
+        changed = [line.strip() for line in sys.stdin.read().splitlines() if line.strip()]
+        candidates = {p for p in changed if p.endswith(".ipynb")}
+        others = [p for p in changed if not p.endswith(".ipynb")]
+        if others:
+            for path in walk_notebooks():
+                nb_dir = path.parent.relative_to(REPO_ROOT).as_posix()
+                # Top-level notebooks would match every file in the repo.
+                if nb_dir != "." and any(p.startswith(nb_dir + "/") for p in others):
+                    candidates.add(path.relative_to(REPO_ROOT).as_posix())
         # Drop paths that no longer exist (deleted in the PR)
-        candidates = [p for p in candidates if (REPO_ROOT / p).exists()]
+        candidates = sorted(p for p in candidates if (REPO_ROOT / p).exists())
     else:
-        candidates = sorted(
-            str(p.relative_to(REPO_ROOT))
-            for p in REPO_ROOT.rglob("*.ipynb")
-            if ".ipynb_checkpoints" not in p.parts
-        )
+        candidates = sorted(str(path.relative_to(REPO_ROOT)) for path in walk_notebooks())
 
     notebooks = [p for p in candidates if not is_excluded(p, exclusions)]
     print(json.dumps(notebooks))
@@ -15,7 +15,16 @@ their pin sets identical, so they are tested against one environment and are
 published together in one container image (see ../docker/README.md).
 
 Usage:
-    python .github/scripts/lock_notebook.py <notebook.ipynb> [...]
+    python .github/scripts/lock_notebook.py <notebook.ipynb> [...] [--jobs N] [--cached]
+
+When several notebooks are given, each distinct resolution (the content of the
+requirements file and every file or local path it pulls in, plus the
+constraint file) is compiled once, independent ones concurrently, and every notebook sharing it
+gets the same pins. By default every run resolves afresh, so new upstream
+releases are picked up. With `--cached`, pins compiled within the last
+`COMPILE_CACHE_TTL` seconds (one day) for the same inputs are reused from
+`.cache/uv-compile/`, e.g. when re-locking many notebooks after an unrelated
+edit; a Colab constraint bump changes every key.
 
 Assumes `uv` is on PATH and `nbformat` is importable.
 """
@@ -23,8 +32,13 @@ Assumes `uv` is on PATH and `nbformat` is importable.
 from __future__ import annotations
 
 import argparse
+import hashlib
+import os
+import shlex
 import subprocess
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import nbformat
@@ -34,6 +48,10 @@ from list_notebooks import REPO_ROOT  # noqa: E402
 from run_notebook import find_install_cell  # noqa: E402
 
 CONSTRAINT = REPO_ROOT / ".github" / "colab-preinstalled.txt"
+COMPILE_CACHE = REPO_ROOT / ".cache" / "uv-compile"
+COMPILE_CACHE_TTL = 24 * 3600
+PYTHON_VERSION = "3.12"
+PYTHON_PLATFORM = "linux"
 
 BADGE = (
     "[![Open In Colab](https://colab.research.google.com/assets/colab-badge.svg)]"
@@ -77,11 +95,83 @@ def requirements_for(nb_path: Path) -> Path:
     )
 
 
-def compile_pins(requirements: Path) -> list[str]:
+def local_inputs(requirements: Path, name: str = "",
+                 seen: set[Path] | None = None) -> list[tuple[str, Path]]:
+    """`requirements` and every file it pulls in: `-r`/`-c` files (recursively)
+    and the files under local paths (`./pkg`, `-e ../lib`, `file:...`).
+
+    Each comes with a name: `-r`/`-c` files by their reference as written,
+    which is the same for identical requirements elsewhere; files of local
+    paths by where they are in the repo, since the compiled pins name them
+    there.
+    """
+    requirements = requirements.resolve()
+    seen = set() if seen is None else seen
+    if requirements in seen:
+        return []
+    seen.add(requirements)
+    inputs = [(name, requirements)]
+    for line in requirements.read_text().splitlines():
+        words = shlex.split(line, comments=True)
+        if not words:
+            continue
+        option, _, value = words[0].partition("=")
+        if option in ("-r", "--requirement", "-c", "--constraint") and (value or len(words) > 1):
+            ref = value or words[1]
+            inputs += local_inputs(requirements.parent / ref, f"{name}>{ref}", seen)
+            continue
+        if option in ("-e", "--editable") and (value or len(words) > 1):
+            target = value or words[1]
+        else:
+            target = words[-1] if "@" in words else words[0]
+        target = target.removeprefix("file://").removeprefix("file:")
+        if not target.startswith((".", "/")):
+            continue  # a package name or a remote URL
+        path = (requirements.parent / target.split("#", 1)[0]).resolve()
+        where = (path.relative_to(REPO_ROOT) if path.is_relative_to(REPO_ROOT)
+                 else path).as_posix()
+        if path.is_file():
+            inputs.append((where, path))
+        elif path.is_dir():
+            inputs += sorted(
+                (f"{where}/{p.relative_to(path).as_posix()}", p)
+                for p in path.rglob("*")
+                if p.is_file() and not any(
+                    part.startswith(".") or part == "__pycache__"
+                    for part in p.relative_to(path).parts
+                )
+            )
+    return inputs
+
+
+def compile_key(requirements: Path) -> str:
+    """Identity of one resolution: the inputs' names and content, constraints,
+    target. Identical requirements files in different directories share a key
+    unless they pull in local paths.
+    """
+    h = hashlib.sha256()
+    for name, path in local_inputs(requirements):
+        h.update(name.encode() + b"\0")
+        h.update(hashlib.sha256(path.read_bytes()).digest())
+    h.update(CONSTRAINT.read_bytes() + b"\0")
+    h.update(f"{PYTHON_VERSION} {PYTHON_PLATFORM}".encode())
+    return h.hexdigest()
+
+
+def compile_pins(requirements: Path, cached: bool = False) -> list[str]:
+    """Pins of `requirements`; with `cached`, reuse a resolution younger than
+    `COMPILE_CACHE_TTL` of the same inputs."""
+    cache_file = COMPILE_CACHE / f"{compile_key(requirements)}.txt"
+    if cached:
+        try:
+            if time.time() - cache_file.stat().st_mtime < COMPILE_CACHE_TTL:
+                return cache_file.read_text().splitlines()
+        except OSError:
+            pass
     cmd = [
         "uv", "pip", "compile", str(requirements),
-        "--python-version", "3.12",
-        "--python-platform", "linux",
+        "--python-version", PYTHON_VERSION,
+        "--python-platform", PYTHON_PLATFORM,
         "--constraint", str(CONSTRAINT),
         "--no-header", "--no-annotate",
     ]
@@ -95,9 +185,31 @@ def compile_pins(requirements: Path) -> list[str]:
     ]
     if not pins:
         raise RuntimeError(f"uv pip compile produced no pins from {requirements}")
+    COMPILE_CACHE.mkdir(parents=True, exist_ok=True)
+    tmp = cache_file.with_name(f".{cache_file.name}.{os.getpid()}.tmp")
+    tmp.write_text("\n".join(pins) + "\n")
+    tmp.replace(cache_file)
     return pins
 
 
+def compile_all(requirements: list[Path], jobs: int,
+                cached: bool = False) -> dict[str, list[str] | Exception]:
+    """Compile each distinct resolution once; map compile_key -> pins or error."""
+    unique: dict[str, Path] = {}
+    for req in requirements:
+        unique.setdefault(compile_key(req), req)
+
+    def one(req: Path) -> list[str] | Exception:
+        try:
+            return compile_pins(req, cached)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        results = pool.map(one, unique.values())
+    return dict(zip(unique, results))
+
+
 def install_cell_source(pins: list[str], helpers: list[str]) -> str:
     lines = [INSTALL_HEADER + "!uv pip install --system \\"]
     lines += [f'    "{pin}" \\' for pin in pins[:-1]]
@@ -106,9 +218,10 @@ def install_cell_source(pins: list[str], helpers: list[str]) -> str:
     return "\n".join(lines)
 
 
-def lock(nb_path: Path) -> None:
+def lock(nb_path: Path, pins: list[str] | None = None) -> None:
     requirements = requirements_for(nb_path)
-    pins = compile_pins(requirements)
+    if pins is None:
+        pins = compile_pins(requirements)
     nb = nbformat.read(nb_path, as_version=4)
 
     try:
@@ -143,11 +256,31 @@ def lock(nb_path: Path) -> None:
 def main() -> int:
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("notebooks", nargs="+", type=Path)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="concurrent `uv pip compile` runs")
+    parser.add_argument("--cached", action="store_true",
+                        help="reuse resolutions of the same inputs from the last "
+                             f"{COMPILE_CACHE_TTL // 3600} hours instead of re-running "
+                             "`uv pip compile`")
     args = parser.parse_args()
     failures = 0
+
+    requirements: dict[Path, Path] = {}
     for nb_path in args.notebooks:
         try:
-            lock(nb_path)
+            requirements[nb_path] = requirements_for(nb_path)
+        except Exception as e:
+            print(f"error: {nb_path}: {e}", file=sys.stderr)
+            failures += 1
+    compiled = compile_all(list(requirements.values()), args.jobs, args.cached)
+    print(f"{len(compiled)} distinct resolution(s) for {len(requirements)} notebook(s)")
+
+    for nb_path, req in requirements.items():
+        try:
+            pins = compiled[compile_key(req)]
+            if isinstance(pins, Exception):
+                raise pins
+            lock(nb_path, pins)
         except Exception as e:
             print(f"error: {nb_path}: {e}", file=sys.stderr)
             failures += 1
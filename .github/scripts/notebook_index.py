@@ -0,0 +1,354 @@
+"""One walk over the repo's notebooks, shared by the CI and site scripts.
+
+`list_notebooks.py`, `build_notebook_image.collect_groups()` and
+`collect_and_render.py` all need the same facts about every `.ipynb`: where
+it is, whether it starts with a Colab-bootstrap install cell (and if so its
+pins, helper lines and cell index), and which exclusion lists match it.
+`scan()` walks the tree once per process and reads each notebook's install
+cell at most once per content change: results are kept in
+`.cache/notebook-index.json`, keyed on each file's git blob SHA, so an
+unchanged notebook is never parsed again, even in a fresh checkout (where
+every mtime is new) given a restored cache file. The SHAs of files git
+tracks unmodified come from one `git ls-files`; others are hashed here.
+
+Exclusion flags are recomputed on every scan (they depend on the pattern
+files, not on the notebook) and written alongside for inspection.
+
+Install cells are read with a streaming decoder that stops once it has the
+install cell, so the cost of a scan depends on the number of notebooks, not
+on the size of the outputs they embed.
+
+Usage:
+    python .github/scripts/notebook_index.py               # refresh and print the index
+    python .github/scripts/notebook_index.py --benchmark N  # vs. json.load, N largest
+"""
+
+from __future__ import annotations
+
+import argparse
+import fnmatch
+import functools
+import hashlib
+import itertools
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+TEST_EXCLUSIONS = REPO_ROOT / ".github" / "notebook-test-exclusions.txt"
+IMAGE_INCLUSIONS = REPO_ROOT / ".github" / "notebook-image-inclusions.txt"
+COLAB_EXCLUSIONS = REPO_ROOT / ".github" / "notebook-colab-exclusions.txt"
+INDEX_FILE = Path(
+    os.environ.get("NOTEBOOK_INDEX", REPO_ROOT / ".cache" / "notebook-index.json")
+)
+# Bump when the cached per-notebook fields change meaning.
+INDEX_VERSION = 2
+PRUNED_DIRS = {".git", ".ipynb_checkpoints"}
+INSTALL_CELL_WINDOW = 8  # the bootstrap cells come first; look no further
+
+
+def install_cell_from_cells(cells) -> tuple[list[str], list[str], int] | None:
+    """Pins, helper lines and index of the Colab-bootstrap install cell.
+
+    The parser behind `run_notebook.find_install_cell`, kept free of nbformat
+    so the listing scripts run on a bare Python. Works on nbformat cells and
+    on plain `json.load`ed ones, whose `source` may still be a list of lines,
+    and on a lazy iterator of cells, which is consumed no further than needed.
+    Returns None when there is no install cell.
+    """
+    for i, cell in enumerate(itertools.islice(cells, INSTALL_CELL_WINDOW)):
+        if cell.get("cell_type") != "code":
+            continue
+        source = cell.get("source", "")
+        if isinstance(source, list):
+            source = "".join(source)
+        if "uv pip install --system" not in source:
+            continue
+        pins = re.findall(r'"([^"]+)"', source)
+        helpers = [
+            line.strip()
+            for line in source.splitlines()
+            if line.strip().startswith(("!curl", "!wget"))
+        ]
+        return pins, helpers, i
+    return None
+
+
+def load_patterns(path: Path) -> list[str]:
+    """Read gitignore-style glob patterns from an exclusion/inclusion file."""
+    if not path.exists():
+        return []
+    return [
+        line.strip()
+        for line in path.read_text().splitlines()
+        if line.strip() and not line.strip().startswith("#")
+    ]
+
+
+def is_excluded(path: str, patterns: list[str]) -> bool:
+    for pat in patterns:
+        if fnmatch.fnmatch(path, pat):
+            return True
+        # Also support /** style matches by stripping the trailing /** and
+        # checking prefix
+        if pat.endswith("/**") and (path == pat[:-3] or path.startswith(pat[:-2])):
+            return True
+    return False
+
+
+@dataclass
+class NotebookEntry:
+    path: str  # repo-relative
+    blob: str  # git blob SHA of the content
+    # (pins, helpers, install-cell index) as from `find_install_cell`, or
+    # None when the notebook has no Colab-bootstrap install cell.
+    install: tuple[list[str], list[str], int] | None
+    test_excluded: bool = False
+    image_included: bool = False
+    colab_excluded: bool = False
+
+    @property
+    def has_bootstrap(self) -> bool:
+        return self.install is not None
+
+
+class _StreamingDecoder:
+    """Decode one JSON value at a time from a text file, reading only as needed.
+
+    Built on `json.JSONDecoder.raw_decode` rather than ijson so the listing
+    scripts keep running on a bare Python. Reads grow geometrically, so a
+    large value costs linear time overall.
+    """
+
+    def __init__(self, f, chunk_size: int = 1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        self.chunk_size *= 2
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError("unexpected end of notebook JSON")
+
+    def take(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"expected {char!r} at offset {self.pos} of notebook JSON")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number that ends the buffer may continue in the next chunk.
+            if (end == len(self.buf) and isinstance(value, (int, float))
+                    and self._fill()):
+                continue
+            self.pos = end
+            return value
+
+
+def iter_cells(f):
+    """Yield a notebook's cells one by one without parsing the rest of the file.
+
+    Top-level values other than `cells` are decoded and dropped as they go by;
+    nbformat writes `cells` first, so normally nothing precedes it.
+    """
+    stream = _StreamingDecoder(f)
+    stream.take("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        key = stream.value()
+        stream.take(":")
+        if key == "cells":
+            stream.take("[")
+            if stream.peek() == "]":
+                return
+            while True:
+                yield stream.value()
+                if stream.peek() == "]":
+                    return
+                stream.take(",")
+        stream.value()
+        if stream.peek() == "}":
+            return
+        stream.take(",")
+
+
+def read_install_cell(path: Path) -> tuple[list[str], list[str], int] | None:
+    """`install_cell_from_cells` on a notebook file, stopping at the install cell.
+
+    Outputs of later cells (often megabytes of base64 images) are never read.
+    """
+    try:
+        with path.open(encoding="utf-8") as f:
+            return install_cell_from_cells(iter_cells(f))
+    except (OSError, ValueError):
+        return None
+
+
+def walk_notebooks(root: Path = REPO_ROOT):
+    """Yield every notebook under `root` once, skipping checkpoints and .git."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in PRUNED_DIRS)
+        for name in sorted(filenames):
+            if name.endswith(".ipynb"):
+                yield Path(dirpath) / name
+
+
+def _git_blobs() -> dict[str, str]:
+    """Repo-relative path -> blob SHA of every notebook git tracks unmodified."""
+    def git(*args: str) -> list[str]:
+        r = subprocess.run(["git", *args, "-z", "--", "*.ipynb"], cwd=REPO_ROOT,
+                           capture_output=True, text=True)
+        return r.stdout.split("\0") if r.returncode == 0 else []
+
+    modified = set(git("diff", "--name-only"))
+    blobs = {}
+    for line in git("ls-files", "--stage"):
+        if line:
+            info, rel = line.split("\t", 1)
+            if rel not in modified:
+                blobs[rel] = info.split()[1]
+    return blobs
+
+
+def blob_sha(path: Path) -> str:
+    """Git blob SHA of the file at `path`, as `git hash-object` computes it."""
+    data = path.read_bytes()
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def _load_index() -> dict[str, dict]:
+    try:
+        data = json.loads(INDEX_FILE.read_text())
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != INDEX_VERSION:
+        return {}
+    return data.get("notebooks", {})
+
+
+def _save_index(entries: dict[str, NotebookEntry]) -> None:
+    INDEX_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = INDEX_FILE.with_name(f".{INDEX_FILE.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps({
+        "version": INDEX_VERSION,
+        "notebooks": {rel: asdict(e) for rel, e in entries.items()},
+    }, indent=1))
+    tmp.replace(INDEX_FILE)
+
+
+@functools.lru_cache(maxsize=None)
+def scan() -> dict[str, NotebookEntry]:
+    """All notebooks in the repo, keyed by sorted repo-relative path."""
+    cached = _load_index()
+    test_excl = load_patterns(TEST_EXCLUSIONS)
+    image_incl = load_patterns(IMAGE_INCLUSIONS)
+    colab_excl = load_patterns(COLAB_EXCLUSIONS)
+
+    blobs = _git_blobs()
+    entries: dict[str, NotebookEntry] = {}
+    for path in walk_notebooks():
+        rel = str(path.relative_to(REPO_ROOT))
+        blob = blobs.get(path.relative_to(REPO_ROOT).as_posix()) or blob_sha(path)
+        old = cached.get(rel)
+        if old and old["blob"] == blob:
+            install = tuple(old["install"]) if old["install"] is not None else None
+        else:
+            install = read_install_cell(path)
+        entries[rel] = NotebookEntry(
+            path=rel,
+            blob=blob,
+            install=install,
+            test_excluded=is_excluded(rel, test_excl),
+            image_included=is_excluded(rel, image_incl),
+            colab_excluded=is_excluded(rel, colab_excl),
+        )
+    entries = dict(sorted(entries.items()))
+    try:
+        _save_index(entries)
+    except OSError as e:
+        # A read-only checkout still works, just without the speedup next time.
+        print(f"warning: could not write {INDEX_FILE}: {e}", file=sys.stderr)
+    return entries
+
+
+def benchmark(n: int) -> int:
+    """Compare `read_install_cell` with a full `json.load` on the n largest notebooks.
+
+    Fails if any result differs; prints time and peak Python memory for both.
+    """
+    paths = sorted(walk_notebooks(), key=lambda p: p.stat().st_size, reverse=True)[:n]
+    mismatches = 0
+    totals = {"full": [0.0, 0], "stream": [0.0, 0]}
+
+    def full(path: Path):
+        with path.open(encoding="utf-8") as f:
+            return install_cell_from_cells(json.load(f).get("cells", []))
+
+    for path in paths:
+        row = {}
+        for name, fn in (("full", full), ("stream", read_install_cell)):
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            result = fn(path)
+            elapsed = time.perf_counter() - t0
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            row[name] = result
+            totals[name][0] += elapsed
+            totals[name][1] = max(totals[name][1], peak)
+            print(f"{name:>6} {elapsed * 1e3:8.1f} ms {peak / 1e6:8.1f} MB  "
+                  f"{path.stat().st_size / 1e6:6.1f} MB {path.relative_to(REPO_ROOT)}")
+        if row["full"] != row["stream"]:
+            mismatches += 1
+            print(f"MISMATCH {path.relative_to(REPO_ROOT)}", file=sys.stderr)
+    for name, (elapsed, peak) in totals.items():
+        print(f"total {name:>6}: {elapsed:.2f} s, peak {peak / 1e6:.1f} MB")
+    return 1 if mismatches else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--benchmark", type=int, metavar="N",
+                        help="check and time streaming extraction on the N largest notebooks")
+    args = parser.parse_args()
+    if args.benchmark:
+        return benchmark(args.benchmark)
+    print(json.dumps({rel: asdict(e) for rel, e in scan().items()}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -16,6 +16,20 @@ status that the workflow can surface in a summary.
 
 Usage:
     python run_notebook.py <notebook-path> --output-dir <dir>
+    python list_notebooks.py | python run_notebook.py --batch - --jobs 8
+
+Batch mode groups the listed notebooks by pin set, installs each distinct set
+once into a cached virtualenv under `--env-cache` (instead of the system
+Python), and runs the notebooks across a process pool, each in a private
+copy of its directory (see `working_copy`); with `--solo-rss-mb`, notebooks
+with a larger memory budget run alone. Per-notebook `result.json` files are
+the same as in single mode.
+
+While a notebook runs, a watchdog samples the RSS, CPU time and open fds of
+its whole process tree and kills it once a budget is exceeded: `--timeout`,
+or the `dandi_ci` budgets in notebook/cell metadata (see `read_budgets`).
+`result.json` then names the offending cell, as it does when the run is
+SIGKILLed from outside (normally the kernel OOM killer).
 
 Assumes `uv` and `nbformat` are already on PATH / importable.
 """
@@ -23,34 +37,35 @@ Assumes `uv` and `nbformat` are already on PATH / importable.
 from __future__ import annotations
 
 import argparse
+import contextlib
 import copy
+import hashlib
 import json
+import os
 import re
+import shutil
+import signal
 import subprocess
 import sys
+import tempfile
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 import nbformat
 
+from notebook_index import install_cell_from_cells
+
 
 def slugify(path: str) -> str:
     return re.sub(r"[^a-zA-Z0-9]+", "_", path).strip("_")
 
 
 def find_install_cell(nb):
-    for i, cell in enumerate(nb.cells[:8]):
-        if cell.cell_type != "code":
-            continue
-        if "uv pip install --system" not in cell.source:
-            continue
-        pins = re.findall(r'"([^"]+)"', cell.source)
-        helpers = [
-            line.strip()
-            for line in cell.source.splitlines()
-            if line.strip().startswith(("!curl", "!wget"))
-        ]
-        return pins, helpers, i
+    found = install_cell_from_cells(nb.cells)
+    if found is not None:
+        return found
     raise RuntimeError(
         "Missing Colab-bootstrap install cell. "
         "CI walks every notebook in the repo and expects each one to begin with a "
@@ -65,27 +80,385 @@ def find_install_cell(nb):
     )
 
 
+def directory_files(nb_dir: Path) -> list[Path]:
+    """Every file under `nb_dir` a notebook there may read, other notebooks aside.
+
+    That is the files git tracks (so helpers the run fetches, and outputs it
+    writes, do not count), or, outside a git checkout, every file not under a
+    hidden or `__pycache__` directory.
+    """
+    r = run(["git", "ls-files", "-z", "--", "."], cwd=str(nb_dir))
+    if r.returncode == 0:
+        files = [nb_dir / name for name in r.stdout.split("\0") if name]
+    else:
+        files = [
+            p for p in nb_dir.rglob("*")
+            if p.is_file() and not any(
+                part.startswith(".") or part == "__pycache__"
+                for part in p.relative_to(nb_dir).parts[:-1]
+            )
+        ]
+    return sorted(p for p in files if p.suffix != ".ipynb" and p.is_file())
+
+
+@contextlib.contextmanager
+def working_copy(nb_dir: Path):
+    """A private copy of `nb_dir` to run a notebook in, removed afterwards.
+
+    Batch workers run the notebooks of one directory concurrently; sharing
+    the directory, they would race on the helpers they download and the
+    files they write. The copy holds everything under `nb_dir` but hidden and
+    `__pycache__` directories, and the directory's siblings are symlinked
+    next to it, so paths into ``..`` still resolve.
+    """
+    nb_dir = nb_dir.resolve()
+    with tempfile.TemporaryDirectory(prefix="notebook-run.") as tmp:
+        work = Path(tmp) / nb_dir.name
+        shutil.copytree(nb_dir, work, symlinks=True,
+                        ignore=shutil.ignore_patterns(".*", "__pycache__"))
+        for sibling in nb_dir.parent.iterdir():
+            if sibling.name != nb_dir.name:
+                (Path(tmp) / sibling.name).symlink_to(sibling)
+        yield work
+
+
+def execution_key(nb, install_idx: int, pins: list[str], helpers: list[str],
+                  nb_dir: Path) -> str:
+    """Content key for a notebook run: the last link of a per-cell hash chain.
+
+    Each code cell's hash covers its own source and the hash of every code
+    cell before it, seeded with the install cell's pins and helper lines,
+    every file under the notebook's directory (helper modules and packages it
+    may import, data it may read; see `directory_files`), this runner and
+    the Python version. Markdown cells and outputs are not part of the key,
+    so prose-only edits keep it stable.
+    """
+    h = hashlib.sha256()
+    h.update(sys.version.encode() + b"\n")
+    scripts_dir = Path(__file__).resolve().parent
+    for runner in (scripts_dir / "run_notebook.py", scripts_dir / "notebook_index.py"):
+        h.update(runner.read_bytes())
+    for entry in sorted(pins) + helpers:
+        h.update(entry.encode() + b"\n")
+    for local in directory_files(nb_dir):
+        h.update(local.relative_to(nb_dir).as_posix().encode() + b"\0")
+        h.update(hashlib.sha256(local.read_bytes()).digest())
+    for i, cell in enumerate(nb.cells):
+        if cell.cell_type != "code" or i == install_idx:
+            continue
+        h = hashlib.sha256(h.digest() + cell.source.encode())
+    return h.hexdigest()
+
+
 def run(cmd, **kw):
     return subprocess.run(cmd, capture_output=True, text=True, **kw)
 
 
-def main() -> int:
-    parser = argparse.ArgumentParser()
-    parser.add_argument("notebook")
-    parser.add_argument("--output-dir", default="/tmp/notebook-test")
-    parser.add_argument("--timeout", type=int, default=3600)
-    args = parser.parse_args()
+# Prepended to the converted script. `_ci_cell` runs at every cell boundary
+# (and at exit) and appends one JSON line per cell to the profile file: a
+# `start` record first, so a cell that never finishes (timeout, OOM kill) is
+# still attributed, then the cell's resource deltas when it ends. Counters are
+# cumulative for the ipython process; `cpu_s` includes reaped `!shell`
+# children. `rchar` counts every read() (files and sockets, so streamed HTTP
+# bytes show up there), `read_bytes` only what came from block storage.
+PROFILE_PRELUDE = """\
+import atexit as _ci_atexit, json as _ci_json, resource as _ci_resource, time as _ci_time
+
+def _ci_snapshot():
+    usage = _ci_resource.getrusage(_ci_resource.RUSAGE_SELF)
+    kids = _ci_resource.getrusage(_ci_resource.RUSAGE_CHILDREN)
+    snap = {{
+        "wall": _ci_time.perf_counter(),
+        "cpu": usage.ru_utime + usage.ru_stime + kids.ru_utime + kids.ru_stime,
+        "maxrss_kb": usage.ru_maxrss,
+        "rchar": None,
+        "read_bytes": None,
+    }}
+    try:
+        with open("/proc/self/io") as f:
+            io = dict(line.split(": ") for line in f.read().splitlines())
+        snap["rchar"], snap["read_bytes"] = int(io["rchar"]), int(io["read_bytes"])
+    except (OSError, KeyError, ValueError):
+        pass
+    return snap
+
+_ci_current = None
+
+def _ci_cell(ordinal, label):
+    global _ci_current
+    now = _ci_snapshot()
+    records = []
+    if _ci_current is not None:
+        prev, start = _ci_current
+        delta = lambda k: None if now[k] is None or start[k] is None else now[k] - start[k]
+        records.append({{
+            "cell": prev, "event": "end",
+            "wall_s": delta("wall"), "cpu_s": delta("cpu"),
+            "peak_rss_delta_kb": delta("maxrss_kb"), "peak_rss_kb": now["maxrss_kb"],
+            "rchar": delta("rchar"), "read_bytes": delta("read_bytes"),
+        }})
+    _ci_current = None
+    if ordinal is not None:
+        records.append({{"cell": ordinal, "event": "start", "label": label,
+                        "t_start": _ci_time.time()}})
+        _ci_current = (ordinal, now)
+    with open({profile_path!r}, "a") as f:
+        for record in records:
+            f.write(_ci_json.dumps(record) + "\\n")
+    if ordinal is not None:
+        print(f"::cell {{label}}::", flush=True)
+
+_ci_atexit.register(_ci_cell, None, None)
+"""
 
-    nb_path = Path(args.notebook)
-    out_dir = Path(args.output_dir)
+# Appended to the prelude when --http-store is given; see http_replay.py.
+HTTP_REPLAY_PRELUDE = """\
+import sys as _ci_sys
+_ci_sys.path.insert(0, {scripts_dir!r})
+import http_replay as _ci_http_replay
+_ci_http_replay.install({store!r}, {mode!r})
+"""
+
+
+def summarize_profile(profile_path: Path, code_cells: list[int], nb,
+                      top_n: int) -> dict:
+    """Fold the prelude's JSON lines into the per-cell table for result.json.
+
+    `code_cells[k]` is the notebook index of the k-th code cell, which is the
+    k-th `# In[...]` block nbconvert emits.
+    """
+    if not profile_path.exists():
+        return {}
+    cells: dict[int, dict] = {}
+    for line in profile_path.read_text().splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue  # torn final line from a killed process
+        entry = cells.setdefault(record["cell"], {"finished": False})
+        if record.pop("event") == "start":
+            entry.update(record)
+        else:
+            entry.update(record, finished=True)
+    table = []
+    for ordinal, entry in sorted(cells.items()):
+        if not entry["finished"] and "t_start" in entry:
+            entry["wall_s"] = time.time() - entry["t_start"]
+        entry.pop("t_start", None)
+        index = code_cells[ordinal] if ordinal < len(code_cells) else None
+        source = nb.cells[index].source.strip() if index is not None else ""
+        row = {
+            "cell": ordinal,
+            "index": index,
+            "label": entry.get("label"),
+            "first_line": source.splitlines()[0][:120] if source else "",
+            "finished": entry["finished"],
+        }
+        for key in ("wall_s", "cpu_s"):
+            if entry.get(key) is not None:
+                row[key] = round(entry[key], 3)
+        for key in ("peak_rss_delta_kb", "peak_rss_kb", "rchar", "read_bytes"):
+            if entry.get(key) is not None:
+                row[key] = entry[key]
+        table.append(row)
+    slowest = sorted(table, key=lambda r: r.get("wall_s", 0), reverse=True)[:top_n]
+    return {
+        "cells": table,
+        "slowest_cells": [
+            {k: r[k] for k in ("cell", "index", "first_line", "wall_s", "finished")
+             if k in r}
+            for r in slowest
+        ],
+    }
+
+
+BUDGET_KEY = "dandi_ci"  # notebook/cell metadata holding resource budgets
+MAX_SAMPLES = 1000
+
+
+def session_usage(sid: int) -> dict | None:
+    """RSS, CPU time, open fds and process count of a whole process session.
+
+    The notebook runs in its own session, so this covers ipython plus any
+    `!shell` children. None where /proc is unavailable.
+    """
+    page = os.sysconf("SC_PAGE_SIZE")
+    ticks = os.sysconf("SC_CLK_TCK")
+    usage = {"rss_mb": 0.0, "cpu_s": 0.0, "fds": 0, "procs": 0}
+    try:
+        pids = [p for p in os.listdir("/proc") if p.isdigit()]
+    except OSError:
+        return None
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                # comm (field 2) may contain spaces; split after its ")".
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[3]) != sid:
+                continue
+            with open(f"/proc/{pid}/statm") as f:
+                usage["rss_mb"] += int(f.read().split()[1]) * page / 2**20
+            usage["cpu_s"] += (int(fields[11]) + int(fields[12])) / ticks
+            usage["fds"] += len(os.listdir(f"/proc/{pid}/fd"))
+            usage["procs"] += 1
+        except (OSError, ValueError, IndexError):
+            continue  # exited between listdir and read, or not ours to inspect
+    return usage
+
+
+def read_budgets(nb, code_cells: list[int], timeout: int) -> tuple[dict, dict]:
+    """Notebook-wide budgets and per-code-cell (by ordinal) overrides.
+
+    Notebook metadata `dandi_ci` may set `timeout_s` and `max_rss_mb` for the
+    whole run and `cell_timeout_s` / `cell_max_rss_mb` as per-cell defaults;
+    a code cell's own `dandi_ci` metadata may set `timeout_s` / `max_rss_mb`
+    for that cell. `--timeout` is the notebook timeout unless overridden.
+    """
+    meta = nb.metadata.get(BUDGET_KEY, {})
+    notebook = {
+        "timeout_s": meta.get("timeout_s", timeout),
+        "max_rss_mb": meta.get("max_rss_mb"),
+    }
+    cells = {}
+    for ordinal, index in enumerate(code_cells):
+        cell_meta = nb.cells[index].metadata.get(BUDGET_KEY, {})
+        cells[ordinal] = {
+            "timeout_s": cell_meta.get("timeout_s", meta.get("cell_timeout_s")),
+            "max_rss_mb": cell_meta.get("max_rss_mb", meta.get("cell_max_rss_mb")),
+        }
+    return notebook, cells
+
+
+class Watchdog(threading.Thread):
+    """Sample the notebook's process session and kill it when over budget.
+
+    The current cell comes from the `start` records the profiling prelude
+    appends to `profile_path`. The first budget violation is kept in
+    `exceeded`; the time series of samples is in `samples`.
+    """
+
+    def __init__(self, proc: subprocess.Popen, profile_path: Path,
+                 budgets: dict, cell_budgets: dict, interval: float):
+        super().__init__(daemon=True)
+        self.proc = proc
+        self.profile_path = profile_path
+        self.budgets = budgets
+        self.cell_budgets = cell_budgets
+        self.interval = interval
+        self.stride = 1
+        self.samples: list[dict] = []
+        self.peak_rss_mb = 0.0
+        self.exceeded: dict | None = None
+        self.current: tuple[int, float] | None = None  # (ordinal, start time)
+        self._done = threading.Event()
+
+    def stop(self) -> None:
+        self._done.set()
+        self.join()
+
+    def _current_cell(self) -> tuple[int, float] | None:
+        try:
+            lines = self.profile_path.read_text().splitlines()
+        except OSError:
+            return self.current
+        for line in reversed(lines):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("event") == "start":
+                return record["cell"], record["t_start"]
+        return self.current
+
+    def _check(self, usage: dict | None, now: float, t0: float) -> dict | None:
+        cell = self.current[0] if self.current else None
+        limits = [("notebook", self.budgets, now - t0)]
+        if self.current:
+            limits.append(("cell", self.cell_budgets.get(cell, {}), now - self.current[1]))
+        for scope, budget, elapsed in limits:
+            if budget.get("timeout_s") and elapsed > budget["timeout_s"]:
+                return {"scope": scope, "budget": "timeout_s",
+                        "limit": budget["timeout_s"], "value": round(elapsed, 1)}
+            if usage and budget.get("max_rss_mb") and usage["rss_mb"] > budget["max_rss_mb"]:
+                return {"scope": scope, "budget": "max_rss_mb",
+                        "limit": budget["max_rss_mb"], "value": round(usage["rss_mb"])}
+        return None
+
+    def run(self) -> None:
+        t0 = time.time()
+        tick = 0
+        while not self._done.wait(self.interval):
+            now = time.time()
+            self.current = self._current_cell()
+            usage = session_usage(self.proc.pid)
+            if usage:
+                self.peak_rss_mb = max(self.peak_rss_mb, usage["rss_mb"])
+                if tick % self.stride == 0:
+                    self.samples.append({
+                        "t_s": round(now - t0, 1),
+                        "cell": self.current[0] if self.current else None,
+                        "rss_mb": round(usage["rss_mb"], 1),
+                        "cpu_s": round(usage["cpu_s"], 1),
+                        "fds": usage["fds"],
+                        "procs": usage["procs"],
+                    })
+                    if len(self.samples) >= MAX_SAMPLES:
+                        # Keep the series bounded over long runs: halve it
+                        # and sample half as often from here on.
+                        self.samples = self.samples[::2]
+                        self.stride *= 2
+                tick += 1
+            self.exceeded = self._check(usage, now, t0)
+            if self.exceeded:
+                self.exceeded["cell"] = self.current[0] if self.current else None
+                try:
+                    os.killpg(self.proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                return
+
+
+def run_notebook(
+    notebook: str,
+    out_dir: Path,
+    timeout: int,
+    env: Path | None = None,
+    stream: bool = True,
+    top_cells: int = 5,
+    cache_dir: Path | None = None,
+    http_store: Path | None = None,
+    http_mode: str = "replay",
+    sample_interval: float = 2.0,
+    run_dir: Path | None = None,
+) -> int:
+    """Run one notebook and write its `<slug>.result.json` into `out_dir`.
+
+    With `env=None` the install cell's pins go into the system Python, as in
+    a single CI job. Otherwise `env` is a prebuilt virtualenv (see
+    `build_env`) that already holds the pins, and the install is skipped.
+    `stream=False` keeps notebook output out of this process's stdout, so
+    concurrent runs in batch mode don't interleave; the log file is kept.
+    The per-cell profile and the `top_cells` slowest cells are recorded in
+    result.json once execution starts, whatever its outcome. With a
+    `cache_dir`, a notebook whose `execution_key` matches an earlier passing
+    run is reported from that run's result without installing or executing.
+    With an `http_store`, the notebook's `requests` traffic is recorded to or
+    replayed from that directory in `http_mode` (see http_replay.py).
+    A `Watchdog` samples the run every `sample_interval` seconds and enforces
+    the budgets from `read_budgets`. Helpers are fetched into, and the
+    notebook runs in, `run_dir` (e.g. a `working_copy`), by default the
+    notebook's own directory.
+    """
+    nb_path = Path(notebook)
     out_dir.mkdir(parents=True, exist_ok=True)
-    slug = slugify(args.notebook)
+    slug = slugify(notebook)
 
     result_path = out_dir / f"{slug}.result.json"
     log_path = out_dir / f"{slug}.log"
     script_path = out_dir / f"{slug}.py"
+    profile_path = out_dir / f"{slug}.cells.jsonl"
 
-    status = {"notebook": args.notebook, "stage": "start", "duration_s": 0}
+    status = {"notebook": notebook, "stage": "start", "duration_s": 0}
     t0 = time.time()
 
     def finalize(stage: str, ok: bool, error: str | None = None, **extra) -> int:
@@ -96,7 +469,8 @@ def main() -> int:
             status["error"] = error[-4000:]
         status.update(extra)
         result_path.write_text(json.dumps(status, indent=2))
-        print(json.dumps(status, indent=2))
+        if stream:
+            print(json.dumps(status, indent=2))
         return 0 if ok else 1
 
     nb = nbformat.read(nb_path, as_version=4)
@@ -107,27 +481,51 @@ def main() -> int:
     except Exception as e:
         return finalize("extract", False, error=str(e))
 
-    log_path.write_text("")
+    nb_dir = nb_path.parent
+    key = execution_key(nb, install_idx, pins, helpers, nb_dir)
+    status["execution_key"] = key
+    cached_path = cache_dir / f"{key}.result.json" if cache_dir else None
+    if cached_path is not None and cached_path.exists():
+        cached = json.loads(cached_path.read_text())
+        status.update({k: v for k, v in cached.items()
+                       if k not in ("notebook", "stage", "ok", "duration_s")})
+        status["cached_from"] = cached["notebook"]
+        status["cached_duration_s"] = cached["duration_s"]
+        return finalize("done", True)
 
-    r = run(
-        ["uv", "pip", "install", "--system",
-         "ipython", "nbconvert", "nbformat", *pins]
-    )
-    with log_path.open("a") as f:
-        f.write(f"=== install rc={r.returncode} ===\n")
-        f.write(f"--- stdout ---\n{r.stdout[-2000:]}\n")
-        f.write(f"--- stderr ---\n{r.stderr[-3000:]}\n")
-    if r.returncode != 0:
-        return finalize("install", False, error=r.stderr[-3000:])
+    log_path.write_text("")
+    run_dir = nb_dir if run_dir is None else run_dir
+
+    if env is None:
+        bin_prefix = ""
+        proc_env = None
+        r = run(
+            ["uv", "pip", "install", "--system",
+             "ipython", "nbconvert", "nbformat", *pins]
+        )
+        with log_path.open("a") as f:
+            f.write(f"=== install rc={r.returncode} ===\n")
+            f.write(f"--- stdout ---\n{r.stdout[-2000:]}\n")
+            f.write(f"--- stderr ---\n{r.stderr[-3000:]}\n")
+        if r.returncode != 0:
+            return finalize("install", False, error=r.stderr[-3000:])
+    else:
+        # `!shell` lines in the notebook resolve `python`/`pip` through PATH,
+        # so the venv has to come first there too, not just for ipython.
+        bin_prefix = f"{env / 'bin'}/"
+        proc_env = dict(os.environ, VIRTUAL_ENV=str(env),
+                        PATH=f"{env / 'bin'}{os.pathsep}{os.environ.get('PATH', '')}")
+        status["env"] = env.name
+        with log_path.open("a") as f:
+            f.write(f"=== install skipped: using shared env {env} ===\n")
 
-    nb_dir = nb_path.parent
     for h in helpers:
         cmd_str = h.lstrip("!").strip()
         m = re.search(r"-o\s+(\S+)", cmd_str)
         if m:
-            target = nb_dir / m.group(1)
+            target = run_dir / m.group(1)
             target.parent.mkdir(parents=True, exist_ok=True)
-        r = run(["bash", "-c", cmd_str], cwd=str(nb_dir))
+        r = run(["bash", "-c", cmd_str], cwd=str(run_dir))
         with log_path.open("a") as f:
             f.write(f"\n=== helper rc={r.returncode}: {cmd_str[:120]} ===\n")
             f.write(f"{r.stderr[-500:]}\n")
@@ -142,63 +540,327 @@ def main() -> int:
     tmp_nb = out_dir / f"{slug}.toexec.ipynb"
     nbformat.write(nb_for_exec, str(tmp_nb))
 
-    r = run(["jupyter", "nbconvert", "--to", "script", "--stdout", str(tmp_nb)])
+    r = run([f"{bin_prefix}jupyter", "nbconvert", "--to", "script", "--stdout", str(tmp_nb)],
+            env=proc_env)
     if r.returncode != 0:
         return finalize("convert", False, error=r.stderr[-3000:])
     raw_script = r.stdout
 
-    # Insert progress markers before each `# In[...]` cell separator so the
-    # CI log shows which cell is running. If the process is killed mid-cell
-    # (eg OOM), the last marker tells you the offending cell.
-    instrumented = []
+    # Insert a profiling/progress hook before each `# In[...]` cell separator
+    # so the CI log shows which cell is running and result.json gets per-cell
+    # resource use. If the process is killed mid-cell (eg OOM), the last
+    # marker and the unfinished profile entry tell you the offending cell.
+    profile_path.unlink(missing_ok=True)
+    instrumented = [PROFILE_PRELUDE.format(profile_path=str(profile_path.resolve()))]
+    if http_store is not None:
+        instrumented.append(HTTP_REPLAY_PRELUDE.format(
+            scripts_dir=str(Path(__file__).resolve().parent),
+            store=str(http_store.resolve()), mode=http_mode,
+        ))
+    ordinal = 0
     for line in raw_script.splitlines(keepends=True):
         m = re.match(r"# In\[(.*?)\]:", line.strip())
         if m:
-            cell_label = m.group(1) or "?"
+            cell_label = m.group(1).strip() or "?"
             instrumented.append(
-                f'import sys as _sys; print("::cell {cell_label}::", flush=True); _sys.stderr.flush()\n'
+                f'import sys as _sys; _ci_cell({ordinal}, "{cell_label}"); _sys.stderr.flush()\n'
             )
+            ordinal += 1
         instrumented.append(line)
     script_path.write_text("".join(instrumented))
 
     # Stream ipython output live to this process's stdout/stderr so CI logs
     # show progress in real time. Tee a copy to the log file via Popen.
     import shlex
-    cmd = ["ipython", "--colors=NoColor", "--no-banner",
+    cmd = [f"{bin_prefix}ipython", "--colors=NoColor", "--no-banner",
            "--InteractiveShell.history_load_length=0", str(script_path)]
-    print(f"\n=== executing notebook (streaming) ===\n  {shlex.join(cmd)}", flush=True)
+    if stream:
+        print(f"\n=== executing notebook (streaming) ===\n  {shlex.join(cmd)}", flush=True)
     log_f = log_path.open("a")
     log_f.write(f"\n=== execute (streaming) ===\n")
     log_f.flush()
+    code_cells = [i for i, c in enumerate(nb_for_exec.cells) if c.cell_type == "code"]
+    budgets, cell_budgets = read_budgets(nb_for_exec, code_cells, timeout)
+    # Own session, so the watchdog can account for and kill the whole tree.
     proc = subprocess.Popen(
-        cmd, cwd=str(nb_dir),
+        cmd, cwd=str(run_dir), env=proc_env,
         stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-        text=True, bufsize=1,
+        text=True, bufsize=1, start_new_session=True,
     )
+    watchdog = Watchdog(proc, profile_path, budgets, cell_budgets, sample_interval)
+    watchdog.start()
+
+    def profile() -> dict:
+        summary = summarize_profile(profile_path, code_cells, nb_for_exec, top_cells)
+        summary["watchdog"] = {
+            "interval_s": sample_interval * watchdog.stride,
+            "budgets": budgets,
+            "peak_rss_mb": round(watchdog.peak_rss_mb, 1),
+            "samples": watchdog.samples,
+        }
+        return summary
+
+    def offending_cell(reason: str, ordinal: int | None) -> dict:
+        index = code_cells[ordinal] if ordinal is not None else None
+        source = nb_for_exec.cells[index].source.strip() if index is not None else ""
+        return {
+            "reason": reason,
+            "cell": ordinal,
+            "index": index,
+            "first_line": source.splitlines()[0][:120] if source else "",
+        }
+
     captured = []
     try:
         for line in proc.stdout:
-            sys.stdout.write(line)
-            sys.stdout.flush()
+            if stream:
+                sys.stdout.write(line)
+                sys.stdout.flush()
             log_f.write(line)
             captured.append(line)
-        proc.wait(timeout=args.timeout)
+        proc.wait(timeout=timeout)
     except subprocess.TimeoutExpired:
-        proc.kill()
+        os.killpg(proc.pid, signal.SIGKILL)
+        watchdog.stop()
         log_f.close()
         return finalize("execute", False,
-                        error=f"hit overall {args.timeout}s timeout")
+                        error=f"hit overall {timeout}s timeout", **profile())
+    watchdog.stop()
     log_f.close()
 
+    if watchdog.exceeded:
+        ex = watchdog.exceeded
+        reason = (f"{ex['scope']} {ex['budget']} budget exceeded: "
+                  f"{ex['value']} > {ex['limit']}")
+        return finalize("execute", False, error=reason,
+                        offending_cell=offending_cell(reason, ex["cell"]), **profile())
+    if proc.returncode == -signal.SIGKILL:
+        # SIGKILL that the watchdog did not send: almost always the kernel's
+        # OOM killer. The cell that was running is the one to blame.
+        reason = (f"killed by SIGKILL (likely the OOM killer) at "
+                  f"{round(watchdog.peak_rss_mb)} MB peak RSS")
+        current = watchdog._current_cell()
+        return finalize("execute", False, error=reason,
+                        offending_cell=offending_cell(reason, current[0] if current else None),
+                        **profile())
+
     full_output = "".join(captured)
+    m = re.search(r"::http-replay mode=(\w+) hits=(\d+) misses=(\d+)::", full_output)
+    if m:
+        status["http_replay"] = {"mode": m.group(1), "hits": int(m.group(2)),
+                                 "misses": int(m.group(3))}
     looks_failed = (
         proc.returncode != 0
         or "Traceback (most recent call last)" in full_output
     )
     if looks_failed:
-        return finalize("execute", False, error=full_output[-3000:])
+        return finalize("execute", False, error=full_output[-3000:], **profile())
+
+    rc = finalize("done", True, **profile())
+    if cached_path is not None:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = cached_path.with_suffix(f".{os.getpid()}.tmp")
+        shutil.copyfile(result_path, tmp)
+        tmp.replace(cached_path)  # atomic: batch workers may share the cache
+    return rc
+
+
+def build_env(pins: list[str], env_root: Path) -> tuple[Path, str | None]:
+    """Create (or reuse) the virtualenv for one pin set.
+
+    Envs are content-addressed by `pin_hash`, so notebooks with identical
+    install cells share one, and a `.complete` marker written after a
+    successful install makes later batch runs skip the install entirely.
+    Returns the env path and an error message (None on success).
+    """
+    # Imported here: build_notebook_image imports this module at top level.
+    from build_notebook_image import pin_hash, real_pins
+
+    kept, _ = real_pins(pins)
+    env = env_root / pin_hash(kept)
+    marker = env / ".complete"
+    if marker.exists():
+        return env, None
+    if env.exists():
+        shutil.rmtree(env)  # leftover from an interrupted install
+    env_root.mkdir(parents=True, exist_ok=True)
+    r = run(["uv", "venv", "--quiet", "--python", sys.executable, str(env)])
+    if r.returncode == 0:
+        r = run(["uv", "pip", "install", "--python", str(env / "bin" / "python"),
+                 "ipython", "nbconvert", "nbformat", *kept])
+    if r.returncode != 0:
+        return env, r.stderr[-3000:]
+    marker.write_text("\n".join(sorted(kept)) + "\n")
+    return env, None
+
+
+def run_in_copy(notebook: str, *args, **kwargs) -> int:
+    """`run_notebook` in a `working_copy` of the notebook's directory."""
+    with working_copy(Path(notebook).parent) as work:
+        return run_notebook(notebook, *args, run_dir=work, **kwargs)
+
+
+def write_failure(notebook: str, out_dir: Path, stage: str, error: str) -> None:
+    result_path = out_dir / f"{slugify(notebook)}.result.json"
+    status = {"notebook": notebook, "stage": stage, "ok": False,
+              "duration_s": 0, "error": error[-4000:]}
+    result_path.write_text(json.dumps(status, indent=2))
+
+
+def rss_budget(nb, timeout: int) -> int:
+    """The most memory a notebook's `read_budgets` let any part of it use, in MB
+    (0 without a memory budget)."""
+    code_cells = [i for i, c in enumerate(nb.cells) if c.cell_type == "code"]
+    budgets, cell_budgets = read_budgets(nb, code_cells, timeout)
+    limits = [budgets["max_rss_mb"], *(c["max_rss_mb"] for c in cell_budgets.values())]
+    return max((limit for limit in limits if limit), default=0)
+
+
+def run_batch(notebooks: list[str], out_dir: Path, timeout: int,
+              env_root: Path, jobs: int, solo_rss_mb: int | None = None,
+              **run_kwargs) -> int:
+    """Run many notebooks, one shared env per distinct pin set.
+
+    Notebooks are grouped by `pin_hash`, the same key
+    `build_notebook_image.collect_groups` uses (minus the directory, since a
+    venv, unlike an image, carries no notebook files). Each env is built once,
+    then its notebooks are fanned out across a process pool as soon as it is
+    ready, each run in its own `working_copy`. Notebooks whose `rss_budget`
+    exceeds `solo_rss_mb` run afterwards, one at a time, so two of them never
+    share the machine's memory. `run_kwargs` are passed on to `run_notebook`.
+    Returns 1 if any notebook failed, else 0.
+
+    Every notebook gets a `pending` failure result up front, which its run
+    replaces; one still there means the batch was killed (e.g. by the job
+    timeout) before reaching it, and is reported rather than missing.
+    """
+    cache_dir = run_kwargs.get("cache_dir")
+    from build_notebook_image import pin_hash, real_pins
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for notebook in notebooks:
+        write_failure(notebook, out_dir, "pending",
+                      "not run: the batch was stopped before this notebook finished")
+    groups: dict[str, tuple[list[str], list[str]]] = {}
+    solo: set[str] = set()
+    failed = 0
+    for notebook in notebooks:
+        nb = nbformat.read(notebook, as_version=4)
+        try:
+            pins, helpers, install_idx = find_install_cell(nb)
+        except Exception as e:
+            write_failure(notebook, out_dir, "extract", str(e))
+            failed += 1
+            continue
+        if cache_dir is not None:
+            key = execution_key(nb, install_idx, pins, helpers, Path(notebook).parent)
+            if (cache_dir / f"{key}.result.json").exists():
+                # Served from the cache without an env; skip the env build.
+                run_notebook(notebook, out_dir, timeout, stream=False, **run_kwargs)
+                print(f"CACHED {notebook}", flush=True)
+                continue
+        if solo_rss_mb is not None and rss_budget(nb, timeout) > solo_rss_mb:
+            solo.add(notebook)
+        kept, _ = real_pins(pins)
+        groups.setdefault(pin_hash(kept), (pins, []))[1].append(notebook)
+    print(f"{len(notebooks)} notebooks in {len(groups)} pin sets, {jobs} workers"
+          + (f", {len(solo)} run alone" if solo else ""), flush=True)
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        builds = {
+            pool.submit(build_env, pins, env_root): members
+            for pins, members in groups.values()
+        }
+        runs = {}
+        solo_runs = []
+        for fut in as_completed(builds):
+            members = builds[fut]
+            env, error = fut.result()
+            if error is not None:
+                print(f"env {env.name[:12]} failed to install; "
+                      f"failing {len(members)} notebook(s)", flush=True)
+                for notebook in members:
+                    write_failure(notebook, out_dir, "install", error)
+                failed += len(members)
+                continue
+            for notebook in members:
+                if notebook in solo:
+                    solo_runs.append((notebook, env))
+                    continue
+                runs[pool.submit(run_in_copy, notebook, out_dir, timeout,
+                                 env=env, stream=False, **run_kwargs)] = notebook
+        for fut in as_completed(runs):
+            rc = fut.result()
+            failed += rc
+            print(f"{'PASS' if rc == 0 else 'FAIL'} {runs[fut]}", flush=True)
+        for notebook, env in solo_runs:
+            rc = pool.submit(run_in_copy, notebook, out_dir, timeout,
+                             env=env, stream=False, **run_kwargs).result()
+            failed += rc
+            print(f"{'PASS' if rc == 0 else 'FAIL'} {notebook} (alone)", flush=True)
+
+    print(f"{len(notebooks) - failed} passed, {failed} failed", flush=True)
+    return 1 if failed else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("notebook", nargs="?")
+    parser.add_argument("--output-dir", default="/tmp/notebook-test")
+    parser.add_argument("--timeout", type=int, default=3600)
+    parser.add_argument(
+        "--batch", metavar="JSON",
+        help="run every notebook in a JSON array (as printed by "
+             "list_notebooks.py; '-' reads stdin) instead of a single notebook",
+    )
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="parallel workers in --batch mode")
+    parser.add_argument("--solo-rss-mb", type=int,
+                        help="in --batch mode, run notebooks whose dandi_ci memory "
+                             "budget exceeds this many MB one at a time, after the rest")
+    parser.add_argument("--env-cache", default="/tmp/notebook-envs",
+                        help="directory of per-pin-set virtualenvs in --batch mode")
+    parser.add_argument("--sample-interval", type=float, default=2.0,
+                        help="seconds between watchdog samples of RSS/CPU/fds")
+    parser.add_argument("--top-cells", type=int, default=5,
+                        help="how many of the slowest cells to list in result.json")
+    parser.add_argument(
+        "--cache-dir",
+        help="reuse passing results keyed on pins + code-cell sources; a "
+             "notebook with no code changes since a cached pass is not re-run",
+    )
+    parser.add_argument(
+        "--http-store",
+        help="record/replay the notebook's HTTP requests (DANDI API, S3 ranges "
+             "via requests) through this content-addressed directory",
+    )
+    parser.add_argument("--http-mode", choices=("record", "replay", "offline"),
+                        default="replay",
+                        help="with --http-store: record always fetches; replay "
+                             "fetches and records misses; offline fails on misses")
+    args = parser.parse_args()
 
-    return finalize("done", True)
+    run_kwargs = {
+        "top_cells": args.top_cells,
+        "cache_dir": Path(args.cache_dir) if args.cache_dir else None,
+        "http_store": Path(args.http_store) if args.http_store else None,
+        "http_mode": args.http_mode,
+        "sample_interval": args.sample_interval,
+    }
+    if args.batch:
+        if args.notebook:
+            parser.error("pass either a notebook or --batch, not both")
+        if args.batch == "-":
+            notebooks = json.load(sys.stdin)
+        else:
+            notebooks = json.loads(Path(args.batch).read_text())
+        return run_batch(notebooks, Path(args.output_dir), args.timeout,
+                         Path(args.env_cache), args.jobs, args.solo_rss_mb,
+                         **run_kwargs)
+    if not args.notebook:
+        parser.error("a notebook path or --batch is required")
+    return run_notebook(args.notebook, Path(args.output_dir), args.timeout,
+                        **run_kwargs)
 
 
 if __name__ == "__main__":
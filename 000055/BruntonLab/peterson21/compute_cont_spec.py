@@ -1,12 +1,41 @@
+"""Continuous spectral power of every 000055 session, projected onto AAL ROIs.
+
+Run from the directory above this one, e.g.
+
+    python -m peterson21.compute_cont_spec --workers 4 --max-opens 4
+
+Each (participant, session file) is a task for a pool of worker processes,
+which reads the file's 30-minute windows, computes their spectra and projects
+them onto the selected ROIs. A worker holds a window of every channel, the
+next one being read ahead, and Welch's copies of it: a few GB, so by default
+there are only as many workers as the available memory allows (see
+`default_workers`). At most ``--max-opens`` workers open a remote file (and
+read its metadata) at the same time; the streaming reads that follow are not
+bounded by it. A file's results are written to a preallocated,
+memory-mapped ``.npy`` under ``<save path>/parts/`` as each window is done,
+along with which windows are done, so a rerun (e.g. after a crash) skips
+finished files and resumes unfinished ones at their first missing window.
+Once all files of a participant are done, their results are copied in
+session order into one ``.npy`` per (participant, ROI).
+"""
+
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+from pathlib import Path
+
 import natsort
 import numpy as np
 from scipy import interpolate
 from tqdm import tqdm as tqdm
 from neurodsp.spectral import compute_spectrum
 from pynwb import NWBHDF5IO
-from dandi.dandiapi import DandiAPIClient
 
-from .spec_utils import project_power, proj_mat_compute
+from .dandi_asset_urls import get_resolver
+from .read_ahead import read_ahead
+from .spec_utils import PROJ_MAT_CACHE_DIR, project_power, proj_mat_compute
 
 # Set parameters
 sp = ''  # save path
@@ -17,123 +46,251 @@ freq_range = [3, 125]  # Hz
 hgrid_fid = "headGrid.mat"
 aal_fid = "aal_rois.mat"
 n_parts = 12  # number of participants
-
-# Determine all file paths
-with DandiAPIClient() as client:
-    paths = []
-    for file in client.get_dandiset("000055", "draft").get_assets_under_path(""):
-        paths.append(file.path)
-paths = natsort.natsorted(paths)
-
-# Create ROI projection matrices
+dandiset_id = "000055"
+version = "draft"  # or pinned by a dandi-assets.json manifest (see dandi_asset_urls.py)
 elec_dens_thresh = 3  # threshold for dipole density
-proj_mats = []
-for s in range(n_parts):
-    fid = [val for val in paths if "sub-" + str(s + 1).zfill(2) in val][0]
-    with DandiAPIClient() as client:
-        asset = client.get_dandiset("000055", "draft").get_asset_by_path(fid)
-        s3_path = asset.get_content_url(follow_redirects=1, strip_query=True)
-
-    with NWBHDF5IO(s3_path, mode="r", load_namespaces=True, driver="ros3") as io:
-        nwb = io.read()
-        elec_locs = np.vstack(
-            (nwb.electrodes["x"][:], nwb.electrodes["y"][:], nwb.electrodes["z"][:])
-        ).T
-
-        elec_locs[elec_locs[:, 0] > 0, 0] = -elec_locs[
-            elec_locs[:, 0] > 0, 0
-        ]  # flip all electrodes to left hemisphere
-
-        keep_inds = (1 - np.isnan(elec_locs[:, 0])).nonzero()[0]
-        elec_locs = elec_locs[keep_inds, :]  # remove NaN electrode locations
-        good_chans = nwb.electrodes["good"][:].astype("int")
-        bad_chans = np.nonzero(1 - good_chans[keep_inds])[0]
-
-        tot_elec_density, weight_mat, roi_labels = proj_mat_compute(
-            elec_locs, hgrid_fid, fwhm=20, bad_chans=bad_chans, aal_fid=aal_fid
-        )
-        if s == 0:
-            elec_densities = tot_elec_density.copy()
-        else:
-            elec_densities += tot_elec_density.copy()
-        proj_mats.append(weight_mat)
-
-elec_densities = elec_densities / n_parts
-# Select ROI's that have electrode density above threshold
-good_rois = np.nonzero(elec_densities > elec_dens_thresh)[0]
-proj_mats = np.asarray(proj_mats)
-print("Selected " + str(len(good_rois)) + " regions")
-
-selected_rois = np.arange(len(good_rois)).tolist()  # 0
+max_opens = 4  # remote files opened at the same time
+worker_bytes = 4 * 2**30  # peak memory of one worker, for the default worker count
 
 win_n_samps = int(win_spec_len * fs)
 large_win_samps = int(large_win * fs)
 freqs = np.arange(freq_range[0], freq_range[1] + 1)
 n_freqs = len(freqs)
 
-for part_ind in tqdm(range(n_parts)):
-    for selected_roi in range(len(good_rois)):
-        fids = [val for val in paths if "sub-" + str(part_ind + 1).zfill(2) in val]
-        pows_sbj = None
-        for j, fid in enumerate(fids):
-            with DandiAPIClient() as client:
-                asset = client.get_dandiset("000055", "draft").get_asset_by_path(fid)
-                s3_path = asset.get_content_url(follow_redirects=1, strip_query=True)
-
-            with NWBHDF5IO(s3_path, mode="r", load_namespaces=True, driver="ros3") as io:
-                nwb = io.read()
-
-                N_dat = len(nwb.acquisition["ElectricalSeries"].data)
-                window_starts_ep = np.arange(0, N_dat, large_win_samps)
-                n_windows = len(window_starts_ep)
-
-                for i in tqdm(range(n_windows)):
-                    end_ind = (
-                        (window_starts_ep[i] + large_win_samps)
-                        if i < (n_windows - 1)
-                        else -1
-                    )
-                    first_elec = nwb.acquisition["ElectricalSeries"].data[
-                        window_starts_ep[i] : end_ind, 0
-                    ]
-                    if np.sum(np.isnan(first_elec)) == 0:
-                        dat = (
-                            nwb.acquisition["ElectricalSeries"]
-                            .data[window_starts_ep[i] : end_ind, :]
-                            .T
-                        )
-
-                        # Compute power using Welch's method
-                        f_welch, spg = compute_spectrum(
-                            dat,
-                            fs,
-                            method="welch",
-                            avg_type="median",
-                            nperseg=win_n_samps,
-                            f_range=freq_range,
-                        )
-
-                        # Interpolate power to integer frequencies
-                        f = interpolate.interp1d(f_welch, spg)
-                        spg_new = f(freqs)
-
-                        # Project power to ROI of interest
-                        spg_proj = project_power(
-                            spg_new, proj_mats[part_ind], good_rois[selected_roi]
-                        )
-
-                        # Append result to final list
-                        if pows_sbj is None:
-                            pows_sbj = spg_proj[np.newaxis, :].copy()
-                        else:
-                            pows_sbj = np.concatenate(
-                                (pows_sbj, spg_proj[np.newaxis, :].copy()), axis=0
-                            )
-
-        # Save power result
-        roi_curr = roi_labels[good_rois[selected_roi]][:-2]
-        np.save(
-            sp + "P" + str(part_ind + 1).zfill(2) + "_" + roi_curr + "_new.npy",
-            pows_sbj,
-        )
-        del pows_sbj
+# Window states in a file's checkpoint
+PENDING, DONE, SKIPPED = 0, 1, 2
+
+# Set in each worker process; bounds concurrent remote opens across the pool.
+_open_slots = None
+
+
+def _init_worker(open_slots):
+    global _open_slots
+    _open_slots = open_slots
+
+
+def default_workers():
+    """As many workers as fit in the available memory (at least 1), up to one per CPU."""
+    try:
+        available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return 2  # not Linux: stay near the sequential baseline
+    return max(1, min(os.cpu_count() or 1, available // worker_bytes))
+
+
+def participant_fids(paths, part_ind):
+    return [val for val in paths if "sub-" + str(part_ind + 1).zfill(2) in val]
+
+
+def compute_proj_mats(resolver, paths):
+    """ROI projection matrix of every participant, and the ROIs above density threshold."""
+    proj_mats = []
+    for s in range(n_parts):
+        fid = participant_fids(paths, s)[0]
+        s3_path = resolver.url(dandiset_id, fid, version, s3=True)
+
+        with NWBHDF5IO(s3_path, mode="r", load_namespaces=True, driver="ros3") as io:
+            nwb = io.read()
+            elec_locs = np.vstack(
+                (nwb.electrodes["x"][:], nwb.electrodes["y"][:], nwb.electrodes["z"][:])
+            ).T
+
+            elec_locs[elec_locs[:, 0] > 0, 0] = -elec_locs[
+                elec_locs[:, 0] > 0, 0
+            ]  # flip all electrodes to left hemisphere
+
+            keep_inds = (1 - np.isnan(elec_locs[:, 0])).nonzero()[0]
+            elec_locs = elec_locs[keep_inds, :]  # remove NaN electrode locations
+            good_chans = nwb.electrodes["good"][:].astype("int")
+            bad_chans = np.nonzero(1 - good_chans[keep_inds])[0]
+
+            tot_elec_density, weight_mat, roi_labels = proj_mat_compute(
+                elec_locs, hgrid_fid, fwhm=20, bad_chans=bad_chans, aal_fid=aal_fid,
+                cache_dir=PROJ_MAT_CACHE_DIR,
+            )
+            if s == 0:
+                elec_densities = tot_elec_density.copy()
+            else:
+                elec_densities += tot_elec_density.copy()
+            proj_mats.append(weight_mat)
+
+    elec_densities = elec_densities / n_parts
+    # Select ROI's that have electrode density above threshold
+    good_rois = np.nonzero(elec_densities > elec_dens_thresh)[0]
+    return np.asarray(proj_mats), good_rois, roi_labels
+
+
+def _checkpoint(out_path, n_windows, n_rois):
+    """Memory-mapped (windows x ROIs x freqs) result of a file in progress, and
+    the state of each window, next to `out_path`; reopened as left when resuming."""
+    pows_path = out_path.with_name(out_path.stem + ".partial.npy")
+    state_path = out_path.with_name(out_path.stem + ".state.npy")
+    shape = (n_windows, n_rois, n_freqs)
+    try:
+        pows = np.lib.format.open_memmap(pows_path, mode="r+")
+        state = np.lib.format.open_memmap(state_path, mode="r+")
+        if pows.shape == shape and state.shape == (n_windows,):
+            return pows, state, (pows_path, state_path)
+    except (OSError, ValueError):
+        pass  # missing, or torn by a crash while being created
+    pows = np.lib.format.open_memmap(pows_path, mode="w+", dtype=np.float64, shape=shape)
+    state = np.lib.format.open_memmap(state_path, mode="w+", dtype=np.int8, shape=(n_windows,))
+    state[:] = PENDING
+    state.flush()
+    return pows, state, (pows_path, state_path)
+
+
+def file_spectra(s3_path, proj_mat, roi_inds, out_path, driver="ros3"):
+    """Power of every window of one session file, projected onto `roi_inds`.
+
+    Saves a (windows x ROIs x freqs) array to `out_path`, renamed into place
+    once complete so that a crash never leaves a partial result behind. Until
+    then, each window is flushed to a checkpoint as soon as it is computed,
+    and a rerun only computes the windows missing from it.
+    """
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with _open_slots if _open_slots is not None else nullcontext():
+        io = NWBHDF5IO(s3_path, mode="r", load_namespaces=True, driver=driver)
+        nwb = io.read()
+
+    with io:
+        data = nwb.acquisition["ElectricalSeries"].data
+        N_dat = len(data)
+        window_starts_ep = np.arange(0, N_dat, large_win_samps)
+        n_windows = len(window_starts_ep)
+        windows = [
+            slice(
+                window_starts_ep[i],
+                (window_starts_ep[i] + large_win_samps)
+                if i < (n_windows - 1)
+                else -1,
+            )
+            for i in range(n_windows)
+        ]
+
+        pows, state, checkpoint = _checkpoint(out_path, n_windows, len(roi_inds))
+        todo = np.nonzero(state == PENDING)[0]
+        # Read the next window while this one is being processed.
+        for i, window in zip(todo, read_ahead(data, [windows[i] for i in todo])):
+            first_elec = window[:, 0]
+            if np.sum(np.isnan(first_elec)) == 0:
+                dat = window.T
+
+                # Compute power using Welch's method
+                f_welch, spg = compute_spectrum(
+                    dat,
+                    fs,
+                    method="welch",
+                    avg_type="median",
+                    nperseg=win_n_samps,
+                    f_range=freq_range,
+                )
+
+                # Interpolate power to integer frequencies
+                f = interpolate.interp1d(f_welch, spg)
+                spg_new = f(freqs)
+
+                # Project power to all ROIs of interest (ROIs x freqs)
+                spg_proj = project_power(spg_new, proj_mat, roi_inds)
+
+                # Store result in its row; mark the window done only once it is on disk
+                pows[i] = spg_proj
+                pows.flush()
+                state[i] = DONE
+            else:
+                state[i] = SKIPPED
+            state.flush()
+
+    tmp = out_path.with_name(f".{out_path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, pows[state == DONE])
+    tmp.replace(out_path)
+    del pows, state
+    for path in checkpoint:
+        path.unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--workers", type=int, default=default_workers(),
+                        help="Worker processes (default: as many as fit in the available "
+                             f"memory at {worker_bytes / 2**30:g} GiB each, up to one per CPU)")
+    parser.add_argument("--max-opens", type=int, default=max_opens,
+                        help="Remote files opened (metadata read) at the same time; "
+                             "does not bound the streaming reads that follow")
+    parser.add_argument("--save-path", default=sp,
+                        help="Directory for the results (default: the working directory)")
+    args = parser.parse_args()
+    save_path = Path(args.save_path)
+
+    # Determine all file paths
+    resolver = get_resolver()
+    paths = natsort.natsorted(resolver.urls_matching(dandiset_id, "*", version))
+
+    # Create ROI projection matrices
+    proj_mats, good_rois, roi_labels = compute_proj_mats(resolver, paths)
+    print("Selected " + str(len(good_rois)) + " regions")
+
+    selected_rois = np.arange(len(good_rois)).tolist()  # 0
+    roi_inds = good_rois[selected_rois]
+
+    parts = {
+        part_ind: [
+            (fid, save_path / "parts" / ("P" + str(part_ind + 1).zfill(2)) / (Path(fid).stem + ".npy"))
+            for fid in participant_fids(paths, part_ind)
+        ]
+        for part_ind in range(n_parts)
+    }
+    todo = [
+        (part_ind, fid, out_path)
+        for part_ind, files in parts.items()
+        for fid, out_path in files
+        if not out_path.exists()
+    ]
+    print(f"{len(todo)} of {sum(map(len, parts.values()))} files left to process")
+
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=ctx,
+        initializer=_init_worker,
+        initargs=(ctx.BoundedSemaphore(args.max_opens),),
+    ) as pool:
+        futures = [
+            pool.submit(
+                file_spectra,
+                resolver.url(dandiset_id, fid, version, s3=True),
+                proj_mats[part_ind],
+                roi_inds,
+                out_path,
+            )
+            for part_ind, fid, out_path in todo
+        ]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            future.result()
+
+    # Merge in session order; save power result, one file per ROI (windows x freqs),
+    # preallocated and filled file by file
+    for part_ind, files in parts.items():
+        pows_files = [np.load(out_path, mmap_mode="r") for _, out_path in files]
+        n_windows = sum(len(pows) for pows in pows_files)
+        for k, roi_ind in enumerate(roi_inds):
+            roi_curr = roi_labels[roi_ind][:-2]
+            pows_sbj = np.lib.format.open_memmap(
+                save_path / ("P" + str(part_ind + 1).zfill(2) + "_" + roi_curr + "_new.npy"),
+                mode="w+",
+                dtype=np.float64,
+                shape=(n_windows, n_freqs),
+            )
+            start = 0
+            for pows in pows_files:
+                pows_sbj[start:start + len(pows)] = pows[:, k]
+                start += len(pows)
+            pows_sbj.flush()
+            del pows_sbj
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""Download-once local subsets ("sidecars") of remote NWB files.
+
+The figure helpers in plot_utils.py read a handful of small objects (the
+electrodes table, the reach events, the wrist positions) from every session
+file, and used to stream them again over ros3 for every figure. Instead,
+`open_materialized(dandiset_id, path, objects)` copies just those objects, with the same
+HDF5 layout, into a local NWB file on first use and opens that file from then
+on. Copied along is everything pynwb needs to read it back: the root
+attributes and datasets, the cached specifications, the attributes of every
+parent group, and every object the copied ones link or refer to (e.g. the
+electrode groups and devices behind the electrodes table).
+
+Sidecars are kept under ``DANDI_NWB_SIDECAR_DIR`` (default
+``~/.cache/dandi-nwb-sidecars``), one per asset, named by the asset's ID: a
+re-uploaded file gets a new ID, and so a fresh sidecar. Asking for objects a
+sidecar lacks copies them in.
+
+Assets are looked up with the shared resolver of dandi_asset_urls.py (and so
+from a ``dandi-assets.json`` manifest when there is one), and every listing
+is recorded next to the sidecars as path -> asset ID. When the archive
+cannot be reached, `asset_paths` and `open_materialized` fall back to that
+record, so figures whose sidecars exist re-render offline.
+"""
+
+import fnmatch
+import json
+import os
+import shutil
+from pathlib import Path
+
+import h5py
+import numpy as np
+import requests
+from pynwb import NWBHDF5IO
+
+from dandi_asset_urls import get_resolver
+
+SIDECAR_DIR = Path(
+    os.environ.get("DANDI_NWB_SIDECAR_DIR", Path.home() / ".cache" / "dandi-nwb-sidecars")
+)
+
+
+def _ref_fields(dtype):
+    """Names of the object-reference fields of `dtype` ([None] for a plain ref dtype)."""
+    if dtype.names is None:
+        return [None] if h5py.check_dtype(ref=dtype) is h5py.Reference else []
+    return [n for n in dtype.names if h5py.check_dtype(ref=dtype.fields[n][0]) is h5py.Reference]
+
+
+class _Copier:
+    """Copies objects from `src` to `dst` at the same paths, following references."""
+
+    def __init__(self, src, dst):
+        self.src = src
+        self.dst = dst
+        self.todo = []
+        self.deferred_datasets = []  # written once every referenced object exists
+        self.deferred_attrs = []
+        self.done = set()  # paths copied with everything under them
+
+    def _copied(self, path):
+        if path in self.dst and isinstance(self.dst[path], h5py.Dataset):
+            return True
+        parts = path.split("/")
+        return any("/".join(parts[:i]) in self.done for i in range(1, len(parts) + 1))
+
+    def _need(self, path):
+        self.todo.append(path.lstrip("/"))
+
+    def _refs_of(self, value, fields):
+        for field in fields:
+            refs = value if field is None else value[field]
+            for ref in np.ravel(refs):
+                if ref:
+                    self._need(self.src[ref].name)
+
+    def _copy_attrs(self, src_obj, dst_obj):
+        for name in src_obj.attrs:
+            dtype = src_obj.attrs.get_id(name).dtype
+            value = src_obj.attrs[name]
+            fields = _ref_fields(dtype)
+            if fields:
+                self._refs_of(value, fields)
+                self.deferred_attrs.append((src_obj.name, name))
+            else:
+                dst_obj.attrs.create(name, value, dtype=dtype)
+
+    def _ensure_parents(self, path):
+        parts = path.split("/")[:-1]
+        for i in range(1, len(parts) + 1):
+            group_path = "/".join(parts[:i])
+            if group_path not in self.dst:
+                self._copy_attrs(self.src[group_path], self.dst.create_group(group_path))
+
+    def _copy_dataset(self, path):
+        src = self.src[path]
+        if src.shape is None:
+            self.dst.create_dataset(path, data=h5py.Empty(src.dtype))
+            self._copy_attrs(src, self.dst[path])
+            return
+        kwargs = {}
+        if src.compression in ("gzip", "lzf"):
+            kwargs = dict(compression=src.compression, compression_opts=src.compression_opts,
+                          shuffle=src.shuffle)
+        dst = self.dst.create_dataset(path, shape=src.shape, dtype=src.dtype, chunks=src.chunks,
+                                      maxshape=src.maxshape, **kwargs)
+        self._copy_attrs(src, dst)
+        fields = _ref_fields(src.dtype)
+        if fields:
+            self._refs_of(src[()], fields)
+            self.deferred_datasets.append(path)
+        elif src.size and src.chunks:
+            for sel in src.iter_chunks():
+                dst[sel] = src[sel]
+        elif src.size:
+            dst[()] = src[()]
+
+    def _copy(self, path):
+        src = self.src[path]
+        if isinstance(src, h5py.Dataset):
+            self._copy_dataset(path)
+            return
+        dst = self.dst.require_group(path) if path else self.dst
+        self._copy_attrs(src, dst)
+        for name in src:
+            child = f"{path}/{name}" if path else name
+            if self._copied(child):
+                continue
+            link = src.get(name, getlink=True)
+            if isinstance(link, h5py.SoftLink):
+                if name not in dst:
+                    dst[name] = h5py.SoftLink(link.path)
+                self._need(link.path)
+            elif isinstance(link, h5py.ExternalLink):
+                if name not in dst:
+                    dst[name] = h5py.ExternalLink(link.filename, link.path)
+            else:
+                self._copy(child)
+
+    def _convert(self, value, fields):
+        """`value` with its references into `src` replaced by references into `dst`."""
+        value = np.array(value, copy=True)
+        for field in fields:
+            refs = value if field is None else value[field]
+            out = np.empty(refs.shape, dtype=refs.dtype)
+            for i, ref in np.ndenumerate(refs):
+                out[i] = self.dst[self.src[ref].name].ref if ref else h5py.Reference()
+            if field is None:
+                value = out
+            else:
+                value[field] = out
+        return value
+
+    def run(self, paths):
+        for path in paths:
+            self._need(path)
+        while self.todo:
+            path = self.todo.pop()
+            if self._copied(path):
+                continue
+            self._ensure_parents(path)
+            self._copy(path)
+            self.done.add(path)
+        for path in self.deferred_datasets:
+            src = self.src[path]
+            self.dst[path][()] = self._convert(src[()], _ref_fields(src.dtype))
+        for path, name in self.deferred_attrs:
+            src = self.src[path]
+            dtype = src.attrs.get_id(name).dtype
+            self.dst[path].attrs.create(
+                name, self._convert(src.attrs[name], _ref_fields(dtype)), dtype=dtype
+            )
+
+
+def materialize(url, objects, sidecar, driver="ros3"):
+    """Copy the NWB `objects` of the file at `url` into the local file `sidecar`.
+
+    Parameters
+    ----------
+    url : str
+        URL (or local path) of the source NWB file.
+    objects : list of str
+        HDF5 paths of the objects to copy, e.g.
+        ``["general/extracellular_ephys/electrodes", "processing/behavior/ReachEvents"]``.
+    sidecar : str or Path
+        Local NWB file to create, or to add the objects to.
+    driver : str or None
+        h5py driver to read `url` with.
+    """
+    sidecar = Path(sidecar)
+    sidecar.parent.mkdir(parents=True, exist_ok=True)
+    # Build a copy and rename it into place: a reader never sees a partial file.
+    tmp = sidecar.with_name(f".{sidecar.name}.{os.getpid()}.tmp")
+    if sidecar.exists():
+        shutil.copyfile(sidecar, tmp)
+    try:
+        with h5py.File(url, "r", driver=driver) as src, h5py.File(tmp, "a") as dst:
+            copier = _Copier(src, dst)
+            copier._copy_attrs(src, dst)
+            # What pynwb needs to build the NWBFile: the root datasets, the
+            # cached specifications, the file-level metadata under "general",
+            # and the top-level groups, empty unless asked for.
+            skeleton = [name for name in src if isinstance(src[name], h5py.Dataset)]
+            if "specifications" in src:
+                skeleton.append("specifications")
+            for name in src:
+                if isinstance(src[name], h5py.Group) and name not in dst:
+                    copier._copy_attrs(src[name], dst.create_group(name))
+            if "general" in src:
+                skeleton += [f"general/{name}" for name in src["general"]
+                             if isinstance(src["general"][name], h5py.Dataset)]
+            copier.run(skeleton + [path.strip("/") for path in objects])
+        tmp.replace(sidecar)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _asset_id(url):
+    """Asset ID of an API download URL (``.../assets/<id>/download/``)."""
+    return url.rstrip("/").split("/")[-2]
+
+
+def _index_file(sidecar_dir, dandiset_id, version):
+    return Path(sidecar_dir) / dandiset_id / f"assets-{version}.json"
+
+
+def _read_index(sidecar_dir, dandiset_id, version):
+    try:
+        return json.loads(_index_file(sidecar_dir, dandiset_id, version).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_index(sidecar_dir, dandiset_id, version, index):
+    path = _index_file(sidecar_dir, dandiset_id, version)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(index, indent=1, sort_keys=True))
+    tmp.replace(path)
+
+
+def asset_paths(dandiset_id, pattern="*", version="draft", sidecar_dir=SIDECAR_DIR):
+    """Paths of the assets of a dandiset that match the glob `pattern`.
+
+    Listed through the shared resolver, and recorded with their asset IDs
+    for `open_materialized`; when the archive cannot be reached, the last
+    recorded listing is returned instead.
+    """
+    try:
+        urls = get_resolver().urls_matching(dandiset_id, pattern, version)
+    except requests.RequestException:
+        index = _read_index(sidecar_dir, dandiset_id, version)
+        if not index:
+            raise
+        return sorted(p for p in index if fnmatch.fnmatchcase(p, pattern))
+    index = _read_index(sidecar_dir, dandiset_id, version)
+    listed = {path: _asset_id(url) for path, url in urls.items()}
+    if any(index.get(path) != asset_id for path, asset_id in listed.items()):
+        _write_index(sidecar_dir, dandiset_id, version, dict(index, **listed))
+    return sorted(listed)
+
+
+def open_materialized(dandiset_id, path, objects, version="draft", sidecar_dir=SIDECAR_DIR,
+                      driver="ros3"):
+    """Open a local copy of the `objects` of a DANDI asset, making it if needed.
+
+    Parameters
+    ----------
+    dandiset_id : str
+        Dandiset ID
+    path : str
+        Asset path within the dandiset
+    objects : list of str
+        HDF5 paths of the NWB objects the caller reads; see `materialize`.
+    version : str
+        Dandiset version
+    sidecar_dir : str or Path
+        Directory holding the sidecars.
+    driver : str or None
+        h5py driver to stream the asset with when materializing.
+
+    Returns
+    -------
+    io : NWBHDF5IO
+        Open reader of the sidecar (use as a context manager, like the
+        `NWBHDF5IO` it replaces).
+    """
+    # The listing `asset_paths` recorded is as fresh as the caller's paths;
+    # the resolver (cached, or pinned by a manifest) covers any other path.
+    asset_id = _read_index(sidecar_dir, dandiset_id, version).get(path)
+    if asset_id is None:
+        asset_id = _asset_id(get_resolver().url(dandiset_id, path, version))
+    sidecar = Path(sidecar_dir) / dandiset_id / f"{asset_id}.nwb"
+    manifest = sidecar.with_suffix(".json")
+    try:
+        have = set(json.loads(manifest.read_text()))
+    except (OSError, ValueError):
+        have = set()
+    objects = {obj.strip("/") for obj in objects}
+    if not sidecar.exists() or not objects <= have:
+        url = get_resolver().url(dandiset_id, path, version, s3=True)
+        materialize(url, sorted(objects - have) if sidecar.exists() else sorted(objects),
+                    sidecar, driver=driver)
+        manifest.write_text(json.dumps(sorted(have | objects)))
+    return NWBHDF5IO(str(sidecar), mode="r", load_namespaces=True)
@@ -10,11 +10,17 @@ from scipy.signal import medfilt
 from nilearn import plotting as ni_plt
 from tqdm import tqdm
 
-from pynwb import NWBHDF5IO
-from dandi.dandiapi import DandiAPIClient
 from nwbwidgets.utils.timeseries import align_by_times, timeseries_time_to_ind
 import ndx_events
 
+from materialize import asset_paths, open_materialized
+
+# NWB objects each helper reads, copied locally once by open_materialized.
+ELECTRODES = "general/extracellular_ephys/electrodes"
+REACH_EVENTS = "processing/behavior/ReachEvents"
+POSITION = "processing/behavior/Position"
+EPOCHS = "intervals/epochs"
+
 
 def prune_clabels(
     clabels_orig, targeted=False, targ_tlims=[13, 17], first_val=True, targ_label="Eat"
@@ -138,20 +144,13 @@ def clabel_table_create(
 ):
     """Create table of coarse label durations across participants.
     Labels to include in the table are specified by common_acts."""
-    with DandiAPIClient() as client:
-        paths = []
-        for file in client.get_dandiset("000055", "draft").get_assets_with_path_prefix(""):
-            paths.append(file.path)
-    paths = natsort.natsorted(paths)
+    paths = natsort.natsorted(asset_paths("000055"))
 
     vals_all = np.zeros([n_parts, len(common_acts) + 1])
     for part_ind in tqdm(range(n_parts)):
         fids = [val for val in paths if "sub-" + str(part_ind + 1).zfill(2) in val]
         for fid in fids:
-            with DandiAPIClient() as client:
-                asset = client.get_dandiset("000055", "draft").get_asset_by_path(fid)
-                s3_path = asset.get_content_url(follow_redirects=1, strip_query=True)
-            with NWBHDF5IO(s3_path, mode="r", driver="ros3") as io:
+            with open_materialized("000055", fid, [EPOCHS]) as io:
                 nwb = io.read()
 
                 curr_labels = nwb.intervals["epochs"].to_dataframe()
@@ -206,11 +205,7 @@ def load_data_characteristics(nparts=12):
     """Load data characteristics including the number of
     good and total ECoG electrodes, hemisphere implanted,
     and number of recording days for each participant."""
-    with DandiAPIClient() as client:
-        paths = []
-        for file in client.get_dandiset("000055", "draft").get_assets_with_path_prefix(""):
-            paths.append(file.path)
-    paths = natsort.natsorted(paths)
+    paths = natsort.natsorted(asset_paths("000055"))
 
     n_elecs_tot, n_elecs_good = [], []
     rec_days, hemis, n_elecs_surf_tot, n_elecs_depth_tot = [], [], [], []
@@ -219,10 +214,7 @@ def load_data_characteristics(nparts=12):
         fids = [val for val in paths if "sub-" + str(part_ind + 1).zfill(2) in val]
         rec_days.append(len(fids))
         for fid in fids[:1]:
-            with DandiAPIClient() as client:
-                asset = client.get_dandiset("000055", "draft").get_asset_by_path(fid)
-                s3_path = asset.get_content_url(follow_redirects=1, strip_query=True)
-            with NWBHDF5IO(s3_path, mode="r", driver="ros3") as io:
+            with open_materialized("000055", fid, [ELECTRODES, REACH_EVENTS]) as io:
                 nwb = io.read()
 
                 # Determine good/total electrodes
@@ -278,11 +270,7 @@ def plot_ecog_descript(
 ):
     """Plot ECoG electrode positions and identified noisy
     electrodes side by side."""
-    with DandiAPIClient() as client:
-        paths = []
-        for file in client.get_dandiset("000055", "draft").get_assets_with_path_prefix(""):
-            paths.append(file.path)
-    paths = natsort.natsorted(paths)
+    paths = natsort.natsorted(asset_paths("000055"))
 
     fig = plt.figure(figsize=(width * 3, height * 3), dpi=150)
     # First subplot: electrode locations
@@ -302,10 +290,7 @@ def plot_ecog_descript(
     for part_ind in tqdm(range(nparts)):
         # Load NWB data file
         fids = [val for val in paths if "sub-" + str(part_ind + 1).zfill(2) in val]
-        with DandiAPIClient() as client:
-            asset = client.get_dandiset("000055", "draft").get_asset_by_path(fids[0])
-            s3_path = asset.get_content_url(follow_redirects=1, strip_query=True)
-        with NWBHDF5IO(s3_path, mode="r", driver="ros3") as io:
+        with open_materialized("000055", fids[0], [ELECTRODES]) as io:
             nwb = io.read()
 
             # Determine hemisphere to display
@@ -870,22 +855,13 @@ def _get_wrist_trajs(
     base_start=-1.5, base_end=-1, before=3, after=3, fs_video=30, n_parts=12
 ):
     """Load in wrist trajectories around move onset events."""
-    with DandiAPIClient() as client:
-        paths = []
-        for file in client.get_dandiset("000055", "draft").get_assets_with_path_prefix(""):
-            paths.append(file.path)
-    paths = natsort.natsorted(paths)
+    paths = natsort.natsorted(asset_paths("000055"))
 
     displ_lst, part_lst, time_lst, pose_lst = [], [], [], []
     for pat in range(n_parts):
         fids = [val for val in paths if "sub-" + str(pat + 1).zfill(2) in val]
         for i, fid in enumerate(fids):
-            with DandiAPIClient() as client:
-                asset = client.get_dandiset("000055", "draft").get_asset_by_path(fid)
-                s3_path = asset.get_content_url(follow_redirects=1, strip_query=True)
-            with NWBHDF5IO(
-                s3_path, mode="r", driver="ros3"
-            ) as io:
+            with open_materialized("000055", fid, [REACH_EVENTS, POSITION]) as io:
                 nwb_file = io.read()
 
                 # Segment data
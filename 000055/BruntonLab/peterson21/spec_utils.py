@@ -1,10 +1,28 @@
+import hashlib
+import os
+from functools import lru_cache
+from pathlib import Path
+
 import numpy as np
 from scipy.io import loadmat
 
+# Projection matrices already computed, by electrode layout (see proj_mat_compute)
+PROJ_MAT_CACHE_DIR = Path(
+    os.environ.get("DANDI_PROJ_MAT_CACHE_DIR", Path.home() / ".cache" / "peterson21-proj-mats")
+)
+
 
 def project_power(dat, proj_mat, roi_ind):
+    """Project power `dat` (channels x freqs) onto ROI `roi_ind` of `proj_mat`.
+    With a list of ROI indices, projects onto all of them at once (ROIs x freqs)."""
     chan_ind_vals = np.nonzero(proj_mat.mean(1) != 0)[0]
-    return np.dot(proj_mat[chan_ind_vals, roi_ind], dat[chan_ind_vals, :])
+    return np.dot(proj_mat[chan_ind_vals][:, roi_ind].T, dat[chan_ind_vals, :])
+
+
+def _column_sums(mat):
+    """Sum of each column of `mat`, added in the same order as `mat[:, j].sum()`
+    would (unlike `mat.sum(0)`), so the result is identical to summing column by column."""
+    return np.ascontiguousarray(mat.T).sum(1)
 
 
 def _calc_dens_norm_factor(elec_locs, headGrid, projectionParameter):
@@ -52,9 +70,6 @@ def _getProjectionMatrix(
 
     n_elecs = elec_locs.shape[0]
     projectionMatrix = np.zeros((n_elecs, n_pnts_roi))
-    totalDipoleDensity = np.zeros((n_pnts_roi))
-    gaussianWeightMatrix = np.zeros((n_elecs, n_pnts_roi))
-    dist_elec_gridlocs = np.zeros((n_elecs, n_pnts_roi))
 
     # swap axes to account for Matlab/Python differences in flattening 3D arrays
     if headGrid["xCube"].shape[0] > headGrid["xCube"].shape[2]:
@@ -78,60 +93,102 @@ def _getProjectionMatrix(
             elec_locs, headGrid, projectionParameter
         )
 
-    for dipoleNumber in range(n_elecs):
-        # first place distance in the array
-        dist_elec_gridlocs[dipoleNumber, :] = (
-            np.sum(
-                (
-                    gridPosition
-                    - np.tile(elec_locs[dipoleNumber, :], [gridPosition.shape[0], 1])
-                )
-                ** 2,
-                1,
-            )
-            ** 0.5
-        )
+    # distance of every grid point to every electrode (electrodes x grid points),
+    # summing the squared differences in the same order as np.sum over x, y, z
+    sq_dist = np.zeros((n_elecs, n_pnts_roi))
+    for axis in range(3):
+        sq_dist += (gridPosition[np.newaxis, :, axis] - elec_locs[:, axis, np.newaxis]) ** 2
+    dist_elec_gridlocs = sq_dist ** 0.5
 
-        normalizationFactor = 1 / (
-            projectionParameter["sd_est_elecloc"] ** 3 * np.sqrt(8 * (np.pi ** 3))
-        )
-        gaussianWeightMatrix[dipoleNumber, :] = normalizationFactor * np.exp(
-            -dist_elec_gridlocs[dipoleNumber, :] ** 2 / (2 * sd_est_err_pow2)
+    normalizationFactor = 1 / (
+        projectionParameter["sd_est_elecloc"] ** 3 * np.sqrt(8 * (np.pi ** 3))
+    )
+    gaussianWeightMatrix = normalizationFactor * np.exp(
+        -dist_elec_gridlocs ** 2 / (2 * sd_est_err_pow2)
+    )
+
+    # truncate the dipole density Gaussian at ~3 standard deviation
+    gaussianWeightMatrix[
+        dist_elec_gridlocs
+        > (
+            projectionParameter["n_sd_trunc_gaussian"]
+            * projectionParameter["sd_est_elecloc"]
         )
+    ] = 0
 
-        # truncate the dipole density Gaussian at ~3 standard deviation
-        gaussianWeightMatrix[
-            dipoleNumber,
-            dist_elec_gridlocs[dipoleNumber, :]
-            > (
-                projectionParameter["n_sd_trunc_gaussian"]
-                * projectionParameter["sd_est_elecloc"]
-            ),
-        ] = 0
-
-        # normalize the dipole in-brain density (make it sum up to one)
-        if projectionParameter["normalizeInBrainDipoleDenisty"]:
-            gaussianWeightMatrix[dipoleNumber, :] = (
-                gaussianWeightMatrix[dipoleNumber, :]
-                * dipoleInBrainDensityNormalizationFactor[dipoleNumber]
-            )
+    # normalize the dipole in-brain density (make it sum up to one)
+    if projectionParameter["normalizeInBrainDipoleDenisty"]:
+        gaussianWeightMatrix *= dipoleInBrainDensityNormalizationFactor[:, np.newaxis]
 
     # normalize gaussian weights to have the sum of 1 at each grid location
-    for gridId in range(gaussianWeightMatrix.shape[1]):
-        totalDipoleDensity[gridId] = np.sum(gaussianWeightMatrix[:, gridId])
-        if totalDipoleDensity[gridId] > 0:
-            projectionMatrix[:, gridId] = (
-                gaussianWeightMatrix[:, gridId] / totalDipoleDensity[gridId]
-            )
+    totalDipoleDensity = _column_sums(gaussianWeightMatrix)
+    has_density = totalDipoleDensity > 0
+    projectionMatrix[:, has_density] = (
+        gaussianWeightMatrix[:, has_density] / totalDipoleDensity[has_density]
+    )
 
     return projectionMatrix, totalDipoleDensity, gaussianWeightMatrix
 
 
-def proj_mat_compute(elec_locs, hgrid_fid, fwhm=20, bad_chans=[], aal_fid=None):
+@lru_cache(maxsize=None)
+def _load_head_grid(hgrid_fid):
+    return loadmat(hgrid_fid, matlab_compatible=True)["headGrid"][0, 0]
+
+
+@lru_cache(maxsize=None)
+def _load_aal_rois(aal_fid):
+    """Labels and (swapped to Python order) membership probability cubes of the AAL ROIs."""
+    aal_rois = loadmat(aal_fid, matlab_compatible=True)["aal_rois"]
+    labels = tuple("".join(roi["label"][0]) for roi in aal_rois[0])
+    cubes = tuple(np.swapaxes(roi["membershipProbabilityCube"], 0, 2) for roi in aal_rois[0])
+    return labels, cubes
+
+
+@lru_cache(maxsize=None)
+def _file_digest(fid):
+    return hashlib.sha256(Path(fid).read_bytes()).hexdigest()
+
+
+def _proj_mat_key(elec_locs, hgrid_fid, fwhm, bad_chans, aal_fid):
+    """Hash of everything a projection matrix depends on."""
+    h = hashlib.sha256()
+    elec_locs = np.ascontiguousarray(elec_locs, dtype=np.float64)
+    h.update(repr(elec_locs.shape).encode())
+    h.update(elec_locs.tobytes())
+    h.update(np.asarray(bad_chans, dtype=np.int64).tobytes())
+    h.update(repr(float(fwhm)).encode())
+    h.update(_file_digest(hgrid_fid).encode())
+    h.update(_file_digest(aal_fid).encode() if aal_fid else b"")
+    return h.hexdigest()
+
+
+def proj_mat_compute(elec_locs, hgrid_fid, fwhm=20, bad_chans=[], aal_fid=None, cache_dir=None):
     """Compute projection matrix from electrodes to regions of interest
-    fwhm : full width at half maximum (in mm)"""
-    hgrid = loadmat(hgrid_fid, matlab_compatible=True)
-    headGrid_in = hgrid["headGrid"][0, 0]
+    fwhm : full width at half maximum (in mm)
+    cache_dir : directory (e.g. PROJ_MAT_CACHE_DIR) to keep the result in, keyed on a
+        hash of the electrode locations, bad channels, fwhm and grid/atlas files, so
+        the same participant is only ever computed once"""
+    if cache_dir is not None:
+        key = _proj_mat_key(elec_locs, hgrid_fid, fwhm, bad_chans, aal_fid)
+        cached = Path(cache_dir) / (key + ".npz")
+        try:
+            with np.load(cached) as f:
+                if aal_fid:
+                    return f["density"], f["proj_mat"], f["labels"].tolist()
+                return f["density"], f["proj_mat"]
+        except (OSError, KeyError, ValueError):
+            pass
+        result = proj_mat_compute(elec_locs, hgrid_fid, fwhm, bad_chans, aal_fid)
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cached.with_name(f".{cached.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, density=result[0], proj_mat=result[1],
+                     **({"labels": np.array(result[2])} if aal_fid else {}))
+        tmp.replace(cached)
+        return result
+
+    # Parsed once per process; copied, as _getProjectionMatrix reorders its cubes
+    headGrid_in = _load_head_grid(os.path.abspath(hgrid_fid)).copy()
 
     sd_est_elecloc = fwhm / 2.355  # this calculates sigma in Gaussian equation
     proj_param = {}
@@ -150,38 +207,23 @@ def proj_mat_compute(elec_locs, hgrid_fid, fwhm=20, bad_chans=[], aal_fid=None):
 
         gaussianWeightMatrix[bad_chans, :] = 0
         sum_vals = gaussianWeightMatrix.sum(0)
-        for s in range(len(sum_vals)):
-            gaussianWeightMatrix[:, s] = gaussianWeightMatrix[:, s] / sum_vals[s]
+        gaussianWeightMatrix = gaussianWeightMatrix / sum_vals
 
     if aal_fid:
-        aal_rois = loadmat(aal_fid, matlab_compatible=True)["aal_rois"]
-        n_rois = aal_rois.shape[1]
-        n_elecs = gaussianWeightMatrix.shape[0]
-
-        labels = []
-        for i in range(n_rois):
-            aal_rois[0, i]["membershipProbabilityCube"] = np.swapaxes(
-                aal_rois[0, i]["membershipProbabilityCube"], 0, 2
-            )
-            labels.append("".join(aal_rois[0, i]["label"][0]))
+        labels, cubes = _load_aal_rois(os.path.abspath(aal_fid))
+        labels = list(labels)
 
         # Compute projection matrix onto specific AAL regions
-        dipoleProbabilityInRegion = np.zeros((n_elecs, n_rois))
-        for i in range(n_rois):
-            dipoleProbabilityInRegion[:, i] = (
-                gaussianWeightMatrix
-                @ aal_rois[0, i]["membershipProbabilityCube"][
-                    headGrid_in["insideBrainCube"]
-                ]
-            )
+        membership = np.stack(
+            [cube[headGrid_in["insideBrainCube"]] for cube in cubes], axis=1
+        )  # grid points x ROIs
+        dipoleProbabilityInRegion = gaussianWeightMatrix @ membership
         dipoleDensityROI = dipoleProbabilityInRegion.sum(0)
 
         # Normalize across ROI's (necessary for scaling)
-        normdipoleProbabilityInRegion = np.zeros((n_elecs, n_rois))
-        for j in range(n_rois):
-            normdipoleProbabilityInRegion[:, j] = (
-                dipoleProbabilityInRegion[:, j] / dipoleProbabilityInRegion[:, j].sum()
-            )
+        normdipoleProbabilityInRegion = dipoleProbabilityInRegion / _column_sums(
+            dipoleProbabilityInRegion
+        )
 
         return dipoleDensityROI, normdipoleProbabilityInRegion, labels
 
@@ -31,11 +31,12 @@ microns_nwb = get_microns_nwb_file(session_no=4, scan_no=4)
 microns_nwb = update_microns_nwb_file(microns_nwb)
 """
 
-from dandi.dandiapi import DandiAPIClient
+import os
+from pathlib import Path
+
 from caveclient import CAVEclient
 
-from fsspec.implementations.cached import CachingFileSystem
-from fsspec import filesystem
+import remfile
 from h5py import File
 from pynwb import NWBHDF5IO
 from pynwb.file import NWBFile
@@ -45,29 +46,31 @@ import pandas as pd
 
 from pynwb.ophys import PlaneSegmentation
 
+from block_cache import DEFAULT_MAX_BYTES, BlockCache
+from dandi_asset_urls import get_resolver
+
 
 DANDISET_ID = "000402"
 CAVE_COREG_TABLE = "apl_functional_coreg_forward_v5"
+# Shared by every kernel and working directory on the machine.
+CACHE_DIR = Path(
+    os.environ.get("DANDI_BLOCK_CACHE_DIR", Path.home() / ".cache" / "dandi-blocks")
+)
 
 
-def get_microns_nwb_file(session_no:int, scan_no:int):
+def get_microns_nwb_file(session_no:int, scan_no:int, cache_dir=CACHE_DIR,
+                         max_cache_bytes:int=DEFAULT_MAX_BYTES):
     file_path = f"sub-17797/sub-17797_ses-{session_no}-scan-{scan_no}_behavior+image+ophys.nwb"
-    with DandiAPIClient() as client:
-        asset = client.get_dandiset(DANDISET_ID, 'draft').get_asset_by_path(file_path)
-        s3_url = asset.get_content_url(follow_redirects=1, strip_query=True)
+    info = get_resolver().info(DANDISET_ID, file_path)
 
-    # First, create a virtual filesystem based on the http protocol
-    fs = filesystem("http")
-
-    # Create a cache to save downloaded data to disk (optional)
-    fs = CachingFileSystem(
-        fs=fs,
-        cache_storage="nwb-cache",  # Local folder for the cache
-    )
+    # Stream the file in blocks, keeping each fetched block in a size-bounded
+    # cache keyed by the file's ETag, so later opens (from any kernel) reuse
+    # them and a re-uploaded file is never served stale bytes
+    cache = BlockCache(cache_dir, info["etag"], max_bytes=max_cache_bytes, size=info["size"])
+    byte_stream = remfile.File(info["s3_url"], disk_cache=cache, _size=info["size"])
 
     # Next, open the file with NWBHDF5IO
-    file_system = fs.open(s3_url, "rb")
-    file = File(file_system, mode="r")
+    file = File(byte_stream, mode="r")
     io = NWBHDF5IO(file=file, load_namespaces=True)
 
     microns_data = io.read()
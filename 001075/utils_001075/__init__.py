@@ -1,4 +1,7 @@
 from ._waterfall import plot_waterfall
 from ._stream_nwbfile import stream_nwbfile
+from ._read_ahead import read_ahead
+from ._open_nwb import open_nwb
+from ._handle_pool import NWBHandlePool, get_pool, pooled_nwbfile
 
-__all__ = ["plot_waterfall", "stream_nwbfile"]
\ No newline at end of file
+__all__ = ["plot_waterfall", "stream_nwbfile", "read_ahead", "open_nwb", "NWBHandlePool", "get_pool", "pooled_nwbfile"]
\ No newline at end of file
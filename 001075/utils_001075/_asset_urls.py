@@ -0,0 +1,420 @@
+"""Resolve DANDI asset paths to content URLs with one pooled client and a cache.
+
+Every `stream_nwbfile`-style helper used to open a fresh `DandiAPIClient` and
+look the asset up over the network on each call, which costs a few round
+trips (and seconds) per file when a notebook loops over many sessions. An
+`AssetURLResolver` keeps one client, and so one pooled HTTP session, for the
+life of the kernel and remembers every (dandiset, version, path) -> URL it has
+seen:
+
+* in memory, in a small LRU;
+* on disk, in a JSON file (``DANDI_ASSET_URL_CACHE``, default
+  ``~/.cache/dandi-asset-urls.json``). Entries for published versions never
+  expire; draft entries expire after ``DANDI_ASSET_URL_TTL`` seconds (default
+  one day), since a draft path can be re-uploaded. Expired entries are
+  dropped whenever the file is written, and so are the least recently
+  resolved ones beyond ``MAX_DISK_ENTRIES``.
+
+The version "published" stands for the dandiset's most recent published
+version (as when `DandiAPIClient.get_dandiset` is given no version), looked
+up once per ``DANDI_ASSET_URL_TTL`` unless a manifest pins the dandiset
+(see below).
+
+`urls` and `urls_matching` resolve many paths with a single paginated listing
+of their common path prefix instead of one lookup per path, and cache every
+asset the listing returns.
+
+A manifest pins a dandiset to one version and resolves it with no API traffic
+at all. `write_manifest` records the content URL, S3 URL, size and ETag of
+every asset under a path prefix in a JSON file, which can be checked in next
+to a notebook. A resolver loads ``DANDI_ASSET_MANIFEST`` (default
+``dandi-assets.json`` in the working directory) if it exists, and
+`load_manifest` adds more. Lookups of the pinned version, and of "draft"
+and "published" (what the helpers ask for), are then served from the
+manifest without any API call; the first such "draft" or "published"
+lookup logs a warning naming the pinned version.
+Run this file (``dandi_asset_urls.py`` in most folders) to write one:
+
+    python dandi_asset_urls.py 000458 --version 0.230317.0039 -o dandi-assets.json
+
+This file is vendored unchanged next to each helper that needs it (it cannot
+be shared across dandiset folders, which Colab fetches independently); keep
+the copies identical.
+"""
+
+from __future__ import annotations
+
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urljoin
+
+from dandi.dandiapi import DandiAPIClient
+from dandi.exceptions import NotFoundError
+
+CACHE_FILE = Path(
+    os.environ.get(
+        "DANDI_ASSET_URL_CACHE", Path.home() / ".cache" / "dandi-asset-urls.json"
+    )
+)
+TTL = float(os.environ.get("DANDI_ASSET_URL_TTL", 24 * 3600))
+MAX_ENTRIES = 4096
+MAX_DISK_ENTRIES = 65536
+MANIFEST_FILE = Path(os.environ.get("DANDI_ASSET_MANIFEST", "dandi-assets.json"))
+HEAD_WORKERS = 8
+
+logger = logging.getLogger(__name__)
+
+
+class AssetURLResolver:
+    """Memoized path -> content URL lookups for one DANDI instance.
+
+    Parameters
+    ----------
+    cache_file : Path or None
+        On-disk cache; None keeps the cache in memory only.
+    ttl : float
+        Seconds a draft-version entry stays valid.
+    max_entries : int
+        Size of the in-memory LRU.
+    manifest : Path or None
+        Manifest to load, if the file exists.
+    """
+
+    def __init__(self, cache_file: Path | None = CACHE_FILE, ttl: float = TTL,
+                 max_entries: int = MAX_ENTRIES, manifest: Path | None = MANIFEST_FILE):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._client = None
+        self._lock = threading.RLock()
+        self._lru: OrderedDict[str, dict] = OrderedDict()
+        self._disk = self._load()
+        self._pinned: dict[str, dict] = {}
+        self._pins: dict[str, str] = {}  # dandiset ID -> manifest version
+        self._warned: set[str] = set()
+        if manifest is not None and Path(manifest).exists():
+            self.load_manifest(manifest)
+
+    @property
+    def client(self) -> DandiAPIClient:
+        with self._lock:
+            if self._client is None:
+                self._client = DandiAPIClient()
+            return self._client
+
+    # -- cache ---------------------------------------------------------------
+
+    @staticmethod
+    def _key(dandiset_id: str, version: str, path: str) -> str:
+        return f"{dandiset_id}/{version}/{path}"
+
+    def _load(self) -> dict[str, dict]:
+        if self.cache_file is None:
+            return {}
+        try:
+            return json.loads(self.cache_file.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _prune(self) -> None:
+        """Drop expired draft entries, then the oldest beyond MAX_DISK_ENTRIES."""
+        now = time.time()
+        expired = [
+            key for key, entry in self._disk.items()
+            if key.split("/")[1] in ("draft", "published") and now - entry["t"] >= self.ttl
+        ]
+        for key in expired:
+            del self._disk[key]
+        if len(self._disk) > MAX_DISK_ENTRIES:
+            keep = sorted(self._disk, key=lambda k: self._disk[k]["t"])[-MAX_DISK_ENTRIES:]
+            self._disk = {key: self._disk[key] for key in keep}
+
+    def _save(self) -> None:
+        if self.cache_file is None:
+            return
+        self._prune()
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.cache_file.with_name(f".{self.cache_file.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(self._disk))
+            tmp.replace(self.cache_file)
+        except OSError:
+            pass  # read-only home: keep working from memory
+
+    def _fresh(self, entry: dict, version: str) -> bool:
+        return version != "draft" or time.time() - entry["t"] < self.ttl
+
+    def _get(self, key: str, version: str) -> dict | None:
+        with self._lock:
+            if key in self._pinned:
+                return self._pinned[key]
+            entry = self._lru.get(key)
+            if entry is None:
+                entry = self._disk.get(key)
+            if entry is None or not self._fresh(entry, version):
+                return None
+            self._lru[key] = entry
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+            return entry
+
+    def _put(self, entries: dict[str, dict]) -> None:
+        with self._lock:
+            for key, entry in entries.items():
+                self._disk[key] = entry
+                self._lru[key] = entry
+                self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+            self._save()
+
+    # -- manifests -----------------------------------------------------------
+
+    def _version(self, dandiset_id: str, version: str) -> str:
+        """The version to look up: the manifest's for "draft" and "published"
+        lookups of a pinned dandiset (with no API call), otherwise the most
+        recent published one for "published"."""
+        if version in ("draft", "published") and dandiset_id in self._pins:
+            pinned = self._pins[dandiset_id]
+            if dandiset_id not in self._warned:
+                self._warned.add(dandiset_id)
+                logger.warning("resolving %s assets of %s from the manifest of version %s",
+                               version, dandiset_id, pinned)
+            return pinned
+        if version == "published":
+            return self.published_version(dandiset_id)
+        return version
+
+    def published_version(self, dandiset_id: str) -> str:
+        """Most recent published version of `dandiset_id` ("draft" if none)."""
+        key = f"{dandiset_id}/published"
+        with self._lock:
+            entry = self._disk.get(key)
+            if entry is not None and time.time() - entry["t"] < self.ttl:
+                return entry["version"]
+        version = self.client.get_dandiset(dandiset_id).version_id
+        self._put({key: {"version": version, "t": time.time()}})
+        return version
+
+    def load_manifest(self, path: str | Path) -> None:
+        """Serve the dandiset version recorded in the manifest at `path` from it."""
+        manifest = json.loads(Path(path).read_text())
+        dandiset_id, version = manifest["dandiset_id"], manifest["version"]
+        with self._lock:
+            for p, entry in manifest["assets"].items():
+                self._pinned[self._key(dandiset_id, version, p)] = entry
+            self._pins[dandiset_id] = version
+
+    def write_manifest(self, dandiset_id: str, version: str, path: str | Path,
+                       prefix: str = "", pattern: str | None = None) -> dict:
+        """Write a manifest of the assets of `dandiset_id`/`version` under `prefix`.
+
+        One paginated listing, plus two small requests per asset (run
+        concurrently; see `_head`) for its S3 URL, size and ETag.
+
+        Parameters
+        ----------
+        dandiset_id : str
+            Dandiset ID
+        version : str
+            Dandiset version; pin a published one, so the manifest stays valid.
+        path : str or Path
+            File to write.
+        prefix : str
+            Only list assets under this path prefix.
+        pattern : str, optional
+            Only keep assets whose path matches this glob.
+
+        Returns
+        -------
+        manifest : dict
+            What was written.
+        """
+        listed = self._list(dandiset_id, version, prefix)
+        entries = {p: e for p, e in sorted(listed.items())
+                   if pattern is None or fnmatch.fnmatchcase(p, pattern)}
+        entries = self._with_head(dandiset_id, version, entries)
+        manifest = {
+            "dandiset_id": dandiset_id,
+            "version": version,
+            "generated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "assets": {
+                p: {k: e[k] for k in ("url", "s3_url", "size", "etag")}
+                for p, e in entries.items()
+            },
+        }
+        path = Path(path)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(manifest, indent=1) + "\n")
+        tmp.replace(path)
+        return manifest
+
+    # -- lookups -------------------------------------------------------------
+
+    def _list(self, dandiset_id: str, version: str, prefix: str) -> dict[str, dict]:
+        """Cache entries for every asset under `prefix`, from one paginated listing."""
+        dandiset = self.client.get_dandiset(dandiset_id, version)
+        now = time.time()
+        listed = {}
+        for asset in dandiset.get_assets_with_path_prefix(prefix):
+            url = f"{self.client.api_url}/assets/{asset.identifier}/download/"
+            old = self._disk.get(self._key(dandiset_id, version, asset.path))
+            # Same asset ID means same content: keep what `_head` learned.
+            listed[asset.path] = dict(old, t=now) if old and old["url"] == url else {
+                "url": url, "t": now}
+        self._put({self._key(dandiset_id, version, p): e for p, e in listed.items()})
+        return listed
+
+    def _head(self, url: str) -> dict:
+        """Look up where the API download URL redirects, with the pooled session.
+
+        Returns the S3 URL (query stripped) and the object's ETag and size.
+        The redirect goes to a URL presigned for GET, on which S3 answers a
+        HEAD with 403, so the redirect is read, not followed, and the ETag
+        and size come from a 1-byte ranged GET of it.
+        """
+        session = self.client.session
+        r = session.get(url, allow_redirects=False, stream=True)
+        r.close()
+        if r.is_redirect:
+            target = urljoin(url, r.headers["Location"])
+        else:
+            r.raise_for_status()
+            target = url  # served in place, e.g. by a mirror
+        r = session.get(target, headers={"Range": "bytes=0-0"}, stream=True)
+        r.close()
+        r.raise_for_status()
+        if r.status_code == 206:
+            size = int(r.headers["Content-Range"].rsplit("/", 1)[1])
+        else:
+            size = int(r.headers.get("Content-Length", -1))
+        return {
+            "s3_url": target.split("?", 1)[0],
+            "etag": r.headers.get("ETag", "").strip('"'),
+            "size": size,
+        }
+
+    def urls(self, dandiset_id: str, paths: list[str], version: str = "draft",
+             s3: bool = False) -> dict[str, str]:
+        """Content URLs for `paths`, listing the dandiset at most once.
+
+        Parameters
+        ----------
+        dandiset_id : str
+            Dandiset ID
+        paths : list of str
+            Asset paths within the dandiset
+        version : str
+            Dandiset version
+        s3 : bool
+            Return the S3 URL the API download URL redirects to (query
+            stripped) instead of the API URL itself.
+
+        Returns
+        -------
+        urls : dict
+            Asset path -> URL, in the order of `paths`
+        """
+        version = self._version(dandiset_id, version)
+        entries = {p: self._get(self._key(dandiset_id, version, p), version) for p in paths}
+        missing = [p for p, e in entries.items() if e is None]
+        if missing:
+            listed = self._list(dandiset_id, version, os.path.commonprefix(missing))
+            for p in missing:
+                if p not in listed:
+                    raise NotFoundError(f"No asset at path {p!r} in {dandiset_id}/{version}")
+                entries[p] = listed[p]
+        if not s3:
+            return {p: e["url"] for p, e in entries.items()}
+        return {p: e["s3_url"] for p, e in self._with_head(dandiset_id, version, entries).items()}
+
+    def _with_head(self, dandiset_id: str, version: str,
+                   entries: dict[str, dict]) -> dict[str, dict]:
+        missing = [p for p, entry in entries.items() if "s3_url" not in entry]
+        if not missing:
+            return entries
+        with ThreadPoolExecutor(max_workers=HEAD_WORKERS) as pool:
+            heads = pool.map(self._head, [entries[p]["url"] for p in missing])
+            for p, head in zip(missing, heads):
+                entries[p] = dict(entries[p], **head)
+        self._put({self._key(dandiset_id, version, p): entries[p] for p in missing})
+        return entries
+
+    def url(self, dandiset_id: str, path: str, version: str = "draft",
+            s3: bool = False) -> str:
+        """Content URL of one asset; see `urls`."""
+        return self.urls(dandiset_id, [path], version, s3=s3)[path]
+
+    def info(self, dandiset_id: str, path: str, version: str = "draft") -> dict:
+        """API URL, S3 URL, ETag and size of one asset, cached like the URLs.
+
+        The ETag identifies the content, so it is a safe key for caching
+        bytes of the file across kernels; the size spares a remote reader
+        its own length request.
+        """
+        version = self._version(dandiset_id, version)
+        self.url(dandiset_id, path, version)
+        entry = self._get(self._key(dandiset_id, version, path), version)
+        return dict(self._with_head(dandiset_id, version, {path: entry})[path])
+
+    def urls_matching(self, dandiset_id: str, pattern: str, version: str = "draft",
+                      s3: bool = False) -> dict[str, str]:
+        """Content URLs of the assets whose path matches the glob `pattern`.
+
+        Always lists (the set of matches may have changed), but only the part
+        of the dandiset under the pattern's literal prefix; a pinned version
+        is matched against its manifest instead.
+        """
+        version = self._version(dandiset_id, version)
+        head = f"{dandiset_id}/{version}/"
+        pinned = [k[len(head):] for k in self._pinned if k.startswith(head)]
+        if pinned:
+            matches = sorted(p for p in pinned if fnmatch.fnmatchcase(p, pattern))
+            return self.urls(dandiset_id, matches, version, s3=s3)
+        prefix = pattern
+        for i, char in enumerate(pattern):
+            if char in "*?[":
+                prefix = pattern[:i]
+                break
+        listed = self._list(dandiset_id, version, prefix)
+        matches = sorted(p for p in listed if fnmatch.fnmatchcase(p, pattern))
+        return self.urls(dandiset_id, matches, version, s3=s3)
+
+
+_default: AssetURLResolver | None = None
+
+
+def get_resolver() -> AssetURLResolver:
+    """The process-wide resolver shared by all helpers."""
+    global _default
+    if _default is None:
+        _default = AssetURLResolver()
+    return _default
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Write a manifest of a dandiset's asset URLs.")
+    parser.add_argument("dandiset_id")
+    parser.add_argument("--version", required=True,
+                        help="Version to pin (a published one stays valid)")
+    parser.add_argument("--prefix", default="", help="Only assets under this path prefix")
+    parser.add_argument("--pattern", help="Only assets whose path matches this glob")
+    parser.add_argument("-o", "--output", type=Path, default=MANIFEST_FILE)
+    args = parser.parse_args()
+    manifest = get_resolver().write_manifest(
+        args.dandiset_id, args.version, args.output, prefix=args.prefix, pattern=args.pattern
+    )
+    print(f"{len(manifest['assets'])} assets -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
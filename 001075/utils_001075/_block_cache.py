@@ -0,0 +1,127 @@
+"""Persistent, size-bounded block cache for `remfile.File`.
+
+`remfile` fetches a file in fixed-size blocks and can keep them in any object
+with ``get(key)``/``set(key, value)``. Its own `remfile.DiskCache` keys blocks
+by URL and never evicts; `BlockCache` keys them by the content's ETag instead
+(so a re-uploaded asset never serves stale bytes, and two URLs for the same
+blob share blocks) and keeps the whole cache directory under ``max_bytes``,
+evicting the least recently used blocks first.
+
+Layout::
+
+    <root>/<etag>/<block size>/<block index>
+
+Blocks are written to a temporary file and renamed into place, so kernels
+sharing a cache directory never read a torn block; eviction tolerates blocks
+disappearing under it. Given the file's size, a block of the wrong length (a
+truncated write on a filesystem without atomic renames, a damaged disk) is
+discarded and fetched again rather than served.
+
+This file is vendored unchanged next to each helper that needs it; keep the
+copies identical.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import threading
+from pathlib import Path
+
+DEFAULT_MAX_BYTES = 10 * 2**30
+
+
+class BlockCache:
+    """`remfile` disk cache for one file's blocks.
+
+    Parameters
+    ----------
+    root : str or Path
+        Cache directory, shared by all files.
+    etag : str
+        ETag of the file the blocks belong to.
+    max_bytes : int
+        Size bound for everything under `root`.
+    size : int, optional
+        Size of the file, to check the length of every block read back.
+    """
+
+    def __init__(self, root: str | Path, etag: str, max_bytes: int = DEFAULT_MAX_BYTES,
+                 size: int | None = None):
+        if not etag:
+            raise ValueError("BlockCache needs the file's ETag to key its blocks")
+        self.root = Path(root)
+        self.dir = self.root / re.sub(r"[^A-Za-z0-9_-]", "_", etag)
+        self.max_bytes = max_bytes
+        self.size = size
+        self._written = 0
+
+    def _path(self, key: str) -> Path:
+        # remfile's keys are "<url>|<block size>|<block index>".
+        _, block_size, index = key.rsplit("|", 2)
+        return self.dir / block_size / index
+
+    def _valid(self, key: str, data: bytes) -> bool:
+        if self.size is None or self.size < 0:
+            return True
+        _, block_size, index = key.rsplit("|", 2)
+        start = int(index) * int(block_size)
+        return len(data) == max(0, min(int(block_size), self.size - start))
+
+    def __contains__(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        if not self._valid(key, data):
+            path.unlink(missing_ok=True)
+            return None
+        try:
+            os.utime(path)  # mtime is the LRU clock
+        except OSError:
+            pass
+        return data
+
+    def set(self, key: str, value: bytes) -> None:
+        if not self._valid(key, value):
+            return
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(value)
+            tmp.replace(path)
+        except OSError:
+            return  # a full or read-only disk only costs us the cache
+        self._written += len(value)
+        # Sweeping walks the whole cache, so only do it every tenth of the budget.
+        if self._written > self.max_bytes // 10:
+            self._written = 0
+            self.evict()
+
+    def evict(self) -> None:
+        """Delete least recently used blocks until the cache is under 90% of its bound."""
+        blocks = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                blocks.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in blocks)
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(blocks):
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= 0.9 * self.max_bytes:
+                break
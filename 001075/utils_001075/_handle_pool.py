@@ -0,0 +1,199 @@
+"""A bounded, reference-counted pool of open remote NWB files.
+
+Every open remote NWB file holds an h5py file, its reader's caches, a
+connection pool and (with remfile) a buffer of fetched blocks. A long
+notebook session that opens a file per cell, and never closes them, piles
+those up. `NWBHandlePool` instead
+
+* reuses the open file when the same asset is requested again;
+* counts the users of each file: `acquire`/`release`, or the `nwbfile`
+  context manager, which does both;
+* keeps at most ``max_open`` files open, closing the least recently used
+  idle ones (no users left) to make room, and making a new request wait
+  while every open file is in use.
+
+`get_pool()` is the process-wide pool `pooled_nwbfile` uses, holding its
+file for the duration of its block. `stream_nwbfile` does not use it: the
+file it returns must stay valid for as long as the caller keeps it.
+"""
+
+from __future__ import annotations
+
+import atexit
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Hashable
+
+import pynwb
+
+from ._block_cache import DEFAULT_MAX_BYTES
+from ._open_nwb import Backend, open_nwb
+
+MAX_OPEN = 16
+WAIT_SECONDS = 60.0
+
+
+class _Handle:
+    def __init__(self):
+        self.io: pynwb.NWBHDF5IO | None = None
+        self.nwbfile: pynwb.NWBFile | None = None
+        self.refs = 1
+        self.error: BaseException | None = None
+        self.ready = threading.Event()
+
+
+class NWBHandlePool:
+    """Open NWB files shared by key, at most `max_open` at a time.
+
+    Parameters
+    ----------
+    max_open : int
+        Number of files kept open, in use or idle.
+    wait : float
+        Seconds `acquire` waits for a file to become idle when all
+        `max_open` are in use, before raising RuntimeError.
+    """
+
+    def __init__(self, max_open: int = MAX_OPEN, wait: float = WAIT_SECONDS):
+        self.max_open = max_open
+        self.wait = wait
+        self._handles: OrderedDict[Hashable, _Handle] = OrderedDict()
+        self._keys: dict[int, Hashable] = {}  # id(nwbfile) -> key
+        self._cond = threading.Condition()
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._handles)
+
+    def acquire(self, key: Hashable, opener: Callable[[], pynwb.NWBHDF5IO]) -> pynwb.NWBFile:
+        """The NWBFile open under `key`, opening it with `opener()` if needed.
+
+        Every `acquire` must be matched by a `release` of the returned file.
+        """
+        deadline = time.monotonic() + self.wait
+        with self._cond:
+            while True:
+                handle = self._handles.get(key)
+                if handle is not None:  # open, or being opened by another thread
+                    handle.refs += 1
+                    self._handles.move_to_end(key)
+                    opening = False
+                    break
+                self._close_idle(keep=self.max_open - 1)
+                if len(self._handles) < self.max_open:
+                    handle = self._handles[key] = _Handle()
+                    opening = True
+                    break
+                if not self._cond.wait(timeout=deadline - time.monotonic()):
+                    raise RuntimeError(
+                        f"all {self.max_open} pooled NWB files are in use; release some "
+                        "or create the pool with a larger max_open"
+                    )
+
+        if not opening:
+            handle.ready.wait()
+            if handle.error is not None:
+                raise handle.error
+            return handle.nwbfile
+        # Open outside the lock: it takes seconds, and other keys need not wait.
+        try:
+            io = opener()
+            handle.nwbfile = io.read()
+            handle.io = io
+        except BaseException as e:
+            with self._cond:
+                handle.error = e
+                del self._handles[key]
+                self._cond.notify_all()
+            handle.ready.set()
+            raise
+        with self._cond:
+            self._keys[id(handle.nwbfile)] = key
+        handle.ready.set()
+        return handle.nwbfile
+
+    def release(self, nwbfile: pynwb.NWBFile) -> None:
+        """Give back a file from `acquire`; it stays open, idle, for reuse.
+
+        Releasing a file the pool no longer holds (released and closed, or
+        closed by `close_all`) or one with no users left does nothing.
+        """
+        with self._cond:
+            key = self._keys.get(id(nwbfile))
+            handle = self._handles.get(key) if key is not None else None
+            if handle is None or handle.refs == 0:
+                return
+            handle.refs -= 1
+            if handle.refs == 0:
+                self._close_idle(keep=self.max_open)
+                self._cond.notify_all()
+
+    @contextmanager
+    def nwbfile(self, key: Hashable, opener: Callable[[], pynwb.NWBHDF5IO]):
+        """``with pool.nwbfile(key, opener) as nwbfile:`` -- acquire, then release."""
+        nwbfile = self.acquire(key, opener)
+        try:
+            yield nwbfile
+        finally:
+            self.release(nwbfile)
+
+    def _close_idle(self, keep: int) -> None:
+        # Least recently used first; caller holds the lock.
+        for key in [k for k, h in self._handles.items() if h.refs == 0]:
+            if len(self._handles) <= keep:
+                break
+            handle = self._handles.pop(key)
+            self._keys.pop(id(handle.nwbfile), None)
+            handle.io.close()
+
+    def close_idle(self) -> None:
+        """Close every file nobody is using."""
+        with self._cond:
+            self._close_idle(keep=0)
+
+    def close_all(self) -> None:
+        """Close every file, in use or not (e.g. at the end of a session)."""
+        with self._cond:
+            for handle in self._handles.values():
+                if handle.io is not None:
+                    handle.io.close()
+            self._handles.clear()
+            self._keys.clear()
+            self._cond.notify_all()
+
+
+_default: NWBHandlePool | None = None
+
+
+def get_pool() -> NWBHandlePool:
+    """The process-wide pool shared by all helpers."""
+    global _default
+    if _default is None:
+        _default = NWBHandlePool()
+        atexit.register(_default.close_all)
+    return _default
+
+
+@contextmanager
+def pooled_nwbfile(
+    asset: str | tuple[str, str],
+    backend: Backend = "remfile",
+    version: str = "draft",
+    cache_dir: str | None = None,
+    max_cache_bytes: int = DEFAULT_MAX_BYTES,
+):
+    """``with pooled_nwbfile(asset) as nwbfile:`` -- `open_nwb` through the shared pool.
+
+    Leaving the block does not close the file: it stays open, idle, so the
+    next block asking for the same asset reuses it, until the pool needs room.
+    See `open_nwb` for the parameters.
+    """
+    key = (asset, backend, version, cache_dir)
+    with get_pool().nwbfile(
+        key,
+        lambda: open_nwb(asset, backend=backend, version=version, cache_dir=cache_dir,
+                         max_cache_bytes=max_cache_bytes),
+    ) as nwbfile:
+        yield nwbfile
@@ -0,0 +1,151 @@
+"""One entry point for the ways the notebooks stream remote NWB files.
+
+The notebooks in this repository stream HDF5 over HTTP in four different ways:
+
+* ``remfile``: ``h5py.File(remfile.File(url))``, fetching fixed-size blocks
+  with ``requests`` (here, through `BlockPrefetcher`, so `read_ahead` and the
+  persistent `BlockCache` work);
+* ``fsspec``: ``h5py.File`` on an fsspec HTTP file, optionally wrapped in a
+  ``CachingFileSystem`` (as in the MICrONS coregistration notebook);
+* ``lindi``: ``lindi.LindiH5pyFile``, which reads the file's metadata into a
+  reference file system once and fetches chunks on demand (as in 000458);
+* ``ros3``: HDF5's own read-only S3 driver (as in the BruntonLab scripts),
+  when h5py was built with it.
+
+`open_nwb(asset, backend=...)` opens an asset with any of them, so they can be
+swapped (and benchmarked against each other, see
+``.github/scripts/benchmark_streaming.py``) without touching the analysis.
+"""
+
+from __future__ import annotations
+
+from typing import Literal
+
+import h5py
+import pynwb
+import remfile
+
+from ._asset_urls import get_resolver
+from ._block_cache import DEFAULT_MAX_BYTES, BlockCache
+from ._read_ahead import BlockPrefetcher
+
+Backend = Literal["remfile", "fsspec", "lindi", "ros3"]
+BACKENDS = ("remfile", "fsspec", "lindi", "ros3")
+
+# remfile's block size, fixed so the prefetcher fetches the same blocks.
+BLOCK_SIZE = 100 * 1024
+
+
+def open_file(
+    url: str,
+    backend: Backend = "remfile",
+    cache_dir: str | None = None,
+    info: dict | None = None,
+    max_cache_bytes: int = DEFAULT_MAX_BYTES,
+):
+    """Open the remote HDF5 file at `url` read-only with `backend`.
+
+    Parameters
+    ----------
+    url : str
+        URL of the file (preferably the S3 URL, which spares every request a
+        redirect).
+    backend : {"remfile", "fsspec", "lindi", "ros3"}
+        Streaming library to read it with.
+    cache_dir : str, optional
+        Directory for the backend's cache of fetched bytes (ignored by ros3).
+    info : dict, optional
+        The asset's ``AssetURLResolver.info``. With it, remfile skips its
+        length request and keys its block cache by the content's ETag.
+    max_cache_bytes : int
+        Size bound of remfile's block cache.
+
+    Returns
+    -------
+    file : h5py.File or lindi.LindiH5pyFile
+        h5py-compatible file, to pass to `pynwb.NWBHDF5IO(file=...)`
+    """
+    if backend == "remfile":
+        if info is None:
+            disk_cache = remfile.DiskCache(cache_dir) if cache_dir is not None else None
+            return h5py.File(remfile.File(url, disk_cache=disk_cache), "r")
+        block_cache = None
+        if cache_dir is not None:
+            block_cache = BlockCache(root=cache_dir, etag=info["etag"], max_bytes=max_cache_bytes,
+                                     size=info["size"])
+        prefetcher = BlockPrefetcher(
+            url=url,
+            fetch_url=url,
+            length=info["size"],
+            block_size=BLOCK_SIZE,
+            session=get_resolver().client.session,
+            inner=block_cache,
+        )
+        byte_stream = remfile.File(
+            url=url,
+            disk_cache=prefetcher,
+            _min_chunk_size=BLOCK_SIZE,
+            _size=info["size"],  # cached with the ETag: no length request on reopen
+        )
+        prefetcher.attach(byte_stream)
+        return h5py.File(byte_stream, "r")
+    if backend == "fsspec":
+        import fsspec
+        from fsspec.implementations.cached import CachingFileSystem
+
+        fs = fsspec.filesystem("http")
+        if cache_dir is not None:
+            fs = CachingFileSystem(fs=fs, cache_storage=cache_dir)
+        return h5py.File(fs.open(url, "rb"), "r")
+    if backend == "lindi":
+        import lindi
+
+        local_cache = lindi.LocalCache(cache_dir=cache_dir) if cache_dir is not None else None
+        return lindi.LindiH5pyFile.from_hdf5_file(url, local_cache=local_cache)
+    if backend == "ros3":
+        if "ros3" not in h5py.registered_drivers():
+            raise ValueError("this h5py was built without the ros3 driver")
+        return h5py.File(url, "r", driver="ros3")
+    raise ValueError(f"Unknown backend {backend!r}; expected one of {BACKENDS}")
+
+
+def open_nwb(
+    asset: str | tuple[str, str],
+    backend: Backend = "remfile",
+    version: str = "draft",
+    cache_dir: str | None = None,
+    max_cache_bytes: int = DEFAULT_MAX_BYTES,
+    info: dict | None = None,
+) -> pynwb.NWBHDF5IO:
+    """Open a remote NWB file with the streaming `backend` of your choice.
+
+    Parameters
+    ----------
+    asset : str or (str, str)
+        URL of the file, or ``(dandiset_id, path)`` of a DANDI asset.
+    backend : {"remfile", "fsspec", "lindi", "ros3"}
+        Streaming library to read it with; see `open_file`.
+    version : str
+        Dandiset version, when `asset` is a DANDI path.
+    cache_dir : str, optional
+        Directory for the backend's cache of fetched bytes.
+    max_cache_bytes : int
+        Size bound of remfile's block cache.
+    info : dict, optional
+        Size and ETag of the file, as in ``AssetURLResolver.info``, when
+        `asset` is a URL; see `open_file`. Looked up for a DANDI path.
+
+    Returns
+    -------
+    io : pynwb.NWBHDF5IO
+        Open reader; ``io.read()`` gives the NWBFile, and the io should be
+        closed after use (e.g. ``with open_nwb(...) as io:``).
+    """
+    if isinstance(asset, str):
+        url = asset
+    else:
+        dandiset_id, path = asset
+        info = get_resolver().info(dandiset_id=dandiset_id, path=path, version=version)
+        url = info["s3_url"]
+    file = open_file(url, backend, cache_dir=cache_dir, info=info, max_cache_bytes=max_cache_bytes)
+    return pynwb.NWBHDF5IO(file=file, mode="r", load_namespaces=True)
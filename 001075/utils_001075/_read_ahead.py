@@ -0,0 +1,278 @@
+"""Read-ahead for sequential slice reads of remote HDF5 datasets.
+
+Reading a remote dataset one slice at a time (a column per ROI, a window per
+step) is a serial chain of HTTP round trips: h5py asks for one chunk, waits,
+asks for the next. `read_ahead(dataset, plan)` takes the whole access plan up
+front and yields ``dataset[selection]`` for each selection in turn, while
+
+* the next selection is already being read by a background thread, so I/O
+  overlaps with whatever the caller does with the current one; and
+* when the file was opened through a `BlockPrefetcher` (see
+  ``stream_nwbfile``), the HDF5 chunks of the following selections are
+  fetched concurrently, as coalesced range requests, straight into the
+  blocks the remote file will ask for next.
+
+Without a prefetcher (a local file, ros3, lindi, ...) only the first applies.
+
+This file is vendored unchanged next to each script that needs it; keep the
+copies identical.
+"""
+
+from __future__ import annotations
+
+import itertools
+import numbers
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+DEFAULT_DEPTH = 2  # selections whose chunks are fetched ahead of the current one
+FETCH_WORKERS = 8
+MAX_BLOCKS_PER_REQUEST = 16
+MAX_PREFETCHED_BYTES = 256 * 2**20
+
+# h5py names a file opened from a file object after the object's repr, which
+# is how a dataset finds the prefetcher of the remote file under it.
+_prefetchers: weakref.WeakValueDictionary[str, BlockPrefetcher] = weakref.WeakValueDictionary()
+
+
+class BlockPrefetcher:
+    """A `remfile` disk cache that can be filled ahead of the reads.
+
+    Parameters
+    ----------
+    url : str
+        URL the `remfile.File` was opened with; part of its block keys.
+    fetch_url : str
+        URL to fetch byte ranges from (e.g. the S3 URL `url` redirects to).
+    length : int
+        Size of the remote file in bytes.
+    block_size : int
+        The `remfile.File`'s ``_min_chunk_size``.
+    session : requests.Session
+        Pooled session for the range requests.
+    inner : object, optional
+        Persistent cache (e.g. `BlockCache`) to read through and fill.
+    """
+
+    def __init__(self, url: str, fetch_url: str, length: int, block_size: int,
+                 session, inner=None):
+        self.url = url
+        self.fetch_url = fetch_url
+        self.length = length
+        self.block_size = block_size
+        self.session = session
+        self.inner = inner
+        self._blocks: dict[int, bytes] = {}
+        self._delivered: set[int] = set()  # handed to remfile, which keeps them
+        self._pending: dict[int, Future] = {}
+        self._chunk_tables: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+
+    def attach(self, byte_stream) -> None:
+        """Let datasets of the h5py file opened on `byte_stream` find this prefetcher."""
+        _prefetchers[repr(byte_stream)] = self
+
+    def _key(self, index: int) -> str:
+        return f"{self.url}|{self.block_size}|{index}"
+
+    # -- remfile's disk-cache interface ----------------------------------------
+
+    def get(self, key: str) -> bytes | None:
+        # Called by h5py with its global lock held: never block here (not on
+        # an in-flight fetch, not even on self._lock), since a fetch thread
+        # can itself be waiting for that lock to free an h5py object.
+        index = int(key.rsplit("|", 1)[1])
+        data = self._blocks.pop(index, None)
+        if data is not None:
+            self._delivered.add(index)
+        elif self.inner is not None:
+            data = self.inner.get(key)
+        return data
+
+    def set(self, key: str, value: bytes) -> None:
+        if self.inner is not None:
+            self.inner.set(key, value)
+
+    # -- prefetching -----------------------------------------------------------
+
+    def prefetch(self, byte_ranges: list[tuple[int, int]]) -> None:
+        """Start fetching the blocks covering `byte_ranges` ((offset, size) pairs).
+
+        At most ``MAX_PREFETCHED_BYTES`` are buffered or in flight: blocks
+        beyond that budget (the tail of a large selection) are left for the
+        reader to fetch itself.
+        """
+        bs = self.block_size
+        with self._lock:
+            budget = MAX_PREFETCHED_BYTES // bs - len(self._blocks) - len(self._pending)
+            wanted = []
+            for i in _block_indices(byte_ranges, bs):
+                if len(wanted) >= budget:
+                    break  # the reader is not keeping up; let it catch up first
+                if (
+                    i not in self._blocks and i not in self._pending
+                    and i not in self._delivered
+                    and not (self.inner is not None and self._key(i) in self.inner)
+                ):
+                    wanted.append(i)
+            if not wanted:
+                return
+            runs = []
+            for _, group in itertools.groupby(enumerate(wanted), lambda p: p[1] - p[0]):
+                run = [index for _, index in group]
+                runs += [run[i:i + MAX_BLOCKS_PER_REQUEST]
+                         for i in range(0, len(run), MAX_BLOCKS_PER_REQUEST)]
+            for run in runs:
+                future = self._pool.submit(self._fetch, run)
+                for index in run:
+                    self._pending[index] = future
+
+    def _fetch(self, run: list[int]) -> None:
+        bs = self.block_size
+        start = run[0] * bs
+        end = min((run[-1] + 1) * bs, self.length) - 1
+        try:
+            r = self.session.get(self.fetch_url, headers={"Range": f"bytes={start}-{end}"})
+            r.raise_for_status()
+            data = r.content
+            for n, index in enumerate(run):
+                block = data[n * bs:(n + 1) * bs]
+                with self._lock:
+                    self._blocks[index] = block
+                if self.inner is not None:
+                    self.inner.set(self._key(index), block)
+        finally:
+            with self._lock:
+                for index in run:
+                    self._pending.pop(index, None)
+
+    def chunk_table(self, dataset) -> dict[tuple, tuple[int, int]]:
+        """Chunk offset -> (byte offset, size) for every allocated chunk of `dataset`."""
+        table = self._chunk_tables.get(dataset.name)
+        if table is None:
+            table = {}
+            if hasattr(dataset.id, "chunk_iter"):
+                dataset.id.chunk_iter(
+                    lambda info: table.__setitem__(info.chunk_offset, (info.byte_offset, info.size))
+                )
+            else:
+                for i in range(dataset.id.get_num_chunks()):
+                    info = dataset.id.get_chunk_info(i)
+                    table[info.chunk_offset] = (info.byte_offset, info.size)
+            self._chunk_tables[dataset.name] = table
+        return table
+
+
+def _bounds(shape: tuple, selection) -> list[tuple[int, int]] | None:
+    """Per-dimension [start, stop) bounding box of an h5py selection; None if empty."""
+    if not isinstance(selection, tuple):
+        selection = (selection,)
+    selection = selection + (slice(None),) * (len(shape) - len(selection))
+    bounds = []
+    for n, sel in zip(shape, selection):
+        if isinstance(sel, slice):
+            start, stop, _ = sel.indices(n)
+        elif isinstance(sel, numbers.Integral):
+            start = int(sel) % n
+            stop = start + 1
+        else:  # list / array of indices
+            indices = [int(i) % n for i in sel]
+            if not indices:
+                return None
+            start, stop = min(indices), max(indices) + 1
+        if stop <= start:
+            return None
+        bounds.append((start, stop))
+    return bounds
+
+
+def _block_indices(byte_ranges: list[tuple[int, int]], block_size: int):
+    """Indices of the blocks covering `byte_ranges`, in order and each once."""
+    last = -1
+    for offset, size in sorted(byte_ranges):
+        stop = (offset + size - 1) // block_size + 1
+        yield from range(max(offset // block_size, last + 1), stop)
+        last = max(last, stop - 1)
+
+
+def _contiguous_ranges(offset: int, shape: tuple, itemsize: int, bounds, block_size: int):
+    """Byte ranges of the bounding box `bounds` of a row-major array at `offset`.
+
+    One range per row of the box, coalesced wherever consecutive rows fall in
+    the same or adjacent blocks (reading the gap costs no extra request).
+    """
+    strides = [itemsize] * len(shape)
+    for d in range(len(shape) - 2, -1, -1):
+        strides[d] = strides[d + 1] * shape[d + 1]
+    # Trailing dimensions selected whole join the run of the dimension before them.
+    d = len(shape) - 1
+    while d > 0 and bounds[d] == (0, shape[d]):
+        d -= 1
+    run = (bounds[d][1] - bounds[d][0]) * strides[d]
+    starts = np.full(1, offset + bounds[d][0] * strides[d], dtype=np.int64)
+    for k in range(d - 1, -1, -1):
+        starts = (np.arange(*bounds[k], dtype=np.int64)[:, None] * strides[k]
+                  + starts[None, :]).ravel()
+    first = starts // block_size
+    last = (starts + run - 1) // block_size
+    breaks = np.nonzero(first[1:] > last[:-1] + 1)[0] + 1
+    begins = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(starts)])) - 1
+    return [(int(starts[b]), int(starts[e] + run - starts[b])) for b, e in zip(begins, ends)]
+
+
+def byte_ranges(prefetcher: BlockPrefetcher, dataset, selection) -> list[tuple[int, int]]:
+    """(offset, size) byte ranges of the file that `dataset[selection]` reads."""
+    bounds = _bounds(dataset.shape, selection)
+    if not bounds:
+        return []
+    if dataset.chunks is None:
+        offset = dataset.id.get_offset()
+        if offset is None:
+            return []  # compact or unallocated: nothing worth fetching ahead
+        return _contiguous_ranges(offset, dataset.shape, dataset.dtype.itemsize, bounds,
+                                  prefetcher.block_size)
+    table = prefetcher.chunk_table(dataset)
+    coords = [
+        range(start // c * c, stop, c)
+        for (start, stop), c in zip(bounds, dataset.chunks)
+    ]
+    return [table[offset] for offset in itertools.product(*coords) if offset in table]
+
+
+def read_ahead(dataset, plan, depth: int = DEFAULT_DEPTH):
+    """Yield ``dataset[selection]`` for each selection of `plan`, reading ahead.
+
+    Parameters
+    ----------
+    dataset : h5py.Dataset
+        Dataset to read, e.g. a `TimeSeries.data`.
+    plan : iterable
+        Selections (anything `dataset[...]` accepts), in the order they will
+        be consumed.
+    depth : int
+        Number of selections beyond the current one whose chunks are fetched
+        concurrently, when the file has a `BlockPrefetcher`.
+    """
+    plan = list(plan)
+    prefetcher = _prefetchers.get(getattr(dataset.file, "filename", None))
+
+    def prefetch(i: int) -> None:
+        if prefetcher is not None and i < len(plan):
+            prefetcher.prefetch(byte_ranges(prefetcher, dataset, plan[i]))
+
+    for i in range(depth + 1):
+        prefetch(i)
+    # One reader thread: h5py serializes reads anyway, and it keeps the order.
+    with ThreadPoolExecutor(max_workers=1) as reader:
+        pending = deque(reader.submit(dataset.__getitem__, sel) for sel in plan[:1])
+        for i in range(len(plan)):
+            if i + 1 < len(plan):
+                pending.append(reader.submit(dataset.__getitem__, plan[i + 1]))
+            prefetch(i + 1 + depth)
+            yield pending.popleft().result()
@@ -1,21 +1,65 @@
+import threading
+import weakref
 from typing import Literal
 
-import dandi.dandiapi
-import h5py
 import pynwb
-import remfile
 
-def stream_nwbfile(subject_id: str, session_id: str, session_type: Literal["imaging", "segmentation"]) -> pynwb.NWBFile:
+from ._asset_urls import get_resolver
+from ._block_cache import DEFAULT_MAX_BYTES
+from ._metadata_index import open_indexed
+from ._open_nwb import open_file
+
+# Files returned by stream_nwbfile and still referenced by a caller.
+_open_files: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+_open_files_lock = threading.Lock()
+
+def stream_nwbfile(
+    subject_id: str,
+    session_id: str,
+    session_type: Literal["imaging", "segmentation"],
+    cache_dir: str | None = None,
+    max_cache_bytes: int = DEFAULT_MAX_BYTES,
+    index_dir: str | None = None,
+) -> pynwb.NWBFile:
+    """Stream one session's NWB file from DANDI.
+
+    Pass `cache_dir` to keep every byte range read in a persistent block cache
+    (bounded by `max_cache_bytes`), so reopening the file, even from a new
+    kernel, is served from disk. Either way, `read_ahead` can fetch the chunks
+    of upcoming slices of the file's datasets concurrently.
+
+    Pass `index_dir` to open the file through a LINDI index of its metadata
+    instead, built on the first open and kept in `index_dir`: later opens read
+    the index locally rather than walking the HDF5 structure over HTTP. With
+    both, `cache_dir` also holds lindi's cache of fetched chunks.
+
+    Asking again for a session whose file a caller still holds returns that
+    file rather than opening another. The file stays open as long as it is
+    referenced, however many sessions are open; to bound the number of open
+    files, use `pooled_nwbfile` instead.
+    """
     dandiset_id = "001075"
     dandifile_path = f"sub-{subject_id}/sub-{subject_id}_ses-{session_id}_desc-{session_type}_ophys+ogen.nwb"
 
-    dandi_client = dandi.dandiapi.DandiAPIClient()
-    dandiset = dandi_client.get_dandiset(dandiset_id=dandiset_id)
-    dandifile = dandiset.get_asset_by_path(path=dandifile_path)
-    s3_url = dandifile.get_content_url()
-    byte_stream = remfile.File(url=s3_url)
-    file = h5py.File(name=byte_stream)
-    io = pynwb.NWBHDF5IO(file=file)
-    nwbfile = io.read()
+    def opener() -> pynwb.NWBHDF5IO:
+        # The most recent published version, as get_dandiset() without a version gives
+        info = get_resolver().info(dandiset_id=dandiset_id, path=dandifile_path, version="published")
+        if index_dir is not None:
+            file = open_indexed(
+                url=info["s3_url"], etag=info["etag"], index_dir=index_dir, local_cache_dir=cache_dir
+            )
+        else:
+            file = open_file(
+                info["s3_url"], "remfile", cache_dir=cache_dir, info=info, max_cache_bytes=max_cache_bytes
+            )
+        return pynwb.NWBHDF5IO(file=file)
 
-    return nwbfile
\ No newline at end of file
+    key = (dandiset_id, dandifile_path, cache_dir, index_dir)
+    with _open_files_lock:
+        nwbfile = _open_files.get(key)
+    if nwbfile is None:
+        # Open outside the lock: it takes seconds, and other sessions need not wait.
+        nwbfile = opener().read()
+        with _open_files_lock:
+            _open_files[key] = nwbfile
+    return nwbfile
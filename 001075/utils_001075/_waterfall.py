@@ -6,6 +6,8 @@ import pynwb
 import scipy.signal
 import scipy.optimize
 
+from ._read_ahead import read_ahead
+
 def plot_waterfall(
     *,
     segmentation_nwbfile: pynwb.NWBFile,
@@ -80,11 +82,10 @@ def plot_waterfall(
 
     frame_vector = numpy.arange(green_signal.data.shape[0])
 
-    for k in range(number_of_rois):
+    columns = read_ahead(green_signal.data, [(slice(None), k) for k in range(number_of_rois)])
+    for k, data in enumerate(columns):
         P = numpy.array([1., 0.006, 1., 0.001, 0.2])
 
-        data = green_signal.data[:, k]
-
         max_normalized_fluorescence[k] = numpy.max(data)
         Y = numpy.copy(data) / max_normalized_fluorescence[k]
         mask = numpy.ones_like(Y, dtype=bool)
@@ -112,11 +113,18 @@ def plot_waterfall(
     plotted_neuropal_ids = []
     neuropal_label_to_colors = dict()
     baseline = []
-    for plot_index, (neuropal_label, neuropal_id) in enumerate(alphabetized_valid_neuropal_labels_with_ids):
+    roi_responses = read_ahead(
+        green_signal.data,
+        [
+            (slice(None), coregistered_neuropal_id_to_green_ids[neuropal_id])
+            for _, neuropal_id in alphabetized_valid_neuropal_labels_with_ids
+        ],
+    )
+    for plot_index, ((neuropal_label, neuropal_id), roi_response) in enumerate(
+        zip(alphabetized_valid_neuropal_labels_with_ids, roi_responses)
+    ):
         green_id = coregistered_neuropal_id_to_green_ids[neuropal_id]
 
-        roi_response = green_signal.data[:, green_id]
-
         # Remove spikes by replacing them with last non-spike data value
         spikes_corrected = numpy.copy(roi_response)
         mean = numpy.average(roi_response)
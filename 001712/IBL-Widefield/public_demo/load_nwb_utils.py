@@ -1,4 +1,8 @@
 # Core data manipulation and analysis
+import fnmatch
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from pathlib import Path
 
 # NWB access
@@ -6,35 +10,130 @@ import h5py
 
 # DANDI access
 import remfile
-from dandi.dandiapi import DandiAPIClient
 from pynwb import NWBHDF5IO
 
+from dandi_asset_urls import get_resolver
+from metadata_index import build_index, index_path, open_indexed
 
-def load_nwb_from_dandi(dandiset_id, subject_id, session_id, description):
+__all__ = ["load_nwb_from_dandi", "load_nwbs_from_dandi", "load_nwb_local"]
+
+MAX_WORKERS = 8
+
+
+def _session_pattern(subject_id, session_id, description):
+    return f"sub-{subject_id}/sub-{subject_id}_ses-{session_id}_desc-{description}*.nwb"
+
+
+def _open(info, index_dir):
+    if index_dir is not None:
+        h5_file = open_indexed(info["s3_url"], info["etag"], index_dir=index_dir)
+    else:
+        file = remfile.File(info["s3_url"])
+        h5_file = h5py.File(file, "r")
+
+    try:
+        io = NWBHDF5IO(file=h5_file, load_namespaces=True)
+        nwbfile = io.read()
+    except BaseException:
+        h5_file.close()
+        raise
+    return nwbfile, io
+
+
+def load_nwb_from_dandi(dandiset_id, subject_id, session_id, description, index_dir=None):
     """
     Load NWB file from DANDI Archive via streaming.
+
+    With `index_dir`, the file is opened through a LINDI index of its metadata,
+    built on the first open and kept in `index_dir`, so later opens skip
+    walking the HDF5 structure over HTTP.
     """
-    pattern = f"sub-{subject_id}/sub-{subject_id}_ses-{session_id}_desc-{description}*.nwb"
+    pattern = _session_pattern(subject_id, session_id, description)
 
-    with DandiAPIClient() as client:
-        assets = client.get_dandiset(dandiset_id, "draft").get_assets_by_glob(pattern=pattern, order="path")
+    resolver = get_resolver()
+    paths = list(resolver.urls_matching(dandiset_id, pattern))
+    if len(paths) != 1:
+        raise ValueError(f"Expected 1 file, found {len(paths)} for pattern {pattern}")
 
-        s3_urls = []
-        for asset in assets:
-            s3_url = asset.get_content_url(follow_redirects=1, strip_query=False)
-            s3_urls.append(s3_url)
+    return _open(resolver.info(dandiset_id, paths[0]), index_dir)
 
-        if len(s3_urls) != 1:
-            raise ValueError(f"Expected 1 file, found {len(s3_urls)} for pattern {pattern}")
 
-        s3_url = s3_urls[0]
+def load_nwbs_from_dandi(dandiset_id, sessions, index_dir=None, max_workers=MAX_WORKERS):
+    """
+    Load many NWB files from DANDI Archive concurrently, yielding each as it is ready.
 
-    file = remfile.File(s3_url)
-    h5_file = h5py.File(file, "r")
-    io = NWBHDF5IO(file=h5_file, load_namespaces=True)
-    nwbfile = io.read()
+    `sessions` is a list of (subject_id, session_id, description) tuples. All
+    of them are resolved with one listing of the dandiset, then opened in
+    parallel: indexes missing from `index_dir` (see `load_nwb_from_dandi`;
+    e.g. `metadata_index.INDEX_DIR`) are built in worker processes, and the
+    files are opened from their indexes in threads. With `index_dir=None`,
+    the default, the files are streamed with remfile from threads, which
+    overlap little, since h5py serializes reads.
 
-    return nwbfile, io
+    Yields (session, nwbfile, io) in the order the files become ready; close
+    each io after use. If a file fails to open, the error is raised once the
+    opens under way have finished, and every file opened so far, yielded or
+    not, is closed; stopping early closes the files not yet yielded.
+    """
+    sessions = [tuple(session) for session in sessions]
+    patterns = {session: _session_pattern(*session) for session in sessions}
+
+    resolver = get_resolver()
+    listing_prefix = os.path.commonprefix([p.split("*", 1)[0] for p in patterns.values()])
+    listed = resolver.urls_matching(dandiset_id, listing_prefix + "*")
+    paths = {}
+    for session, pattern in patterns.items():
+        matches = [p for p in listed if fnmatch.fnmatchcase(p, pattern)]
+        if len(matches) != 1:
+            raise ValueError(f"Expected 1 file, found {len(matches)} for pattern {pattern}")
+        paths[session] = matches[0]
+    resolver.urls(dandiset_id, list(paths.values()), s3=True)  # HEADs in one batch
+    infos = {session: resolver.info(dandiset_id, path) for session, path in paths.items()}
+
+    to_index = []
+    if index_dir is not None:
+        to_index = [s for s, info in infos.items() if not index_path(info["etag"], index_dir).exists()]
+    ready = [s for s in sessions if s not in to_index]
+
+    opening, yielded = {}, []
+    try:
+        with ProcessPoolExecutor(
+            max_workers=min(max_workers, len(to_index)) or 1,
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as processes, ThreadPoolExecutor(max_workers=max_workers) as threads:
+            building = {
+                processes.submit(build_index, infos[s]["s3_url"], infos[s]["etag"], index_dir): s
+                for s in to_index
+            }
+            opening.update({threads.submit(_open, infos[s], index_dir): s for s in ready})
+            try:
+                while building or opening:
+                    done, _ = wait([*building, *opening], return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future in building:
+                            # On failure, the open below retries the build and raises.
+                            session = building.pop(future)
+                            opening[threads.submit(_open, infos[session], index_dir)] = session
+                        else:
+                            session = opening.pop(future)
+                            nwbfile, io = future.result()
+                            yielded.append(io)
+                            yield session, nwbfile, io
+            except BaseException:
+                # Drop what has not started; leaving the pools waits for the rest.
+                for future in [*building, *opening]:
+                    future.cancel()
+                raise
+    except BaseException as error:
+        ios = [
+            future.result()[1] for future in opening
+            if not future.cancelled() and future.exception() is None
+        ]
+        if not isinstance(error, GeneratorExit):
+            ios += yielded
+        for io in ios:
+            io.close()
+        raise
 
 
 def load_nwb_local(directory_path, subject_id, session_id, description):
@@ -0,0 +1,87 @@
+"""Open remote NWB/HDF5 files through a cached LINDI reference index.
+
+`h5py.File(remfile.File(url))` walks the file's HDF5 B-trees over HTTP on
+every open: one small range request per metadata block, dominated by round
+trip latency. LINDI instead describes the whole file as a JSON reference file
+system (small attributes and arrays inlined, chunk locations as byte ranges
+into the original file), which `lindi.LindiH5pyFile` serves through the h5py
+API and pynwb reads as usual.
+
+`open_indexed` builds that index on the first open of a file and keeps it on
+disk, keyed by the file's ETag; later opens read the index locally and only
+fetch the data chunks they touch.
+
+This file is vendored unchanged next to each loader that needs it; keep the
+copies identical.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+from pathlib import Path
+
+import lindi
+
+INDEX_DIR = Path(
+    os.environ.get("DANDI_LINDI_INDEX_DIR", Path.home() / ".cache" / "dandi-lindi-index")
+)
+
+
+def index_path(etag: str, index_dir: str | Path = INDEX_DIR) -> Path:
+    return Path(index_dir) / f"{re.sub(r'[^A-Za-z0-9_-]', '_', etag)}.lindi.json"
+
+
+def open_indexed(url: str, etag: str, index_dir: str | Path = INDEX_DIR,
+                 local_cache_dir: str | None = None) -> lindi.LindiH5pyFile:
+    """Open the HDF5 file at `url` read-only through its cached LINDI index.
+
+    Parameters
+    ----------
+    url : str
+        URL of the HDF5 file. The index refers to it for chunk data, so it
+        should be stable (e.g. the S3 URL, not a presigned one).
+    etag : str
+        ETag of the file's content; a new upload gets a new index.
+    index_dir : str or Path
+        Directory holding the indexes.
+    local_cache_dir : str, optional
+        Directory for lindi's own cache of fetched chunks.
+
+    Returns
+    -------
+    file : lindi.LindiH5pyFile
+        h5py-compatible file, to pass to `pynwb.NWBHDF5IO(file=...)`
+    """
+    if not etag:
+        raise ValueError("open_indexed needs the file's ETag to key its index")
+    local_cache = lindi.LocalCache(cache_dir=local_cache_dir) if local_cache_dir else None
+    path = index_path(etag, index_dir)
+    if path.exists():
+        try:
+            return lindi.LindiH5pyFile.from_lindi_file(str(path), local_cache=local_cache)
+        except (OSError, ValueError, KeyError):
+            path.unlink(missing_ok=True)  # truncated or from an incompatible lindi
+    file = lindi.LindiH5pyFile.from_hdf5_file(url, local_cache=local_cache)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write-then-rename: concurrent first opens must not see a partial index.
+        tmp = path.with_name(f".{path.stem}.{os.getpid()}.lindi.json")
+        file.write_lindi_file(str(tmp))
+        tmp.replace(path)
+    except OSError:
+        pass  # read-only home: this open still works, just unindexed next time
+    return file
+
+
+def build_index(url: str, etag: str, index_dir: str | Path = INDEX_DIR) -> Path:
+    """Build the index of the file at `url` unless it exists; return its path.
+
+    h5py holds one global lock for every read, so indexes of several files
+    are only built concurrently from separate processes; this function
+    imports nothing but lindi, so it is cheap to run in one.
+    """
+    path = index_path(etag, index_dir)
+    if not path.exists():
+        open_indexed(url, etag, index_dir=index_dir).close()
+    return path